@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import time
+import random
+from pathlib import Path
+from models.replay_reader import ReplayReader, read_header_blocks
+from models.json_backends import available_backends
+
+# Пропускная способность JSON бэкендов на наборе реплеев.
+# Запуск: python benchmark_json_backends.py [файлы или папки с .mtreplay ...]
+# Без аргументов используется синтетический набор реплеев 7×7.
+
+REPEATS = 3
+SYNTHETIC_REPLAYS = 300
+
+
+def make_blocks(seed):
+    """JSON блоки синтетического реплея (metadata и results)"""
+    rnd = random.Random(seed)
+    vehicles = {}
+    stats = {}
+    for i in range(14):
+        vid = str(1000 + i)
+        vehicles[vid] = {'name': f'Игрок_{i}', 'vehicleType': 'ussr:R45_IS-7',
+                         'team': 1 if i < 7 else 2, 'clanAbbrev': 'CLAN'}
+        stats[vid] = [{'damageDealt': rnd.randint(0, 5000), 'health': rnd.randint(0, 1500),
+                       'kills': rnd.randint(0, 3), **{f'counter{k}': k for k in range(80)}}]
+
+    metadata = {'clientVersionFromXml': '1.0', 'playerName': 'Игрок_0',
+                'mapDisplayName': 'Прохоровка', 'dateTime': '01.01.2026 20:00:00',
+                'vehicles': vehicles}
+    results = {'arenaUniqueID': seed, 'personal': {str(k): {'credits': k} for k in range(200)},
+               'common': {'winnerTeam': 1}, 'vehicles': stats}
+    return [json.dumps(metadata, ensure_ascii=False).encode('utf-8'),
+            json.dumps([results, vehicles, {}], ensure_ascii=False).encode('utf-8')]
+
+
+def load_corpus(paths):
+    """Читает JSON блоки всех реплеев корпуса в память"""
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob('*.mtreplay')) if path.is_dir() else [path])
+
+    corpus = []
+    for file_path in files:
+        with open(file_path, 'rb') as f:
+            blocks, _ = read_header_blocks(f, os.fstat(f.fileno()).st_size)
+        if blocks:
+            corpus.append(blocks)
+        else:
+            print(f"⚠️ Заголовок не распознан, пропускаем: {file_path.name}")
+    return corpus
+
+
+if len(sys.argv) > 1:
+    corpus = load_corpus(sys.argv[1:])
+else:
+    corpus = [make_blocks(seed) for seed in range(SYNTHETIC_REPLAYS)]
+
+if not corpus:
+    print("❌ Нет реплеев для замера")
+    sys.exit(1)
+
+total_mb = sum(len(block) for blocks in corpus for block in blocks) / 1048576
+print(f"📚 Реплеев: {len(corpus)}, JSON: {total_mb:.1f} МБ")
+print(f"{'Бэкенд':<10} {'Реплеев/с':>12} {'МБ/с':>10}")
+print("-" * 34)
+
+for backend in available_backends():
+    reader = ReplayReader(json_backend=backend)
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for blocks in corpus:
+            reader.decode_blocks(blocks)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{backend:<10} {len(corpus) / best:>12.0f} {total_mb / best:>10.1f}")
@@ -0,0 +1,120 @@
+import sys
+import json
+import time
+import random
+from pathlib import Path
+from models.replay_reader import (
+    locate_json_blocks, locate_json_blocks_numpy, np
+)
+
+# Сравнение стратегий резервного поиска JSON блоков на файлах
+# с нераспознанным заголовком.
+# Запуск: python benchmark_replay_reader.py [файлы.mtreplay ...]
+# Без аргументов используются синтетические реплеи на несколько МБ.
+
+REPEATS = 3
+# Старый перебор квадратичен на мусоре - большие файлы ему не даём
+LEGACY_MAX_BYTES = 8 * 1024 * 1024
+
+
+def legacy_scan(data):
+    """Старый перебор байтов из extract_json_from_replay"""
+    metadata = None
+    results = None
+    pos = 0
+
+    while pos < len(data) - 1000 and (not metadata or not results):
+        if data[pos] == ord('{'):
+            end, depth, in_str, esc = pos, 0, False, False
+            while end < len(data):
+                b = data[end]
+                if not in_str:
+                    if b == ord('{'): depth += 1
+                    elif b == ord('}'):
+                        depth -= 1
+                        if depth == 0: break
+                elif b == ord('"') and not esc: in_str = not in_str
+                if b == ord('\\') and not esc: esc = True
+                else: esc = False
+                end += 1
+
+            if depth == 0:
+                try:
+                    j = json.loads(data[pos:end+1].decode('utf-8', errors='ignore'))
+                    if 'clientVersionFromXml' in j:
+                        metadata = j
+                    if 'vehicles' in j and 'personal' in j and 'common' in j:
+                        results = j
+                except:
+                    pass
+        pos += 1
+
+    return metadata, results, None if metadata and results else 'not_found'
+
+
+def make_replay(stream_mb, garbage_kb=0, seed=0):
+    """Синтетический реплей 7×7 с неизвестной сигнатурой и потоком пакетов"""
+    rnd = random.Random(seed)
+    vehicles = {}
+    stats = {}
+    for i in range(14):
+        vid = str(1000 + i)
+        vehicles[vid] = {'name': f'Игрок_{i}', 'vehicleType': 'ussr:R45_IS-7',
+                         'team': 1 if i < 7 else 2, 'clanAbbrev': 'CLAN'}
+        stats[vid] = [{'damageDealt': rnd.randint(0, 5000), 'health': 0, 'kills': 1,
+                       **{f'counter{k}': k for k in range(40)}}]
+
+    metadata = {'clientVersionFromXml': '1.0', 'playerName': 'Игрок_0',
+                'mapDisplayName': 'Прохоровка', 'dateTime': '01.01.2026 20:00:00',
+                'vehicles': vehicles}
+    results = {'arenaUniqueID': 1, 'personal': {'avatar': {}},
+               'common': {'winnerTeam': 1}, 'vehicles': stats}
+
+    garbage = rnd.getrandbits(garbage_kb * 8192).to_bytes(garbage_kb * 1024, 'little')
+    stream = rnd.getrandbits(64 * 8192).to_bytes(64 * 1024, 'little') * (stream_mb * 16)
+    return (b'\xde\xad\xbe\xef' + garbage
+            + json.dumps(metadata, ensure_ascii=False).encode('utf-8')
+            + json.dumps([results, vehicles, {}], ensure_ascii=False).encode('utf-8')
+            + stream)
+
+
+def measure(locate, data, repeats=REPEATS):
+    """Лучшее время из нескольких запусков"""
+    best = None
+    found = False
+    for _ in range(repeats):
+        start = time.perf_counter()
+        metadata, results, _ = locate(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        found = bool(metadata and results)
+    return best, found
+
+
+strategies = [('python', legacy_scan), ('linear', locate_json_blocks)]
+if np is not None:
+    strategies.append(('numpy', locate_json_blocks_numpy))
+else:
+    print("⚠️ numpy не установлен, стратегия 'numpy' пропущена")
+
+if len(sys.argv) > 1:
+    samples = [(Path(p).name, Path(p).read_bytes()[8:]) for p in sys.argv[1:]]
+else:
+    samples = [
+        ('5 МБ, блоки в начале', make_replay(5)),
+        ('5 МБ, 8 КБ мусора перед блоками', make_replay(5, garbage_kb=8)),
+        ('20 МБ, 1 МБ мусора перед блоками', make_replay(20, garbage_kb=1024)),
+    ]
+
+print(f"{'Файл':<40} {'Стратегия':<10} {'Время, мс':>10}  Найдено")
+print("-" * 72)
+for name, data in samples:
+    for strategy, locate in strategies:
+        if locate is legacy_scan:
+            if len(data) > LEGACY_MAX_BYTES:
+                print(f"{name:<40} {strategy:<10} {'пропуск':>10}")
+                continue
+            elapsed, found = measure(locate, data, repeats=1)
+        else:
+            elapsed, found = measure(locate, data)
+        print(f"{name:<40} {strategy:<10} {elapsed * 1000:>10.1f}  {'✅' if found else '❌'}")
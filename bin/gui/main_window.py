@@ -1,5 +1,6 @@
 import sys
 import os
+import csv
 from pathlib import Path
 from datetime import datetime
 from PyQt6.QtWidgets import (
@@ -7,31 +8,64 @@ from PyQt6.QtWidgets import (
     QPushButton, QLabel, QTableWidget, QTableWidgetItem,
     QHeaderView, QLineEdit, QFileDialog,
     QMessageBox, QStatusBar, QMenuBar, QMenu, QFrame,
-    QButtonGroup, QRadioButton, QApplication
+    QButtonGroup, QRadioButton, QApplication, QDialog, QComboBox
 )
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QSettings
 from PyQt6.QtGui import QAction, QFont
-from PyQt6.QtGui import QAction, QFont, QColor
+from PyQt6.QtGui import QAction, QFont, QColor, QActionGroup
 import qdarkstyle
 
 # Добавляем путь к родительской папке для импорта моделей
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from models.analyzer import BattleMatrixAnalyzer
 from models.analyzer_random import RandomBattleAnalyzer
+from models.json_backends import JSON_BACKENDS, available_backends
+from models.ingest import DEFAULT_WORKERS
+from models.replay_cache import ReplayCache
+from models.replay_reader import FAILURE_REASONS
+from models.battle_store import BattleStore
+from models.battle_index import WIN, LOSS
+from models.snapshot import save_snapshot, load_snapshot, default_session_path
+from models.schemas import PlayerTotals
 from utils.file_dialog import select_files_gui
-from utils.clan_extractor import ClanExtractor  # Добавляем импорт для кланов
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, json_backend=None, workers=None):
         super().__init__()
         self.abs_analyzer = None
         self.random_analyzer = None
         self.current_mode = "abs"  # "abs" или "random"
         self.current_abs_data = []  # Сохраняем текущие данные АБС режима для сброса
-        self.battle_clans = []  # Список кланов для каждого боя
+        self.abs_filter = {}  # Фильтр боев АБС режима: атрибут -> значение (см. BattleBitmaps)
+        
+        # Настройки сохраняются между запусками
+        self.settings = QSettings("AleXNocS", "MirTankovABSReplayAnalyzer")
+        # JSON декодер: аргумент командной строки важнее сохраненной настройки
+        self.json_backend = json_backend or self.settings.value("json_backend", "auto")
+        if self.json_backend not in JSON_BACKENDS:
+            self.json_backend = "auto"
+        # Процессов для разбора реплеев: 0 - по числу ядер, 1 - последовательно
+        if workers is None:
+            workers = self.settings.value("workers", DEFAULT_WORKERS, type=int)
+        self.workers = max(0, workers)
+        
+        # Кэш разобранных реплеев между запусками
+        self.last_files = []  # Файлы последнего анализа - для перестроения кэша
+        self.replay_cache = None
+        if self.settings.value("use_cache", True, type=bool):
+            self.open_cache()
+        
+        # Архив АБС боев в SQLite (по умолчанию выключен)
+        self.battle_store = None
+        if self.settings.value("use_store", False, type=bool):
+            self.open_store()
+        
+        # Снимок анализа сохраняется при закрытии и открывается при следующем запуске
+        self.session_path = default_session_path()
         
         self.init_ui()
         self.apply_dark_theme()
+        self.offer_last_session()
         
     def init_ui(self):
         """Инициализация интерфейса"""
@@ -111,6 +145,33 @@ class MainWindow(QMainWindow):
         self.reset_search_btn.setEnabled(False)
         control_layout.addWidget(self.reset_search_btn)
         
+        # Фильтр боев: карта, исход, клан соперника, месяц (через AND)
+        self.filter_frame = QFrame()
+        filter_layout = QHBoxLayout(self.filter_frame)
+        filter_layout.setContentsMargins(0, 0, 0, 0)
+        
+        filter_label = QLabel("🔎 Бои:")
+        filter_label.setFont(QFont("Arial", 10))
+        filter_layout.addWidget(filter_label)
+        
+        self.filter_combos = {}
+        for attribute, all_text in (('map', "Все карты"), ('result', "Все исходы"),
+                                    ('clan', "Все кланы"), ('month', "Все месяцы")):
+            combo = QComboBox()
+            combo.addItem(all_text, None)
+            combo.setMinimumWidth(120)
+            combo.currentIndexChanged.connect(self.apply_abs_filter)
+            filter_layout.addWidget(combo)
+            self.filter_combos[attribute] = combo
+        
+        self.reset_filter_btn = QPushButton("✖ Сбросить фильтр")
+        self.reset_filter_btn.setFont(QFont("Arial", 10))
+        self.reset_filter_btn.clicked.connect(self.reset_abs_filter)
+        filter_layout.addWidget(self.reset_filter_btn)
+        
+        self.filter_frame.setEnabled(False)
+        control_layout.addWidget(self.filter_frame)
+        
         control_layout.addStretch()
         
         main_layout.addLayout(control_layout)
@@ -142,6 +203,21 @@ class MainWindow(QMainWindow):
         self.select_btn.clicked.connect(self.select_files)
         button_layout.addWidget(self.select_btn)
         
+        self.add_btn = QPushButton("➕ Добавить реплеи")
+        self.add_btn.setFont(QFont("Arial", 11, QFont.Weight.Bold))
+        self.add_btn.setFixedHeight(40)
+        self.add_btn.setToolTip("Добавить новые реплеи к текущему анализу - уже учтенные файлы не разбираются")
+        self.add_btn.clicked.connect(self.add_replays)
+        self.add_btn.setEnabled(False)
+        button_layout.addWidget(self.add_btn)
+        
+        self.last_session_btn = QPushButton("🕘 Открыть последнюю сессию")
+        self.last_session_btn.setFont(QFont("Arial", 11, QFont.Weight.Bold))
+        self.last_session_btn.setFixedHeight(40)
+        self.last_session_btn.clicked.connect(self.open_last_session)
+        self.last_session_btn.hide()
+        button_layout.addWidget(self.last_session_btn)
+        
         self.save_btn = QPushButton("💾 Сохранить в CSV")
         self.save_btn.setFont(QFont("Arial", 11, QFont.Weight.Bold))
         self.save_btn.setFixedHeight(40)
@@ -173,6 +249,24 @@ class MainWindow(QMainWindow):
         select_action.triggered.connect(self.select_files)
         file_menu.addAction(select_action)
         
+        add_action = QAction("➕ Добавить реплеи", self)
+        add_action.triggered.connect(self.add_replays)
+        file_menu.addAction(add_action)
+        
+        file_menu.addSeparator()
+        
+        last_session_action = QAction("🕘 Открыть последнюю сессию", self)
+        last_session_action.triggered.connect(self.open_last_session)
+        file_menu.addAction(last_session_action)
+        
+        open_session_action = QAction("📂 Открыть сессию...", self)
+        open_session_action.triggered.connect(self.open_session_dialog)
+        file_menu.addAction(open_session_action)
+        
+        save_session_action = QAction("💾 Сохранить сессию...", self)
+        save_session_action.triggered.connect(self.save_session_dialog)
+        file_menu.addAction(save_session_action)
+        
         file_menu.addSeparator()
         
         exit_action = QAction("🚪 Выход", self)
@@ -190,6 +284,70 @@ class MainWindow(QMainWindow):
         random_action.triggered.connect(lambda: self.set_mode("random"))
         mode_menu.addAction(random_action)
         
+        # Меню Настройки
+        settings_menu = menubar.addMenu("Настройки")
+        
+        backend_menu = settings_menu.addMenu("🧩 JSON декодер")
+        backend_group = QActionGroup(self)
+        installed = available_backends()
+        for backend in JSON_BACKENDS:
+            title = "Автоматически" if backend == "auto" else backend
+            backend_action = QAction(title, self)
+            backend_action.setCheckable(True)
+            backend_action.setChecked(backend == self.json_backend)
+            backend_action.setEnabled(backend == "auto" or backend in installed)
+            backend_action.triggered.connect(lambda checked, b=backend: self.set_json_backend(b))
+            backend_group.addAction(backend_action)
+            backend_menu.addAction(backend_action)
+        
+        workers_menu = settings_menu.addMenu("⚙️ Процессы разбора")
+        workers_group = QActionGroup(self)
+        cpu_count = os.cpu_count() or 1
+        choices = [0, 1] + [n for n in (2, 4, 8, 16, 32) if n <= cpu_count]
+        if self.workers not in choices:
+            choices.append(self.workers)
+        for workers in choices:
+            if workers == 0:
+                title = f"Автоматически ({cpu_count})"
+            elif workers == 1:
+                title = "1 (последовательно)"
+            else:
+                title = str(workers)
+            workers_action = QAction(title, self)
+            workers_action.setCheckable(True)
+            workers_action.setChecked(workers == self.workers)
+            workers_action.triggered.connect(lambda checked, w=workers: self.set_workers(w))
+            workers_group.addAction(workers_action)
+            workers_menu.addAction(workers_action)
+        
+        settings_menu.addSeparator()
+        
+        self.cache_action = QAction("💾 Кэш реплеев", self)
+        self.cache_action.setCheckable(True)
+        self.cache_action.setChecked(self.replay_cache is not None)
+        self.cache_action.triggered.connect(self.set_use_cache)
+        settings_menu.addAction(self.cache_action)
+        
+        rebuild_cache_action = QAction("🧹 Перестроить кэш", self)
+        rebuild_cache_action.triggered.connect(self.rebuild_cache)
+        settings_menu.addAction(rebuild_cache_action)
+        
+        quarantine_action = QAction("🚫 Карантин нечитаемых реплеев...", self)
+        quarantine_action.triggered.connect(self.show_quarantine)
+        settings_menu.addAction(quarantine_action)
+        
+        settings_menu.addSeparator()
+        
+        self.store_action = QAction("🗄️ Архив боев (SQLite)", self)
+        self.store_action.setCheckable(True)
+        self.store_action.setChecked(self.battle_store is not None)
+        self.store_action.triggered.connect(self.set_use_store)
+        settings_menu.addAction(self.store_action)
+        
+        store_totals_action = QAction("📊 Итоги по архиву...", self)
+        store_totals_action.triggered.connect(self.show_store_totals)
+        settings_menu.addAction(store_totals_action)
+        
         # Меню Помощь
         help_menu = menubar.addMenu("Помощь")
         
@@ -218,6 +376,272 @@ class MainWindow(QMainWindow):
         else:
             self.random_radio.setChecked(True)
     
+    def set_json_backend(self, backend):
+        """Выбирает JSON декодер для следующего анализа"""
+        self.json_backend = backend
+        self.settings.setValue("json_backend", backend)
+        self.status_bar.showMessage(f"🧩 JSON декодер: {backend}")
+    
+    def set_workers(self, workers):
+        """Выбирает количество процессов для разбора реплеев"""
+        self.workers = workers
+        self.settings.setValue("workers", workers)
+        self.status_bar.showMessage(f"⚙️ Процессы разбора: {workers or 'по числу ядер'}")
+    
+    def open_cache(self):
+        """Открывает кэш реплеев и удаляет из него устаревшие записи"""
+        try:
+            self.replay_cache = ReplayCache()
+            self.replay_cache.evict()
+            print(f"💾 Кэш реплеев: {self.replay_cache.count()} записей ({self.replay_cache.path})")
+        except Exception as e:
+            print(f"⚠️ Не удалось открыть кэш реплеев: {e}")
+            self.replay_cache = None
+    
+    def set_use_cache(self, enabled):
+        """Включает или выключает кэш реплеев"""
+        self.settings.setValue("use_cache", enabled)
+        if enabled and not self.replay_cache:
+            self.open_cache()
+        elif not enabled and self.replay_cache:
+            self.replay_cache.close()
+            self.replay_cache = None
+        self.cache_action.setChecked(self.replay_cache is not None)
+        self.status_bar.showMessage("💾 Кэш реплеев включен" if self.replay_cache else "💾 Кэш реплеев выключен")
+    
+    def open_store(self):
+        """Открывает архив боев, в который АБС анализ добавляет учтенные бои"""
+        try:
+            self.battle_store = BattleStore()
+            print(f"🗄️ Архив боев: {self.battle_store.count()} боев ({self.battle_store.path})")
+        except Exception as e:
+            print(f"⚠️ Не удалось открыть архив боев: {e}")
+            self.battle_store = None
+    
+    def set_use_store(self, enabled):
+        """Включает или выключает пополнение архива боев"""
+        self.settings.setValue("use_store", enabled)
+        if enabled and not self.battle_store:
+            self.open_store()
+        elif not enabled and self.battle_store:
+            self.battle_store.close()
+            self.battle_store = None
+        if self.abs_analyzer:
+            self.abs_analyzer.store = self.battle_store
+        self.store_action.setChecked(self.battle_store is not None)
+        self.status_bar.showMessage("🗄️ Архив боев включен" if self.battle_store else "🗄️ Архив боев выключен")
+    
+    def rebuild_cache(self):
+        """Очищает кэш и заново разбирает файлы последнего анализа"""
+        if not self.replay_cache:
+            QMessageBox.information(self, "Кэш реплеев", "Кэш реплеев выключен в настройках")
+            return
+        
+        self.replay_cache.clear()
+        if self.last_files:
+            self.analyze_files(self.last_files)
+        else:
+            self.status_bar.showMessage("🧹 Кэш очищен, он заполнится при следующем анализе")
+    
+    def show_quarantine(self):
+        """Показывает файлы в карантине с возможностью экспорта и повторного разбора"""
+        if not self.replay_cache:
+            QMessageBox.information(self, "Карантин", "Кэш реплеев выключен в настройках")
+            return
+        
+        rows = self.replay_cache.quarantined_files()
+        
+        dialog = QDialog(self)
+        dialog.setWindowTitle(f"🚫 Карантин: {len(rows)} файлов")
+        dialog.setMinimumSize(900, 500)
+        layout = QVBoxLayout(dialog)
+        
+        table = QTableWidget(len(rows), 3)
+        table.setHorizontalHeaderLabels(["Файл", "Причина", "Дата ошибки"])
+        table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        for i, (path, reason, failed_at) in enumerate(rows):
+            table.setItem(i, 0, QTableWidgetItem(path))
+            table.setItem(i, 1, QTableWidgetItem(FAILURE_REASONS.get(reason, reason)))
+            table.setItem(i, 2, QTableWidgetItem(datetime.fromtimestamp(failed_at).strftime('%d.%m.%Y %H:%M')))
+        layout.addWidget(table)
+        
+        buttons = QHBoxLayout()
+        export_btn = QPushButton("💾 Экспорт CSV")
+        export_btn.clicked.connect(lambda: self.export_quarantine(rows))
+        export_btn.setEnabled(bool(rows))
+        buttons.addWidget(export_btn)
+        
+        retry_btn = QPushButton("🔄 Разобрать заново")
+        retry_btn.setToolTip("Снять карантин со всех файлов, например после обновления клиента")
+        retry_btn.clicked.connect(lambda: (dialog.accept(), self.retry_quarantine()))
+        retry_btn.setEnabled(bool(rows))
+        buttons.addWidget(retry_btn)
+        
+        buttons.addStretch()
+        close_btn = QPushButton("Закрыть")
+        close_btn.clicked.connect(dialog.reject)
+        buttons.addWidget(close_btn)
+        layout.addLayout(buttons)
+        
+        dialog.exec()
+    
+    def show_store_totals(self):
+        """Итоги игроков по всем боям архива (за все сессии) с выбором карты"""
+        if not self.battle_store:
+            QMessageBox.information(self, "Архив боев", "Архив боев выключен в настройках")
+            return
+        
+        dialog = QDialog(self)
+        dialog.setWindowTitle(f"📊 Архив: {self.battle_store.count()} боев")
+        dialog.setMinimumSize(800, 500)
+        layout = QVBoxLayout(dialog)
+        
+        map_combo = QComboBox()
+        map_combo.addItem("Все карты", None)
+        for map_name in self.battle_store.maps():
+            map_combo.addItem(map_name, map_name)
+        layout.addWidget(map_combo)
+        
+        headers = ["Игрок", "Боёв", "Ср.урон", "Фраги", "Выживаемость %", "Победы %"]
+        table = QTableWidget(0, len(headers))
+        table.setHorizontalHeaderLabels(headers)
+        table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        table.horizontalHeader().setSortIndicator(0, Qt.SortOrder.AscendingOrder)
+        table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        layout.addWidget(table)
+        
+        def fill():
+            rows = self.battle_store.player_totals(map=map_combo.currentData())
+            table.setSortingEnabled(False)
+            table.setRowCount(len(rows))
+            for i, (name, *values) in enumerate(rows):
+                totals = PlayerTotals(*values)
+                cells = [totals.battles, totals.avg_damage, totals.kills,
+                         round(totals.survival_rate, 1), round(totals.win_rate, 1)]
+                table.setItem(i, 0, QTableWidgetItem(name))
+                for j, value in enumerate(cells, 1):
+                    item = QTableWidgetItem()
+                    item.setData(Qt.ItemDataRole.DisplayRole, value)
+                    table.setItem(i, j, item)
+            table.setSortingEnabled(True)
+        
+        map_combo.currentIndexChanged.connect(fill)
+        fill()
+        
+        close_btn = QPushButton("Закрыть")
+        close_btn.clicked.connect(dialog.reject)
+        layout.addWidget(close_btn, alignment=Qt.AlignmentFlag.AlignRight)
+        
+        dialog.exec()
+    
+    def export_quarantine(self, rows):
+        """Сохраняет список файлов в карантине в CSV"""
+        file_path, _ = QFileDialog.getSaveFileName(
+            self,
+            "Сохранить список карантина",
+            f"quarantine_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+            "CSV files (*.csv);;All files (*.*)"
+        )
+        if not file_path:
+            return
+        
+        with open(file_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["Файл", "Причина", "Дата ошибки"])
+            for path, reason, failed_at in rows:
+                writer.writerow([path, reason, datetime.fromtimestamp(failed_at).isoformat(' ', 'seconds')])
+        self.status_bar.showMessage(f"✅ Список карантина сохранен: {file_path}")
+    
+    def retry_quarantine(self):
+        """Снимает карантин и заново анализирует файлы последнего анализа"""
+        released = self.replay_cache.release_quarantine()
+        if self.last_files:
+            self.analyze_files(self.last_files)
+        else:
+            self.status_bar.showMessage(f"🔄 Снят карантин с файлов: {released}")
+    
+    def offer_last_session(self):
+        """Показывает кнопку открытия последней сессии, если она сохранена"""
+        if not self.session_path.exists():
+            return
+        saved_at = datetime.fromtimestamp(self.session_path.stat().st_mtime)
+        self.last_session_btn.setToolTip(f"Сессия от {saved_at:%d.%m.%Y %H:%M}")
+        self.last_session_btn.show()
+        self.status_bar.showMessage(f"🕘 Есть сохраненная сессия от {saved_at:%d.%m.%Y %H:%M}")
+    
+    def save_session(self, path):
+        """Сохраняет анализаторы обоих режимов в снимок"""
+        if not self.abs_analyzer and not self.random_analyzer:
+            return False
+        try:
+            save_snapshot(path, {
+                'mode': self.current_mode,
+                'abs': self.abs_analyzer,
+                'random': self.random_analyzer,
+                'files': self.last_files,
+            })
+            return True
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить сессию: {e}")
+            return False
+    
+    def open_session(self, path):
+        """Восстанавливает анализ из снимка без повторного разбора реплеев"""
+        state = load_snapshot(path)
+        if not state:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось открыть сессию:\n{path}")
+            return False
+        
+        self.abs_analyzer = state.get('abs')
+        self.random_analyzer = state.get('random')
+        self.last_files = state.get('files', [])
+        # Кэш и число процессов - текущие, а не на момент сохранения
+        for analyzer in (self.abs_analyzer, self.random_analyzer):
+            if analyzer:
+                analyzer.cache = self.replay_cache
+                analyzer.workers = self.workers
+        if self.abs_analyzer:
+            self.abs_analyzer.store = self.battle_store
+        
+        self.last_session_btn.hide()
+        self.save_btn.setEnabled(True)
+        mode = state.get('mode', 'abs')
+        if mode != self.current_mode:
+            self.set_mode(mode)
+        else:
+            self.change_mode()
+        self.status_bar.showMessage(f"📂 Сессия открыта: {path}")
+        return True
+    
+    def open_last_session(self):
+        self.open_session(self.session_path)
+    
+    def open_session_dialog(self):
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Открыть сессию", str(self.session_path.parent),
+            "Сессии (*.snapshot);;All files (*.*)"
+        )
+        if file_path:
+            self.open_session(file_path)
+    
+    def save_session_dialog(self):
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, "Сохранить сессию",
+            f"session_{datetime.now().strftime('%Y%m%d_%H%M')}.snapshot",
+            "Сессии (*.snapshot);;All files (*.*)"
+        )
+        if file_path and self.save_session(file_path):
+            self.status_bar.showMessage(f"✅ Сессия сохранена: {file_path}")
+    
+    def closeEvent(self, event):
+        self.save_session(self.session_path)
+        if self.replay_cache:
+            self.replay_cache.close()
+        if self.battle_store:
+            self.battle_store.close()
+        super().closeEvent(event)
+    
     def change_mode(self):
         """Обрабатывает изменение режима"""
         if self.abs_radio.isChecked():
@@ -226,12 +650,17 @@ class MainWindow(QMainWindow):
             # Показываем поиск и кнопку сброса
             self.search_input.show()
             self.reset_search_btn.show()
+            self.filter_frame.show()
         else:
             self.current_mode = "random"
             self.status_bar.showMessage("Режим: Случайные (только вы)")
             # Скрываем поиск и кнопку сброса (в случайном режиме они не нужны)
             self.search_input.hide()
             self.reset_search_btn.hide()
+            self.filter_frame.hide()
+        
+        # Добавлять реплеи можно к уже выполненному анализу этого режима
+        self.add_btn.setEnabled(bool(self.current_analyzer()))
         
         # Если уже есть данные, обновляем таблицу
         if self.current_mode == "abs" and self.abs_analyzer:
@@ -244,8 +673,62 @@ class MainWindow(QMainWindow):
         if not self.abs_analyzer:
             return
         
-        headers, data, total_battles = self.abs_analyzer.get_table_data()
+        self.update_filter_options()
+        battles = self.filtered_battles()
+        headers, data, total_battles = self.abs_analyzer.get_table_data(battles)
         self.current_abs_data = data.copy()
+        self.update_abs_info()
+        
+        # Заполняем таблицу с новыми заголовками
+        self.populate_table_abs(headers, data, battles)
+        self.reset_search_btn.setEnabled(True)
+    
+    def filtered_battles(self):
+        """Бои по фильтру АБС режима (битовые индексы анализатора) или None без фильтра"""
+        if not self.abs_filter:
+            return None
+        return self.abs_analyzer.select_battles(**self.abs_filter)
+    
+    def update_filter_options(self):
+        """Заполняет списки фильтра значениями из боев, сохраняя выбор"""
+        bitmaps = self.abs_analyzer.bitmaps
+        labels = {WIN: "🏆 Победы", LOSS: "💔 Поражения"}
+        self.filter_frame.setEnabled(True)
+        for attribute, combo in self.filter_combos.items():
+            current = combo.currentData()
+            combo.blockSignals(True)
+            while combo.count() > 1:
+                combo.removeItem(1)
+            for value in bitmaps.values(attribute):
+                combo.addItem(labels.get(value, value), value)
+            index = combo.findData(current) if current is not None else 0
+            combo.setCurrentIndex(max(index, 0))
+            combo.blockSignals(False)
+        # Значения, которых нет в новых боях, из фильтра выпадают
+        self.abs_filter = {
+            attribute: combo.currentData()
+            for attribute, combo in self.filter_combos.items()
+            if combo.currentData() is not None
+        }
+    
+    def apply_abs_filter(self):
+        """Показывает только бои, подходящие под выбранные значения фильтра"""
+        if self.abs_analyzer and self.current_mode == "abs":
+            # display_abs_data берет фильтр из выбранных значений
+            self.display_abs_data()
+            if self.search_input.text():
+                self.filter_table(self.search_input.text())
+    
+    def reset_abs_filter(self):
+        for combo in self.filter_combos.values():
+            combo.blockSignals(True)
+            combo.setCurrentIndex(0)
+            combo.blockSignals(False)
+        self.apply_abs_filter()
+    
+    def update_abs_info(self):
+        """Строка с итогами АБС режима над таблицей"""
+        total_battles = len(self.abs_analyzer.battles)
         self.total_battles = total_battles
         total_wins = self.abs_analyzer.total_wins
         
@@ -254,10 +737,9 @@ class MainWindow(QMainWindow):
         # Подсчитываем статистику по кланам
         clan_stats = {'clan': 0, 'mixed': 0, 'none': 0}
         for battle in self.abs_analyzer.battles:
-            clan_info = battle.get('clan_info', {})
-            if not clan_info.get('clan') or clan_info.get('clan') == '?':
+            if not battle.clan or battle.clan == '?':
                 clan_stats['none'] += 1
-            elif clan_info.get('is_mixed'):
+            elif battle.clan_is_mixed:
                 clan_stats['mixed'] += 1
             else:
                 clan_stats['clan'] += 1
@@ -269,18 +751,23 @@ class MainWindow(QMainWindow):
         if self.abs_analyzer.skipped_battles > 0:
             info_text += f"  |  ⏭️ Пропущено: {self.abs_analyzer.skipped_battles}"
         
-        self.info_label.setText(info_text)
+        if self.abs_filter:
+            info_text += f"  |  🔎 По фильтру: {len(self.filtered_battles())}"
         
-        # Заполняем таблицу с новыми заголовками
-        self.populate_table_abs(headers, data)
-        self.reset_search_btn.setEnabled(True)
+        self.info_label.setText(info_text)
     
     def display_random_data(self):
         """Отображает данные случайного режима"""
         if not self.random_analyzer:
             return
         
-        headers, data, total_battles, total_damage = self.random_analyzer.get_table_data()
+        headers, data, _, _ = self.random_analyzer.get_table_data()
+        self.update_random_info()
+        self.populate_table_random(headers, data)
+    
+    def update_random_info(self):
+        """Строка с итогами случайного режима над таблицей"""
+        total_battles = len(self.random_analyzer.player_stats)
         stats = self.random_analyzer.get_summary_stats()
         
         self.info_label.setText(
@@ -289,8 +776,30 @@ class MainWindow(QMainWindow):
             f"📊 Средний урон: {stats['avg_damage']}  |  "
             f"🏆 Побед: {stats['total_wins']} ({stats['win_rate']}%)"
         )
+    
+    def update_table_random(self, added):
+        """Вставляет строки новых боев на их места по времени, остальные строки не трогает"""
+        header = self.table.horizontalHeader()
+        section, order = header.sortIndicatorSection(), header.sortIndicatorOrder()
+        if 0 <= section < self.table.columnCount():
+            # Таблица отсортирована по столбцу - места по времени уже не совпадают
+            # со строками, поэтому заполняем ее в порядке времени и сортируем так же
+            headers, data, _, _ = self.random_analyzer.get_table_data()
+            self.populate_table_random(headers, data)
+            self.table.sortByColumn(section, order)
+            return
         
-        self.populate_table_random(headers, data)
+        added_ids = set(map(id, added))
+        self.table.setSortingEnabled(False)
+        for position, battle in enumerate(self.random_analyzer.player_stats):
+            if id(battle) not in added_ids:
+                continue
+            self.table.insertRow(position)
+            for col, value in enumerate(self.random_analyzer.get_row_data(battle)):
+                item = QTableWidgetItem(str(value))
+                item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+                self.table.setItem(position, col, item)
+        self.table.setSortingEnabled(True)
 
     def populate_table_random(self, headers, data):
         """Заполняет таблицу для случайного режима с подгонкой под заголовки"""
@@ -338,49 +847,171 @@ class MainWindow(QMainWindow):
         # Включаем сортировку
         self.table.setSortingEnabled(True)        
     
-    def populate_table_abs(self, headers, data):
-        """Заполняет таблицу для АБС режима с отображением времени, карты, клана и результата"""
-        self.table.clear()
-        self.table.setRowCount(len(data))
+    def battle_header(self, battle):
+        """Заголовок столбца боя: время, карта, результат и клан соперника"""
+        date_part = battle.date[:16]
+        map_part = battle.map
         
-        # Создаем новые заголовки (добавляем колонку с процентом выживания)
-        new_headers = ['Игрок', 'Ср.урон', 'Боёв', '% Выживания']
+        # Получаем информацию о клане
+        clan = battle.clan or '?'
         
-        for i, battle in enumerate(self.abs_analyzer.battles):
-            date_part = battle['date'][:16]
-            map_part = battle['map']
-            
-            # Получаем информацию о клане
-            clan_info = battle.get('clan_info', {})
-            clan = clan_info.get('clan', '?')
-            is_mixed = clan_info.get('is_mixed', False)
+        # Формируем отображение клана
+        if battle.clan_is_mixed:
+            clan_display = f"⚔️ {clan}"
+        else:
+            clan_display = f"🏷️ {clan}"
+        
+        # Эмодзи для результата
+        result_emoji = "🏆" if battle.is_win else "💔"
+        
+        # Создаем заголовок из четырех строк
+        return f"{date_part}\n{map_part} - {result_emoji}\n{clan_display}"
+    
+    def make_battle_item(self, value):
+        """Ячейка боя: словарь с техникой и статистикой или '-'"""
+        if value == '-':
+            display_text = '-'
+        else:
+            # Извлекаем танк, урон, здоровье и убийства из словаря
+            tank = value.get('vehicle', '')
+            damage = value.get('damage', 0)
+            health = value.get('health', 0)
+            kills = value.get('kills', 0)
             
-            # Формируем отображение клана
-            if is_mixed:
-                clan_display = f"⚔️ {clan}"
+            # Первая строка: статус + танк
+            if health > 0:
+                status_emoji = "✅"
             else:
-                clan_display = f"🏷️ {clan}"
+                status_emoji = "💀"
             
-            # Определяем результат боя
-            # Нам нужно знать, победил ли владелец в этом бою
-            # Для этого нужно найти ID владельца и его команду
-            owner_name = None
-            owner_team = None
-            winner_team = None
+            line1 = f"{status_emoji} {tank}"
             
-            # Получаем имя владельца из первого боя (оно одинаковое для всех)
-            if hasattr(self.abs_analyzer, 'battles') and len(self.abs_analyzer.battles) > 0:
-                # Здесь нужно получить информацию о победителе из данных боя
-                # Пока используем заглушку - будем брать из battle если есть
-                pass
-            
-            # Эмодзи для результата
-            is_win = battle.get('is_win', False)
-            result_emoji = "🏆" if is_win else "💔"
+            # Вторая строка: урон и убийства
+            if kills > 0:
+                line2 = f"{damage} 🔪{kills}"
+            else:
+                line2 = str(damage)
             
-            # Создаем заголовок из четырех строк
-            header_text = f"{date_part}\n{map_part} - {result_emoji}\n{clan_display}"
-            new_headers.append(header_text)
+            display_text = f"{line1}\n{line2}"
+        
+        item = QTableWidgetItem(display_text)
+        item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+        
+        # Добавляем тултип с полной информацией
+        if value != '-':
+            tooltip = f"Техника: {tank}\nУрон: {damage}\nЗдоровье: {health} HP\nУбийств: {kills}"
+            item.setToolTip(tooltip)
+        return item
+    
+    def make_survival_item(self, survived_battles, total_battles):
+        """Ячейка процента выживания с цветовой индикацией"""
+        # Рассчитываем процент выживания
+        survival_rate = (survived_battles / total_battles * 100) if total_battles > 0 else 0
+        
+        # Форматируем отображение
+        survival_text = f"{survival_rate:.1f}%"
+        survival_item = QTableWidgetItem(survival_text)
+        survival_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+        
+        # Добавляем цветовую индикацию
+        if survival_rate >= 70:
+            survival_item.setForeground(QColor("#4CAF50"))  # Зеленый для высокого выживания
+        elif survival_rate >= 40:
+            survival_item.setForeground(QColor("#FFC107"))  # Желтый для среднего
+        else:
+            survival_item.setForeground(QColor("#FF6B6B"))  # Красный для низкого
+        
+        # Добавляем тултип
+        survival_item.setToolTip(f"Выжил в {survived_battles} из {total_battles} боев")
+        return survival_item
+    
+    def set_player_summary(self, row, player_name, avg_damage, battles_count):
+        """Имя, средний урон и количество боев игрока (столбцы 0-2)"""
+        item = QTableWidgetItem(str(player_name))
+        item.setTextAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter)
+        self.table.setItem(row, 0, item)
+        
+        for col, value in ((1, avg_damage), (2, battles_count)):
+            item = QTableWidgetItem(str(value))
+            item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+            self.table.setItem(row, col, item)
+    
+    def update_table_abs(self, battle_ids):
+        """
+        Добавляет в таблицу новые бои: вставляет их столбцы на места по времени
+        и строки новых игроков, а итоги пересчитывает только у участников новых боев
+        """
+        analyzer = self.abs_analyzer
+        
+        # Строки таблицы по индексу игрока в анализаторе (имя могло смениться)
+        table_rows = {}
+        for row in range(self.table.rowCount()):
+            item = self.table.item(row, 0)
+            player_row = analyzer.get_player_row(item.text()) if item else None
+            if player_row is None:
+                continue
+            if player_row in table_rows:
+                # Строка игрока из старых реплеев без accountDBID слилась
+                # со строкой по accountDBID - таблица строится заново
+                self.display_abs_data()
+                return
+            table_rows[player_row] = row
+        
+        # Пока таблица отсортирована, вставленные ячейки переставляли бы строки
+        self.table.setSortingEnabled(False)
+        
+        new_ids = set(battle_ids)
+        positions = [i for i, battle in enumerate(analyzer.battles) if battle.id in new_ids]
+        for position in positions:
+            col = position + 4
+            self.table.insertColumn(col)
+            self.table.setHorizontalHeaderItem(col, QTableWidgetItem(self.battle_header(analyzer.battles[position])))
+            self.table.setColumnWidth(col, 120)
+        
+        # Новые игроки - в конец таблицы, в старых боях у них прочерки
+        for player_row in range(len(analyzer.players)):
+            if player_row in table_rows:
+                continue
+            row = self.table.rowCount()
+            self.table.insertRow(row)
+            self.table.setRowHeight(row, 50)
+            table_rows[player_row] = row
+            for col in range(4, self.table.columnCount()):
+                self.table.setItem(row, col, self.make_battle_item('-'))
+        
+        # Столбцы новых боев
+        affected = set()
+        for position in positions:
+            cells = analyzer.get_battle_cells(analyzer.battles[position].id)
+            affected.update(cells)
+            for player_row, row in table_rows.items():
+                self.table.setItem(row, position + 4, self.make_battle_item(cells.get(player_row, '-')))
+        
+        # Итоги участников новых боев - из накопленных в анализаторе
+        for player_row in affected:
+            row = table_rows[player_row]
+            totals = analyzer.matrix.row_totals(player_row)
+            self.set_player_summary(row, analyzer.players[player_row], totals.avg_damage, totals.battles)
+            self.table.setItem(row, 3, self.make_survival_item(totals.survived, totals.battles))
+        
+        self.table.setSortingEnabled(True)
+        
+        # Поиск по игрокам применяется и к новым строкам
+        if self.search_input.text():
+            self.filter_table(self.search_input.text())
+    
+    def populate_table_abs(self, headers, data, battles=None):
+        """
+        Заполняет таблицу для АБС режима с отображением времени, карты, клана и результата.
+        battles - бои по фильтру (None - все бои)
+        """
+        self.table.clear()
+        self.table.setRowCount(len(data))
+        
+        # Создаем новые заголовки (добавляем колонку с процентом выживания)
+        new_headers = ['Игрок', 'Ср.урон', 'Боёв', '% Выживания']
+        shown_battles = self.abs_analyzer.battles if battles is None else battles
+        new_headers.extend(self.battle_header(battle) for battle in shown_battles)
         
         self.table.setColumnCount(len(new_headers))
         self.table.setHorizontalHeaderLabels(new_headers)
@@ -392,137 +1023,22 @@ class MainWindow(QMainWindow):
         # Отключаем сортировку временно
         self.table.setSortingEnabled(False)
         
-        # Заполняем данные
+        # Заполняем данные: имя, средний урон, количество боев, затем бои
+        # (столбцы боев сдвинуты на один - в столбце 3 процент выживания)
         for row, row_data in enumerate(data):
-            player_name = row_data[0]  # Имя игрока из первого столбца
-            
-            # Считаем количество выживаний для игрока
-            total_battles = 0
-            survived_battles = 0
-            
-            for battle in self.abs_analyzer.battles:
-                battle_id = battle['id']
-                if player_name in self.abs_analyzer.battle_data[battle_id]:
-                    total_battles += 1
-                    if hasattr(self.abs_analyzer, 'battle_health'):
-                        health = self.abs_analyzer.battle_health.get(battle_id, {}).get(player_name, 0)
-                        if health > 0:
-                            survived_battles += 1
-            
-            # Рассчитываем процент выживания
-            survival_rate = (survived_battles / total_battles * 100) if total_battles > 0 else 0
-            
-            for col, value in enumerate(row_data):
-                if col == 0:  # Имя игрока
-                    item = QTableWidgetItem(str(value))
-                    item.setTextAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter)
-                    self.table.setItem(row, col, item)
-                
-                elif col == 1:  # Средний урон
-                    item = QTableWidgetItem(str(value))
-                    item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                    self.table.setItem(row, col, item)
-                
-                elif col == 2:  # Количество боев
-                    item = QTableWidgetItem(str(value))
-                    item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                    self.table.setItem(row, col, item)
-                
-                else:  # Столбцы с данными по боям (индекс 3 и дальше)
-                    # В цикле заполнения данных для col >= 3:
-                    # В цикле заполнения данных для col >= 3:
-                    battle_index = col - 3
-                    if battle_index < len(self.abs_analyzer.battles):
-                        battle = self.abs_analyzer.battles[battle_index]
-                        battle_id = battle['id']
-                        
-                        # Получаем здоровье, убийства игрока в этом бою
-                        health = 0
-                        kills = 0
-                        
-                        if hasattr(self.abs_analyzer, 'battle_health'):
-                            health = self.abs_analyzer.battle_health.get(battle_id, {}).get(player_name, 0)
-                        if hasattr(self.abs_analyzer, 'battle_kills'):
-                            kills = self.abs_analyzer.battle_kills.get(battle_id, {}).get(player_name, 0)
-                        
-                        # Проверяем тип value (может быть словарем или строкой '-')
-                        if value == '-':
-                            display_text = '-'
-                        else:
-                            # Извлекаем танк и урон из словаря
-                            tank = value.get('vehicle', '')
-                            damage = value.get('damage', 0)
-                            
-                            
-                            
-                            # Первая строка: статус + танк
-                            if health > 0:
-                                status_emoji = "✅"
-                            else:
-                                status_emoji = "💀"
-                            
-                            line1 = f"{status_emoji} {tank}"
-                            
-                            # Вторая строка: урон и убийства
-                            if kills > 0:
-                                line2 = f"{damage} 🔪{kills}"
-                            else:
-                                line2 = str(damage)
-                            
-                            display_text = f"{line1}\n{line2}"
-                        
-                        item = QTableWidgetItem(display_text)
-                        item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                        
-                        # Увеличиваем высоту строки для двухстрочного текста
-                        current_height = self.table.rowHeight(row)
-                        if current_height < 50:
-                            self.table.setRowHeight(row, 50)
-                        
-                        # Добавляем тултип с полной информацией
-                        if value != '-':
-                            tooltip = f"Техника: {tank}\nУрон: {damage}\nЗдоровье: {health} HP\nУбийств: {kills}"
-                            item.setToolTip(tooltip)
-                        
-                        self.table.setItem(row, col + 1, item)
+            self.set_player_summary(row, *row_data[:3])
+            for battle_index, value in enumerate(row_data[3:]):
+                self.table.setItem(row, battle_index + 4, self.make_battle_item(value))
+            if len(row_data) > 3:
+                # Увеличиваем высоту строки для двухстрочного текста
+                self.table.setRowHeight(row, 50)
         
         # Добавляем процент выживания в отдельную колонку (индекс 3)
+        survival_stats = self.abs_analyzer.get_survival_stats(battles)
         for row, row_data in enumerate(data):
-            player_name = row_data[0]
-            
-            # Считаем количество выживаний для игрока
-            total_battles = 0
-            survived_battles = 0
-            
-            for battle in self.abs_analyzer.battles:
-                battle_id = battle['id']
-                if player_name in self.abs_analyzer.battle_data[battle_id]:
-                    total_battles += 1
-                    if hasattr(self.abs_analyzer, 'battle_health'):
-                        health = self.abs_analyzer.battle_health.get(battle_id, {}).get(player_name, 0)
-                        if health > 0:
-                            survived_battles += 1
-            
-            # Рассчитываем процент выживания
-            survival_rate = (survived_battles / total_battles * 100) if total_battles > 0 else 0
-            
-            # Форматируем отображение
-            survival_text = f"{survival_rate:.1f}%"
-            survival_item = QTableWidgetItem(survival_text)
-            survival_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            
-            # Добавляем цветовую индикацию
-            if survival_rate >= 70:
-                survival_item.setForeground(QColor("#4CAF50"))  # Зеленый для высокого выживания
-            elif survival_rate >= 40:
-                survival_item.setForeground(QColor("#FFC107"))  # Желтый для среднего
-            else:
-                survival_item.setForeground(QColor("#FF6B6B"))  # Красный для низкого
-            
-            # Добавляем тултип
-            survival_item.setToolTip(f"Выжил в {survived_battles} из {total_battles} боев")
-            
-            self.table.setItem(row, 3, survival_item)
+            # Выживания игрока накоплены анализатором при добавлении боев
+            survived_battles, total_battles = survival_stats.get(row_data[0], (0, 0))
+            self.table.setItem(row, 3, self.make_survival_item(survived_battles, total_battles))
         
         # Подгоняем ширину столбцов
         self.table.resizeColumnsToContents()
@@ -578,11 +1094,12 @@ class MainWindow(QMainWindow):
         
         self.search_input.clear()
         
-        # Полностью перезаполняем таблицу исходными данными
+        # Полностью перезаполняем таблицу данными анализатора
+        # (после добавления реплеев сохраненные данные устарели)
         if self.current_abs_data is not None:
-            # Нужно получить свежие заголовки из анализатора
-            headers, _, _ = self.abs_analyzer.get_table_data()
-            self.populate_table_abs(headers, self.current_abs_data)
+            battles = self.filtered_battles()
+            headers, self.current_abs_data, _ = self.abs_analyzer.get_table_data(battles)
+            self.populate_table_abs(headers, self.current_abs_data, battles)
         
         self.filter_stats_label.clear()
         self.status_bar.showMessage("🔄 Поиск сброшен")
@@ -594,6 +1111,71 @@ class MainWindow(QMainWindow):
         if not files:
             return
         
+        self.analyze_files(files)
+    
+    def current_analyzer(self):
+        return self.abs_analyzer if self.current_mode == "abs" else self.random_analyzer
+    
+    def add_replays(self):
+        """Добавляет новые реплеи к текущему анализу без повторного разбора остальных"""
+        analyzer = self.current_analyzer()
+        if not analyzer:
+            self.select_files()
+            return
+        
+        files = select_files_gui()
+        if not files:
+            return
+        
+        self.add_btn.setEnabled(False)
+        self.add_btn.setText("⏳ Добавление...")
+        self.status_bar.showMessage(f"Добавление {len(files)} файлов...")
+        QApplication.processEvents()
+        
+        try:
+            added = analyzer.add_files(files)
+            # Для перестроения кэша нужны все файлы анализа
+            known = set(self.last_files)
+            self.last_files = self.last_files + [f for f in files if f not in known]
+            
+            if added:
+                if self.current_mode == "abs" and self.abs_filter:
+                    # Новые бои могут попасть под фильтр в любом месте - перестраиваем выборку
+                    self.display_abs_data()
+                elif self.current_mode == "abs":
+                    self.update_abs_info()
+                    self.update_filter_options()
+                    self.update_table_abs(added)
+                else:
+                    self.update_random_info()
+                    self.update_table_random(added)
+            
+            status_text = f"➕ Добавлено боев: {len(added)}"
+            if analyzer.failed_files:
+                status_text += f"  |  ⚠️ Не прочитано: {len(analyzer.failed_files)}"
+            self.status_bar.showMessage(status_text)
+        
+        except Exception as e:
+            QMessageBox.critical(
+                self,
+                "Критическая ошибка",
+                f"Произошла непредвиденная ошибка:\n\n{str(e)}\n\n"
+                "Пожалуйста, сообщите об этом разработчику."
+            )
+            self.status_bar.showMessage("❌ Критическая ошибка")
+            print(f"❌ Ошибка: {e}")
+            import traceback
+            traceback.print_exc()
+        
+        finally:
+            self.add_btn.setEnabled(True)
+            self.add_btn.setText("➕ Добавить реплеи")
+            QApplication.processEvents()
+    
+    def analyze_files(self, files):
+        """Анализирует файлы в текущем режиме и показывает результат"""
+        self.last_files = files
+        
         # Блокируем кнопку выбора во время анализа
         self.select_btn.setEnabled(False)
         self.select_btn.setText("⏳ Анализ...")
@@ -605,26 +1187,31 @@ class MainWindow(QMainWindow):
         try:
             if self.current_mode == "abs":
                 # АБС режим
-                self.abs_analyzer = BattleMatrixAnalyzer()
+                self.abs_analyzer = BattleMatrixAnalyzer(
+                    workers=self.workers, cache=self.replay_cache, store=self.battle_store,
+                    json_backend=self.json_backend)
                 
                 if self.abs_analyzer.process_files(files):
-                    # Добавляем информацию о кланах в заголовки
-                    self.add_clan_info_to_headers(files)
-                    
+                    # Информация о кланах уже собрана анализатором при разборе
                     self.display_abs_data()
                     self.save_btn.setEnabled(True)
+                    self.add_btn.setEnabled(True)
                     
                     # Показываем детальную статистику обработки
                     processed = self.abs_analyzer.processed_battles
                     skipped = self.abs_analyzer.skipped_battles
+                    duplicates = self.abs_analyzer.duplicate_battles
                     
-                    if skipped > 0:
+                    if skipped > 0 or duplicates > 0:
                         status_text = f"✅ АБС боев: {processed}  |  ⏭️ Пропущено случайных: {skipped}"
+                        if duplicates:
+                            status_text += f"  |  🔁 Повторов: {duplicates}"
                         QMessageBox.information(
                             self, 
                             "Информация", 
                             f"Обработано АБС боев: {processed}\n"
-                            f"Пропущено случайных боев (15×15): {skipped}\n\n"
+                            f"Пропущено случайных боев (15×15): {skipped}\n"
+                            f"Повторов одного боя (реплеи сокомандников): {duplicates}\n\n"
                             f"Всего файлов: {len(files)}"
                         )
                     else:
@@ -645,11 +1232,13 @@ class MainWindow(QMainWindow):
             
             else:
                 # Случайный режим
-                self.random_analyzer = RandomBattleAnalyzer()
+                self.random_analyzer = RandomBattleAnalyzer(
+                    workers=self.workers, cache=self.replay_cache, json_backend=self.json_backend)
                 
                 if self.random_analyzer.process_files(files):
                     self.display_random_data()
                     self.save_btn.setEnabled(True)
+                    self.add_btn.setEnabled(True)
                     
                     stats = self.random_analyzer.get_summary_stats()
                     status_text = (
@@ -689,58 +1278,6 @@ class MainWindow(QMainWindow):
             self.select_btn.setText("📂 Выбрать файлы")
             QApplication.processEvents()
     
-    def add_clan_info_to_headers(self, files):
-        """
-        Добавляет информацию о кланах и результате в заголовки таблицы
-        """
-        if not self.abs_analyzer or not self.abs_analyzer.battles:
-            return
-        
-        self.battle_clans = []
-        files = sorted(files)       
-
-        # Для каждого боя получаем клан соперника
-        for i,battle in enumerate(self.abs_analyzer.battles):
-           # print(f"Номер i :{i}")
-           # print(f"battle :{battle}")
-            if i < len(files):
-                try:
-                    file_path = files[i]
-                    print(f"Обработка файла {i+1}: {os.path.basename(file_path)}")
-            
-                    clan_info = ClanExtractor.extract_opponent_clan_info(file_path)
-                    clan_string = clan_info['clan_string']
-                    is_mixed = clan_info.get('is_mixed', False)
-                    
-                    # Получаем результат боя из battle объекта
-                    is_win = battle.get('is_win', False)
-                    
-                    # Сохраняем информацию о клане и результате
-                    battle_info = {
-                        'clan': clan_string,
-                        'is_mixed': is_mixed,
-                        'is_win': is_win,
-                        'full_info': clan_info
-                    }
-                    self.battle_clans.append(battle_info)
-                    battle['clan_info'] = battle_info
-                    
-                    # Выводим в консоль для отладки
-                    icon = "⚔️" if is_mixed else "🏷️"
-                    result_icon = "🏆" if is_win else "💔"
-                    print(f"  {icon} {result_icon} Бой {i+1}: {clan_string}")
-                    
-                except Exception as e:
-                    print(f"Ошибка получения клана для боя {i}: {e}")
-                    battle_info = {
-                        'clan': '?',
-                        'is_mixed': False,
-                        'is_win': False,
-                        'full_info': {}
-                    }
-                    self.battle_clans.append(battle_info)
-                    battle['clan_info'] = battle_info
-    
     def save_csv(self):
         """Сохраняет данные в CSV"""
         analyzer = self.abs_analyzer if self.current_mode == "abs" else self.random_analyzer
@@ -756,7 +1293,10 @@ class MainWindow(QMainWindow):
         )
         
         if file_path:
-            if analyzer.export_to_csv(file_path):
+            # В АБС режиме сохраняются бои по текущему фильтру
+            exported = (analyzer.export_to_csv(file_path, self.filtered_battles())
+                        if self.current_mode == "abs" else analyzer.export_to_csv(file_path))
+            if exported:
                 QMessageBox.information(self, "Готово", f"Файл успешно сохранен:\n{file_path}")
                 self.status_bar.showMessage(f"✅ Файл сохранен: {file_path}")
             else:
@@ -1,9 +1,12 @@
 import sys
 import os
 import ctypes
+import argparse
+import multiprocessing
 from PyQt6.QtWidgets import QApplication
 from PyQt6.QtGui import QIcon
 from gui.main_window import MainWindow
+from models.json_backends import JSON_BACKENDS
 
 def setup_taskbar_icon():
     """Критически важно: вызывать ДО создания QApplication"""
@@ -34,12 +37,25 @@ def get_icon_path():
     
     return icon_path if os.path.exists(icon_path) else None
 
+def parse_args():
+    """Разбирает аргументы командной строки, остальные передаются в Qt"""
+    parser = argparse.ArgumentParser(description="MirTankov ABS Replay Analyzer")
+    parser.add_argument('--json-backend', choices=JSON_BACKENDS, default=None,
+                        help="JSON декодер для реплеев (по умолчанию - из настроек)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Процессов для разбора реплеев: 0 - по числу ядер, "
+                             "1 - последовательно (по умолчанию - из настроек)")
+    args, qt_args = parser.parse_known_args()
+    return args, [sys.argv[0]] + qt_args
+
 def main():
+    args, qt_args = parse_args()
+    
     # 1. СНАЧАЛА устанавливаем AppUserModelID (это критически важно!)
     setup_taskbar_icon()
     
     # 2. ПОТОМ создаем QApplication
-    app = QApplication(sys.argv)
+    app = QApplication(qt_args)
     app.setApplicationName("MirTankov ABS Replay Analyzer")
     app.setApplicationVersion("2.0.0")
     
@@ -51,7 +67,7 @@ def main():
         print("✅ Иконка установлена для приложения")
     
     # 4. Создаем и показываем окно
-    window = MainWindow()
+    window = MainWindow(json_backend=args.json_backend, workers=args.workers)
     
     # 5. ДОПОЛНИТЕЛЬНО устанавливаем иконку для окна
     if icon_path:
@@ -64,4 +80,6 @@ def main():
     sys.exit(app.exec())
 
 if __name__ == "__main__":
+    # Нужно для пула процессов разбора в собранном .exe
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -1,23 +1,56 @@
 import json
 import csv
+from bisect import bisect_left, bisect_right
 from pathlib import Path
-from collections import defaultdict
+from .replay_reader import ReplayReader, FAILURE_REASONS, TRANSIENT_FAILURES, RANDOM_BATTLE_PLAYERS
+from .ingest import parse_replay, iter_parsed_replays, dedupe_battles
+from .battle_matrix import BattleMatrix
+from .battle_index import BattleBitmaps
+from .schemas import BattleRecord
+from utils.clan_extractor import ClanExtractor
 
 class BattleMatrixAnalyzer:
-    def __init__(self):
-        self.players = set()
-        self.battles = []
-        self.battle_data = defaultdict(dict)      # battle_id -> player_name -> damage
-        self.battle_vehicles = defaultdict(dict)  # battle_id -> player_name -> vehicle (short name)
-        self.battle_health = defaultdict(dict)    # battle_id -> player_name -> health
-        self.battle_kills = defaultdict(dict)     # battle_id -> player_name -> kills
-        self.player_battles = defaultdict(int)
+    def __init__(self, read_mode='prefix', workers=1, cache=None, storage='auto', store=None,
+                 **reader_options):
+        self.battles = []       # BattleRecord по каждому бою, по возрастанию времени
+        self.battle_times = []  # timestamp каждого боя из battles - для бинарного поиска
+        # Игрок × бой: урон, здоровье, фраги и техника в NumPy массивах;
+        # storage - плотное или разреженное хранение (см. battle_matrix)
+        self.matrix = BattleMatrix(storage)
+        # Битовые индексы боев по карте, исходу, клану соперника и месяцу - для фильтров
+        self.bitmaps = BattleBitmaps()
         self.total_wins = 0
         self.skipped_battles = 0  # Счетчик пропущенных боев (30 игроков)
         self.processed_battles = 0  # Счетчик обработанных боев (14 игроков)
+        self.duplicate_battles = 0  # Копии уже учтенного боя из реплеев сокомандников
         
         # Загружаем короткие названия танков
         self.tank_short_names = self.load_tank_names()
+        
+        # Чтение JSON блоков из реплеев; случайные бои отсеиваются
+        # по блоку metadata, не читая блок results
+        reader_options.setdefault('battle_filter', 'abs')
+        self.reader = ReplayReader(read_mode, **reader_options)
+        self.bytes_read = 0   # Сколько байт прочитано с диска
+        self.bytes_total = 0  # Суммарный размер обработанных файлов
+        self.failed_files = []  # (имя файла, причина) для нечитаемых реплеев
+        self.workers = workers  # Процессов для разбора: 1 - последовательно, 0 - по числу ядер
+        self.cache = cache      # ReplayCache или None
+        self.known_files = set()  # Полные пути уже учтенных файлов - для add_files
+        self.store = store      # BattleStore (архив боев в SQLite) или None
+    
+    def __getstate__(self):
+        # Для снимка сессии: кэш (соединение SQLite) не сохраняется,
+        # короткие названия танков загружаются заново из JSON
+        state = self.__dict__.copy()
+        state['cache'] = None
+        state['store'] = None
+        del state['tank_short_names']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.tank_short_names = self.load_tank_names()
     
     def load_tank_names(self):
         """Загружает короткие названия танков из JSON"""
@@ -53,134 +86,116 @@ class BattleMatrixAnalyzer:
             return vehicle_key.replace('_', ' ')
         return vehicle_key
     
+    @property
+    def players(self):
+        """Имена всех игроков (по одному на accountDBID) в порядке появления"""
+        return self.matrix.players
+    
+    def get_player_totals(self, player_name):
+        """PlayerTotals игрока - накопленные при добавлении боев итоги, без пересчета"""
+        return self.matrix.player_totals(player_name)
+    
+    def get_player_row(self, player_name):
+        """Индекс игрока в матрице по имени (в т.ч. прежнему) или None"""
+        return self.matrix.name_index.get(player_name)
+    
+    def get_battle_cells(self, battle_id):
+        """{индекс игрока: ячейка как в get_table_data} для одного боя"""
+        return {
+            row: {'vehicle': vehicle, 'damage': damage, 'health': health, 'kills': kills}
+            for row, (vehicle, damage, health, kills, _) in self.matrix.column(battle_id).items()
+        }
+    
+    def get_cell(self, player_name, battle_id):
+        """(техника, урон, здоровье, фраги) игрока в бою или None"""
+        return self.matrix.cell(player_name, battle_id)
+    
     def extract_json_from_replay(self, replay_path):
         """Извлекает metadata и results из .mtreplay файла"""
-        try:
-            with open(replay_path, 'rb') as f:
-                data = f.read()
-        except Exception as e:
-            print(f"  ❌ Ошибка чтения файла: {e}")
-            return None, None
-        
-        # Ищем JSON блоки
-        metadata = None
-        results = None
-        pos = 0
-        
-        while pos < len(data) - 1000 and (not metadata or not results):
-            if data[pos] == ord('{'):
-                end, depth, in_str, esc = pos, 0, False, False
-                while end < len(data):
-                    b = data[end]
-                    if not in_str:
-                        if b == ord('{'): depth += 1
-                        elif b == ord('}'): 
-                            depth -= 1
-                            if depth == 0: break
-                    elif b == ord('"') and not esc: in_str = not in_str
-                    if b == ord('\\') and not esc: esc = True
-                    else: esc = False
-                    end += 1
-                
-                if depth == 0:
-                    try:
-                        j = json.loads(data[pos:end+1].decode('utf-8', errors='ignore'))
-                        if 'clientVersionFromXml' in j: 
-                            metadata = j
-                        if 'vehicles' in j and 'personal' in j and 'common' in j: 
-                            results = j
-                    except: 
-                        pass
-            pos += 1
-        
-        return metadata, results
+        return self.reader.read(replay_path)
     
     def count_players_in_battle(self, vehicles_meta):
         """Подсчитывает количество игроков в бою"""
-        return len([v for v in vehicles_meta.values() if isinstance(v, dict)])
+        return len(vehicles_meta)
     
     def process_replay(self, replay_path):
         """Обрабатывает один реплей"""
-        print(f"\n📁 Обработка: {Path(replay_path).name}")
+        return self.ingest_replay(parse_replay(self.reader, replay_path))
+    
+    def ingest_replay(self, parsed):
+        """Добавляет в статистику уже разобранный реплей (ParsedReplay)"""
+        print(f"\n📁 Обработка: {parsed.file}")
+        
+        metadata, results = parsed.metadata, parsed.results
+        
+        # Учитываем, сколько байт реально прочитано с диска
+        self.bytes_read += parsed.bytes_read
+        self.bytes_total += parsed.file_size
+        if parsed.from_cache:
+            if not parsed.error:
+                print(f"  💾 Из кэша")
+        else:
+            print(f"  📦 Прочитано {parsed.bytes_read / 1024:.1f} КБ "
+                  f"из {parsed.file_size / 1024:.1f} КБ")
         
-        metadata, results = self.extract_json_from_replay(replay_path)
+        if parsed.error == 'filtered':
+            self.skipped_battles += 1
+            print(f"  ⏭️ Пропущен случайный бой (по блоку metadata)")
+            return False
         
-        if not metadata or not results:
-            print("  ⚠️ Не удалось извлечь данные, пропускаем")
+        if parsed.error:
+            self.failed_files.append((parsed.file, parsed.error))
+            if parsed.from_cache:
+                print(f"  🚫 В карантине ({FAILURE_REASONS[parsed.error]}), пропускаем")
+            else:
+                print(f"  ⚠️ Не удалось извлечь данные ({FAILURE_REASONS[parsed.error]}), пропускаем")
             return False
         
         # Получаем информацию о бое
-        map_name = metadata.get('mapDisplayName', 'Неизвестно')
-        date_time = metadata.get('dateTime', 'Неизвестно')
+        map_name = metadata.map_name
+        date_time = metadata.date_time
         
         # Собираем всех игроков
-        vehicles_meta = metadata.get('vehicles', {})
+        vehicles_meta = metadata.vehicles
         
         # Подсчитываем количество игроков
         players_count = self.count_players_in_battle(vehicles_meta)
         print(f"  👥 Участников в бою: {players_count}")
         
         # Проверяем, что это АБС режим (14 игроков - 7 на 7)
-        if players_count == 30:  # Если 30 игроков (15 на 15) - это случайный бой
+        if players_count == RANDOM_BATTLE_PLAYERS:  # Если 30 игроков (15 на 15) - это случайный бой
             self.skipped_battles += 1
             print(f"  ⏭️ Пропущен случайный бой (30 участников)")
             return False
         
-        # Создаем ID для боя
-        battle_id = f"{date_time}_{map_name}"
-        
-        # Добавляем бой в список
-        self.battles.append({
-            'id': battle_id,
-            'date': date_time,
-            'map': map_name,
-            'file': Path(replay_path).name,
-            'players_count': players_count
-        })
-        
-        # Получаем статистику
-        vehicles_stats = results.get('vehicles', {})
+        # ID боя - arenaUniqueID, одинаковый в реплеях всех участников;
+        # в старых реплеях без него - дата и карта
+        battle_id = results.arena_unique_id or f"{date_time}_{map_name}"
+        if battle_id in self.matrix:
+            self.duplicate_battles += 1
+            print(f"  🔁 Бой уже учтен по реплею другого участника, пропускаем")
+            return False
         
-        battle_players = set()
+        winner_team = results.winner_team
         
+        # Игроки определяются по accountDBID из results, имя - из metadata
+        entries = []
         for vid, v in vehicles_meta.items():
-            if not isinstance(v, dict):
-                continue
-            
-            player_name = v.get('name', 'Unknown')
-            vehicle_full = v.get('vehicleType', 'Unknown')
-            
+            stats = results.stats_for(vid)
             # Получаем короткое название танка
-            vehicle_short = self.get_vehicle_short_name(vehicle_full)
-            
-            self.players.add(player_name)
-            battle_players.add(player_name)
-            
-            stats = vehicles_stats.get(vid, [{}])[0]
-            damage = stats.get('damageDealt', 0)
-            health = stats.get('health', 0)
-            kills = stats.get('kills', 0)
-            
-            self.battle_data[battle_id][player_name] = damage
-            self.battle_vehicles[battle_id][player_name] = vehicle_short
-            self.battle_health[battle_id][player_name] = health
-            self.battle_kills[battle_id][player_name] = kills
+            vehicle_short = self.get_vehicle_short_name(v.vehicle_type)
+            entries.append((stats.account_id, v.name, vehicle_short,
+                            stats.damage, stats.health, stats.kills,
+                            bool(v.team) and v.team == winner_team))
         
-        # Увеличиваем счетчик боёв для каждого игрока
-        for player in battle_players:
-            self.player_battles[player] += 1
+        # Итоги игроков (бои, урон, фраги, выживания, победы) обновляются здесь же
+        self.matrix.add_battle(battle_id, entries, metadata.timestamp)
         
         # Определяем исход боя
-        winner_team = results.get('common', {}).get('winnerTeam', 0)
-        player_name = metadata.get('playerName', '')
-        player_team = None
+        owner = metadata.find_player(metadata.player_name)
+        player_team = owner.team if owner else None
         is_win = False
         
-        for vid, v in vehicles_meta.items():
-            if isinstance(v, dict) and v.get('name') == player_name:
-                player_team = v.get('team', 0)
-                break
-        
         if player_team and winner_team == player_team:
             self.total_wins += 1
             is_win = True
@@ -188,16 +203,93 @@ class BattleMatrixAnalyzer:
         else:
             outcome = "❌ ПОРАЖЕНИЕ"
         
-        # Добавляем результат боя
-        self.battles[-1]['is_win'] = is_win
-        self.battles[-1]['winner_team'] = winner_team
-        self.battles[-1]['player_team'] = player_team
+        # Клан соперника берем из того же блока metadata - файл второй раз не читаем
+        clan_info = ClanExtractor.from_metadata(metadata)
+        
+        # Добавляем бой в список, сохраняя порядок по времени
+        battle = BattleRecord(
+            id=battle_id,
+            date=date_time,
+            timestamp=metadata.timestamp,
+            map=map_name,
+            file=parsed.file,
+            players_count=players_count,
+            is_win=is_win,
+            winner_team=winner_team,
+            player_team=player_team,
+            clan=clan_info['clan_string'],
+            clan_is_mixed=clan_info['is_mixed']
+        )
+        self.insert_battle(battle)
+        if self.store:
+            self.store.add_battle(battle, entries)
         
         self.processed_battles += 1
         print(f"  {outcome} на карте {map_name}")
-        print(f"     Участников: {len(battle_players)}")
+        print(f"     {'⚔️' if clan_info['is_mixed'] else '🏷️'} Соперник: {clan_info['clan_string']}")
+        print(f"     Участников: {len(entries)}")
         return True
     
+    def insert_battle(self, battle):
+        """Вставляет бой в battles по времени; равные по времени - в порядке добавления"""
+        index = bisect_right(self.battle_times, battle.timestamp)
+        self.battle_times.insert(index, battle.timestamp)
+        self.battles.insert(index, battle)
+        self.bitmaps.add(self.matrix.battle_index[battle.id], battle)
+    
+    def select_battles(self, **criteria):
+        """
+        Бои по фильтру через битовые индексы (см. BattleBitmaps.select), по времени:
+        атрибуты map, result ('win'/'loss'), clan, month ('ГГГГ-ММ') объединяются
+        через AND, список значений одного атрибута - через OR
+        """
+        return self.bitmaps.battles(self.bitmaps.select(**criteria))
+    
+    def battles_between(self, start=None, end=None):
+        """
+        Бои с start <= timestamp <= end (секунды, см. parse_battle_time).
+        Границы ищутся бинарным поиском; None - без ограничения
+        """
+        lo = 0 if start is None else bisect_left(self.battle_times, start)
+        hi = len(self.battle_times) if end is None else bisect_right(self.battle_times, end)
+        return self.battles[lo:hi]
+    
+    def merge(self, other):
+        """
+        Добавляет состояние другого анализатора, собранного по другим реплеям
+        (в другом процессе, на другой машине, у другого участника клана).
+        Бои встают в battles по времени, итоги игроков складываются через
+        add_battle, бои, которые уже есть здесь, считаются повторами.
+        Объединение ассоциативно: a.merge(b).merge(c) дает те же бои и итоги,
+        что и a.merge(b.merge(c)) и разбор всех реплеев вместе, в т.ч. когда
+        игрок из реплеев без accountDBID находится только в другой части
+        (см. BattleMatrix.merge_names). Возвращает self
+        """
+        for battle in other.battles:
+            if battle.id in self.matrix:
+                self.duplicate_battles += 1
+                continue
+            self.matrix.merge_battle(other.matrix, battle.id)
+            self.insert_battle(battle)
+            if self.store:
+                # Имена в матрице - текущие, а не из этого боя; их согласует merge_names
+                self.store.add_battle(battle, self.matrix.battle_entries(battle.id), name_time=0)
+            if battle.is_win:
+                self.total_wins += 1
+            self.processed_battles += 1
+        self.matrix.merge_names(other.matrix)
+        if self.store:
+            self.store.merge_names(self.matrix)
+            self.store.commit()
+        
+        self.skipped_battles += other.skipped_battles
+        self.duplicate_battles += other.duplicate_battles
+        self.bytes_read += other.bytes_read
+        self.bytes_total += other.bytes_total
+        self.failed_files.extend(other.failed_files)
+        self.known_files |= other.known_files
+        return self
+    
     def process_files(self, file_paths):
         """Обрабатывает список файлов"""
         if not file_paths:
@@ -210,64 +302,148 @@ class BattleMatrixAnalyzer:
         
         self.skipped_battles = 0
         self.processed_battles = 0
+        self.duplicate_battles = 0
+        self.ingest_files(file_paths)
+        
+        return self.processed_battles > 0
+    
+    def add_files(self, file_paths):
+        """
+        Добавляет реплеи к уже выполненному анализу (например, вечерние бои к сезону).
+        Разбираются только файлы, которых еще нет в анализе; их бои встают
+        в battles по времени, итоги игроков обновляются при добавлении.
+        Счетчики боев не сбрасываются.
+        Возвращает список battle_id новых боев
+        """
+        new_files = [p for p in file_paths if str(Path(p).resolve()) not in self.known_files]
         
-        for file_path in sorted(file_paths):
-            self.process_replay(file_path)
+        print(f"\n{'='*80}")
+        print(f"➕ Добавление реплеев: новых файлов {len(new_files)} из {len(file_paths)}")
+        print(f"{'='*80}")
+        
+        if not new_files:
+            return []
+        return self.ingest_files(new_files)
+    
+    def ingest_files(self, file_paths):
+        """Разбирает файлы и добавляет их бои; возвращает battle_id новых боев"""
+        first_col = len(self.matrix.battle_ids)
+        self.bytes_read = 0
+        self.bytes_total = 0
+        self.failed_files = []
+        if self.cache:
+            self.cache.reset_stats()
+        
+        # Файлы разбираются параллельно, но добавляются в статистику
+        # в отсортированном порядке - результат как при последовательном разборе.
+        # Копии одного боя от разных участников отбрасываются до агрегации
+        file_paths = sorted(file_paths)
+        records = list(iter_parsed_replays(file_paths, self.reader, self.workers, self.cache))
+        parsed_replays, duplicates = dedupe_battles(records)
+        self.duplicate_battles += duplicates
+        for parsed in parsed_replays:
+            self.ingest_replay(parsed)
+        if self.store:
+            self.store.commit()
+        # Файлы с временной ошибкой чтения не запоминаются - add_files разберет их снова
+        self.known_files.update(str(Path(p).resolve()) for p, parsed in zip(file_paths, records)
+                                if parsed.error not in TRANSIENT_FAILURES)
         
         print(f"\n{'='*80}")
         print(f"📊 Статистика обработки:")
         print(f"   ✅ Обработано АБС боев (7×7): {self.processed_battles}")
         print(f"   ⏭️ Пропущено случайных боев (15×15): {self.skipped_battles}")
+        if self.duplicate_battles:
+            print(f"   🔁 Повторов одного боя (реплеи сокомандников): {self.duplicate_battles}")
         print(f"   👥 Уникальных игроков: {len(self.players)}")
+        if self.failed_files:
+            print(f"   ⚠️ Не удалось прочитать: {len(self.failed_files)}")
+        print(f"   📦 Прочитано с диска: {self.bytes_read / 1048576:.1f} МБ "
+              f"из {self.bytes_total / 1048576:.1f} МБ")
+        if self.cache and self.cache.hits:
+            print(f"   💾 Взято из кэша: {self.cache.hits}")
+        if self.cache and self.cache.quarantined:
+            print(f"   🚫 Пропущено из карантина: {self.cache.quarantined}")
         print(f"{'='*80}")
         
-        return self.processed_battles > 0
+        return self.matrix.battle_ids[first_col:]
     
-    def get_table_data(self):
-        """Возвращает данные для таблицы"""
-        # Сортируем бои по дате
-        self.battles.sort(key=lambda x: x['date'])
+    def get_table_data(self, battles=None):
+        """
+        Возвращает данные для таблицы.
+        battles - подмножество боев (например, из select_battles): итоги игроков
+        пересчитываются только по нему, игроки без этих боев не показываются
+        """
+        # Бои уже упорядочены по времени при добавлении
+        matrix = self.matrix
+        subset = battles is not None
+        if not subset:
+            battles = self.battles
+        cols = [matrix.battle_index[battle.id] for battle in battles]
+        
+        # Количества боев и суммы урона накоплены при добавлении боев,
+        # по подмножеству - считаются только по его столбцам
+        battle_counts, damage_totals, _ = matrix.row_sums(cols if subset else None)
+        rows = battle_counts.nonzero()[0].tolist() if subset else range(len(matrix.players))
         
         # Сортируем игроков по алфавиту
-        sorted_players = sorted(self.players)
+        rows = sorted(rows, key=matrix.players.__getitem__)
+        sorted_players = [matrix.players[row] for row in rows]
         
         # ФОРМИРУЕМ ЗАГОЛОВКИ: дата + карта в одной строке
         headers = ['Игрок', 'Ср.урон', 'Боёв']
-        for battle in self.battles:
-            date_part = battle['date'][:16]
-            map_part = battle['map']
+        for battle in battles:
+            date_part = battle.date[:16]
+            map_part = battle.map
             headers.append(f"{date_part} {map_part}")
         
+        played, vehicle, damage, health, kills, _ = matrix.block(rows, cols)
+        vehicle_names = matrix.vehicle_names
+        
         # Создаем данные
         data = []
-        for player in sorted_players:
-            total_damage = 0
-            battles_list = []
+        for i, player in enumerate(sorted_players):
+            row_played = played[i].tolist()
+            row_vehicle = vehicle[i].tolist()
+            row_damage = damage[i].tolist()
+            row_health = health[i].tolist()
+            row_kills = kills[i].tolist()
             
-            for battle in self.battles:
-                if player in self.battle_data[battle['id']]:
-                    damage = self.battle_data[battle['id']][player]
-                    vehicle = self.battle_vehicles[battle['id']][player]
-                    # Сохраняем как словарь вместо строки
-                    battles_list.append({
-                        'vehicle': vehicle,
-                        'damage': damage
-                    })
-                    total_damage += damage
-                else:
-                    battles_list.append('-')
+            # Ячейка боя - словарь с техникой и статистикой или '-'
+            battles_list = [
+                {
+                    'vehicle': vehicle_names[row_vehicle[j]],
+                    'damage': row_damage[j],
+                    'health': row_health[j],
+                    'kills': row_kills[j]
+                } if row_played[j] else '-'
+                for j in range(len(cols))
+            ]
             
-            battles_count = self.player_battles[player]
+            battles_count = int(battle_counts[rows[i]])
+            total_damage = int(damage_totals[rows[i]])
             avg_damage = round(total_damage / battles_count) if battles_count > 0 else 0
             
             row = [player, avg_damage, battles_count] + battles_list
             data.append(row)
         
-        return headers, data, len(self.battles)
+        return headers, data, len(battles)
+    
+    def get_survival_stats(self, battles=None):
+        """
+        Возвращает {игрок: (выжил в боях, всего боев)} из накопленных итогов,
+        а для подмножества battles - пересчитанные только по нему
+        """
+        cols = None if battles is None else [self.matrix.battle_index[battle.id] for battle in battles]
+        battle_counts, _, survival_counts = self.matrix.row_sums(cols)
+        return {
+            player: (int(survival_counts[row]), int(battle_counts[row]))
+            for row, player in enumerate(self.matrix.players)
+        }
     
-    def export_to_csv(self, filename):
-        """Экспортирует матрицу боев в CSV"""
-        headers, data, _ = self.get_table_data()
+    def export_to_csv(self, filename, battles=None):
+        """Экспортирует матрицу боев (или подмножества боев battles) в CSV"""
+        headers, data, _ = self.get_table_data(battles)
         
         with open(filename, 'w', encoding='utf-8', newline='') as f:
             writer = csv.writer(f)
@@ -1,7 +1,14 @@
 import json
 import csv
+from bisect import bisect_right
 from pathlib import Path
 from collections import defaultdict
+from .replay_reader import ReplayReader, FAILURE_REASONS, TRANSIENT_FAILURES
+from .ingest import parse_replay, iter_parsed_replays
+from .schemas import BattleRecord, RandomBattleStats
+
+# Поля RandomBattleStats, суммы которых копятся для сводной статистики
+SUMMARY_FIELDS = ('damage', 'kills', 'spotted', 'shots', 'hits', 'piercings', 'damage_blocked')
 
 class RandomBattleAnalyzer:
     """
@@ -10,14 +17,38 @@ class RandomBattleAnalyzer:
     Добавляет информацию о выстрелах/попаданиях/пробитиях.
     """
     
-    def __init__(self):
+    def __init__(self, read_mode='prefix', workers=1, cache=None, **reader_options):
         self.player_name = None
-        self.player_stats = []  # Статистика по боям для игрока
-        self.battles = []       # Информация о боях
+        self.player_stats = []  # RandomBattleStats по боям для игрока, по возрастанию времени
+        self.stats_times = []   # timestamp каждой записи player_stats - для бинарного поиска
+        self.battles = []       # BattleRecord по каждому бою
+        self.battle_ids = set() # id боев из battles - повторы пропускаются
+        self.totals = defaultdict(int)  # Суммы SUMMARY_FIELDS по всем боям, копятся при добавлении
         self.total_wins = 0
         
         # Загружаем короткие названия танков
         self.tank_short_names = self.load_tank_names()
+        
+        # Чтение JSON блоков из реплеев
+        self.reader = ReplayReader(read_mode, **reader_options)
+        self.bytes_read = 0   # Сколько байт прочитано с диска
+        self.bytes_total = 0  # Суммарный размер обработанных файлов
+        self.failed_files = []  # (имя файла, причина) для нечитаемых реплеев
+        self.workers = workers  # Процессов для разбора: 1 - последовательно, 0 - по числу ядер
+        self.cache = cache      # ReplayCache или None
+        self.known_files = set()  # Полные пути уже учтенных файлов - для add_files
+    
+    def __getstate__(self):
+        # Для снимка сессии: кэш (соединение SQLite) не сохраняется,
+        # короткие названия танков загружаются заново из JSON
+        state = self.__dict__.copy()
+        state['cache'] = None
+        del state['tank_short_names']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.tank_short_names = self.load_tank_names()
     
     def load_tank_names(self):
         """Загружает короткие названия танков из JSON"""
@@ -55,59 +86,40 @@ class RandomBattleAnalyzer:
     
     def extract_json_from_replay(self, replay_path):
         """Извлекает metadata и results из .mtreplay файла"""
-        try:
-            with open(replay_path, 'rb') as f:
-                data = f.read()
-        except Exception as e:
-            print(f"  ❌ Ошибка чтения файла: {e}")
-            return None, None
-        
-        metadata = None
-        results = None
-        pos = 0
-        
-        while pos < len(data) - 1000 and (not metadata or not results):
-            if data[pos] == ord('{'):
-                end, depth, in_str, esc = pos, 0, False, False
-                while end < len(data):
-                    b = data[end]
-                    if not in_str:
-                        if b == ord('{'): depth += 1
-                        elif b == ord('}'): 
-                            depth -= 1
-                            if depth == 0: break
-                    elif b == ord('"') and not esc: in_str = not in_str
-                    if b == ord('\\') and not esc: esc = True
-                    else: esc = False
-                    end += 1
-                
-                if depth == 0:
-                    try:
-                        j = json.loads(data[pos:end+1].decode('utf-8', errors='ignore'))
-                        if 'clientVersionFromXml' in j: 
-                            metadata = j
-                        if 'vehicles' in j and 'personal' in j and 'common' in j: 
-                            results = j
-                    except: 
-                        pass
-            pos += 1
-        
-        return metadata, results
+        return self.reader.read(replay_path)
     
     def process_replay(self, replay_path):
         """Обрабатывает один реплей и собирает статистику владельца"""
-        print(f"\n📁 Обработка: {Path(replay_path).name}")
-        
-        metadata, results = self.extract_json_from_replay(replay_path)
-        
-        if not metadata or not results:
-            print("  ⚠️ Не удалось извлечь данные, пропускаем")
+        return self.ingest_replay(parse_replay(self.reader, replay_path))
+    
+    def ingest_replay(self, parsed):
+        """Добавляет в статистику уже разобранный реплей (ParsedReplay)"""
+        print(f"\n📁 Обработка: {parsed.file}")
+        
+        metadata, results = parsed.metadata, parsed.results
+        
+        # Учитываем, сколько байт реально прочитано с диска
+        self.bytes_read += parsed.bytes_read
+        self.bytes_total += parsed.file_size
+        if parsed.from_cache:
+            if not parsed.error:
+                print(f"  💾 Из кэша")
+        else:
+            print(f"  📦 Прочитано {parsed.bytes_read / 1024:.1f} КБ "
+                  f"из {parsed.file_size / 1024:.1f} КБ")
+        
+        if parsed.error:
+            self.failed_files.append((parsed.file, parsed.error))
+            if parsed.from_cache:
+                print(f"  🚫 В карантине ({FAILURE_REASONS[parsed.error]}), пропускаем")
+            else:
+                print(f"  ⚠️ Не удалось извлечь данные ({FAILURE_REASONS[parsed.error]}), пропускаем")
             return False
         
         # Получаем информацию о бое
-        map_name = metadata.get('mapDisplayName', 'Неизвестно')
-        date_time = metadata.get('dateTime', 'Неизвестно')
-        player_name = metadata.get('playerName', '')
+        map_name = metadata.map_name
+        date_time = metadata.date_time
+        player_name = metadata.player_name
         
         # Сохраняем имя игрока (оно одинаковое для всех реплеев)
         if not self.player_name:
@@ -115,88 +127,129 @@ class RandomBattleAnalyzer:
         
         # Создаем ID для боя
         battle_id = f"{date_time}_{map_name}"
-        
-        # Добавляем бой в список
-        self.battles.append({
-            'id': battle_id,
-            'date': date_time,
-            'map': map_name,
-            'file': Path(replay_path).name
-        })
+        if battle_id in self.battle_ids:
+            print(f"  🔁 Бой уже учтен по другому файлу, пропускаем")
+            return False
         
         # Находим статистику игрока
-        vehicles_meta = metadata.get('vehicles', {})
-        vehicles_stats = results.get('vehicles', {})
-        
         player_found = False
         player_data = None
+        player_team = None
         
-        for vid, v in vehicles_meta.items():
-            if not isinstance(v, dict):
-                continue
-            
-            if v.get('name') == player_name:
+        for vid, v in metadata.vehicles.items():
+            if v.name == player_name:
                 player_found = True
-                stats = vehicles_stats.get(vid, [{}])[0]
+                player_team = v.team
+                stats = results.stats_for(vid)
                 
                 # Получаем короткое название танка
-                vehicle_full = v.get('vehicleType', 'Unknown')
-                vehicle = self.get_vehicle_short_name(vehicle_full)
-                
-                # Собираем всю статистику
-                player_data = {
-                    'battle_id': battle_id,
-                    'date': date_time,
-                    'map': map_name,
-                    'vehicle': vehicle,
-                    'damage': stats.get('damageDealt', 0),
-                    'kills': stats.get('kills', 0),
-                    'spotted': stats.get('spotted', 0),
-                    'shots': stats.get('shots', 0),
-                    'hits': stats.get('directHits', 0),
-                    'piercings': stats.get('piercings', 0),
-                    'xp': stats.get('xp', 0),
-                    'damage_blocked': stats.get('damageBlockedByArmor', 0),
-                    'damage_received': stats.get('damageReceived', 0),
-                    'health': stats.get('health', 0)
-                }
+                vehicle = self.get_vehicle_short_name(v.vehicle_type)
                 
                 # Рассчитываем точность
-                if player_data['shots'] > 0:
-                    player_data['accuracy'] = (player_data['hits'] / player_data['shots']) * 100
+                if stats.shots > 0:
+                    accuracy = (stats.hits / stats.shots) * 100
                 else:
-                    player_data['accuracy'] = 0
+                    accuracy = 0
+                
+                # Собираем всю статистику
+                player_data = RandomBattleStats(
+                    battle_id=battle_id,
+                    date=date_time,
+                    timestamp=metadata.timestamp,
+                    map=map_name,
+                    vehicle=vehicle,
+                    damage=stats.damage,
+                    kills=stats.kills,
+                    spotted=stats.spotted,
+                    shots=stats.shots,
+                    hits=stats.hits,
+                    piercings=stats.piercings,
+                    xp=stats.xp,
+                    damage_blocked=stats.damage_blocked,
+                    damage_received=stats.damage_received,
+                    health=stats.health,
+                    accuracy=accuracy
+                )
                 
                 # Добавляем в общую статистику
-                self.player_stats.append(player_data)
+                self.insert_stats(player_data)
                 break
         
+        # Определяем исход боя
+        winner_team = results.winner_team
+        is_win = bool(player_team) and winner_team == player_team
+        
+        # Добавляем бой в список
+        self.battle_ids.add(battle_id)
+        self.battles.append(BattleRecord(
+            id=battle_id,
+            date=date_time,
+            timestamp=metadata.timestamp,
+            map=map_name,
+            file=parsed.file,
+            is_win=is_win,
+            winner_team=winner_team,
+            player_team=player_team
+        ))
+        
         if not player_found:
             print(f"  ⚠️ Не найден игрок {player_name} в реплее")
             return False
         
-        # Определяем исход боя
-        winner_team = results.get('common', {}).get('winnerTeam', 0)
-        player_team = None
-        
-        for vid, v in vehicles_meta.items():
-            if isinstance(v, dict) and v.get('name') == player_name:
-                player_team = v.get('team', 0)
-                break
-        
-        if player_team and winner_team == player_team:
+        if is_win:
             self.total_wins += 1
             outcome = "🏆 ПОБЕДА"
         else:
             outcome = "❌ ПОРАЖЕНИЕ"
         
         print(f"  {outcome} на карте {map_name}")
-        print(f"     Урон: {player_data['damage']} | Фраги: {player_data['kills']} | "
-              f"Выстрелы: {player_data['shots']} | Попадания: {player_data['hits']} | "
-              f"Пробития: {player_data['piercings']} | Блок: {player_data['damage_blocked']}")
+        print(f"     Урон: {player_data.damage} | Фраги: {player_data.kills} | "
+              f"Выстрелы: {player_data.shots} | Попадания: {player_data.hits} | "
+              f"Пробития: {player_data.piercings} | Блок: {player_data.damage_blocked}")
         
         return True
     
+    def insert_stats(self, player_data):
+        """Вставляет бой в player_stats по времени и добавляет его к суммам"""
+        index = bisect_right(self.stats_times, player_data.timestamp)
+        self.stats_times.insert(index, player_data.timestamp)
+        self.player_stats.insert(index, player_data)
+        for field in SUMMARY_FIELDS:
+            self.totals[field] += getattr(player_data, field)
+    
+    def merge(self, other):
+        """
+        Добавляет состояние другого анализатора, собранного по другим реплеям того же игрока.
+        Бои встают по времени, суммы и победы складываются, бои, которые
+        уже есть здесь, пропускаются; объединение ассоциативно, порядок
+        частей на результат не влияет. Возвращает self.
+        Статистику другого игрока объединить нельзя - ValueError
+        """
+        if self.player_name and other.player_name and self.player_name != other.player_name:
+            raise ValueError(f"Нельзя объединить статистику разных игроков: "
+                             f"{self.player_name} и {other.player_name}")
+        if not self.player_name:
+            self.player_name = other.player_name
+        
+        new_ids = set()
+        for battle in other.battles:
+            if battle.id in self.battle_ids:
+                continue
+            self.battle_ids.add(battle.id)
+            new_ids.add(battle.id)
+            self.battles.append(battle)
+            if battle.is_win:
+                self.total_wins += 1
+        for player_data in other.player_stats:
+            if player_data.battle_id in new_ids:
+                self.insert_stats(player_data)
+        
+        self.bytes_read += other.bytes_read
+        self.bytes_total += other.bytes_total
+        self.failed_files.extend(other.failed_files)
+        self.known_files |= other.known_files
+        return self
+    
     def process_files(self, file_paths):
         """Обрабатывает список файлов"""
         if not file_paths:
@@ -207,26 +260,65 @@ class RandomBattleAnalyzer:
         print(f"🔍 Выбрано файлов для анализа: {len(file_paths)}")
         print(f"{'='*80}")
         
-        processed = 0
-        for file_path in sorted(file_paths):
-            if self.process_replay(file_path):
-                processed += 1
+        added = self.ingest_files(file_paths)
+        return len(added) > 0
+    
+    def add_files(self, file_paths):
+        """
+        Добавляет реплеи к уже выполненному анализу: разбираются только файлы,
+        которых еще нет в анализе, их бои встают в player_stats по времени.
+        Возвращает список новых RandomBattleStats
+        """
+        new_files = [p for p in file_paths if str(Path(p).resolve()) not in self.known_files]
+        
+        print(f"\n{'='*80}")
+        print(f"➕ Добавление реплеев: новых файлов {len(new_files)} из {len(file_paths)}")
+        print(f"{'='*80}")
+        
+        if not new_files:
+            return []
+        return self.ingest_files(new_files)
+    
+    def ingest_files(self, file_paths):
+        """Разбирает файлы и добавляет их бои; возвращает новые RandomBattleStats"""
+        known_stats = set(map(id, self.player_stats))
+        self.bytes_read = 0
+        self.bytes_total = 0
+        self.failed_files = []
+        if self.cache:
+            self.cache.reset_stats()
+        # Файлы разбираются параллельно, но добавляются в статистику
+        # в отсортированном порядке - результат как при последовательном разборе
+        file_paths = sorted(file_paths)
+        parsed_replays = iter_parsed_replays(file_paths, self.reader, self.workers, self.cache)
+        for replay_path, parsed in zip(file_paths, parsed_replays):
+            self.ingest_replay(parsed)
+            # Файл с временной ошибкой чтения add_files разберет снова
+            if parsed.error not in TRANSIENT_FAILURES:
+                self.known_files.add(str(Path(replay_path).resolve()))
+        added = [stats for stats in self.player_stats if id(stats) not in known_stats]
         
         print(f"\n{'='*80}")
-        print(f"✅ Успешно обработано файлов: {processed}/{len(file_paths)}")
+        print(f"✅ Успешно обработано файлов: {len(added)}/{len(file_paths)}")
         print(f"👤 Игрок: {self.player_name}")
+        if self.failed_files:
+            print(f"⚠️ Не удалось прочитать: {len(self.failed_files)}")
+        print(f"📦 Прочитано с диска: {self.bytes_read / 1048576:.1f} МБ "
+              f"из {self.bytes_total / 1048576:.1f} МБ")
+        if self.cache and self.cache.hits:
+            print(f"💾 Взято из кэша: {self.cache.hits}")
+        if self.cache and self.cache.quarantined:
+            print(f"🚫 Пропущено из карантина: {self.cache.quarantined}")
         print(f"{'='*80}")
         
-        return processed > 0
+        return added
     
     def get_table_data(self):
         """Возвращает данные для таблицы в формате для случайных боев"""
         if not self.player_stats:
             return [], [], 0, 0
         
-        # Сортируем бои по дате
-        self.player_stats.sort(key=lambda x: x['date'])
-        
+        # Бои уже упорядочены по времени при добавлении
         # Формируем заголовки
         headers = [
             'Танк', 'Урон', 'Фраги', 'Засвет',
@@ -236,46 +328,48 @@ class RandomBattleAnalyzer:
         
         # Создаем данные
         data = []
-        total_damage = 0
         
         for battle in self.player_stats:
-            # Форматируем точность
-            accuracy = f"{battle['accuracy']:.1f}"
-            
-            # Формируем дату и карту
-            date_map = f"{battle['date'][:16]} {battle['map']}"
-            
-            row = [
-                battle['vehicle'],
-                battle['damage'],
-                battle['kills'],
-                battle['spotted'],
-                battle['shots'],
-                battle['hits'],
-                battle['piercings'],
-                accuracy,
-                battle['xp'],
-                battle['damage_blocked'],
-                date_map
-            ]
-            data.append(row)
-            total_damage += battle['damage']
-        
-        return headers, data, len(self.player_stats), total_damage
+            data.append(self.get_row_data(battle))
+        
+        return headers, data, len(self.player_stats), self.totals['damage']
+    
+    def get_row_data(self, battle):
+        """Строка таблицы для одного боя (RandomBattleStats)"""
+        # Форматируем точность
+        accuracy = f"{battle.accuracy:.1f}"
+        
+        # Формируем дату и карту
+        date_map = f"{battle.date[:16]} {battle.map}"
+        
+        return [
+            battle.vehicle,
+            battle.damage,
+            battle.kills,
+            battle.spotted,
+            battle.shots,
+            battle.hits,
+            battle.piercings,
+            accuracy,
+            battle.xp,
+            battle.damage_blocked,
+            date_map
+        ]
     
     def get_summary_stats(self):
         """Возвращает сводную статистику по всем боям"""
         if not self.player_stats:
             return {}
         
+        # Суммы накоплены при добавлении боев
         total_battles = len(self.player_stats)
-        total_damage = sum(b['damage'] for b in self.player_stats)
-        total_kills = sum(b['kills'] for b in self.player_stats)
-        total_spotted = sum(b['spotted'] for b in self.player_stats)
-        total_shots = sum(b['shots'] for b in self.player_stats)
-        total_hits = sum(b['hits'] for b in self.player_stats)
-        total_piercings = sum(b['piercings'] for b in self.player_stats)
-        total_blocked = sum(b['damage_blocked'] for b in self.player_stats)
+        total_damage = self.totals['damage']
+        total_kills = self.totals['kills']
+        total_spotted = self.totals['spotted']
+        total_shots = self.totals['shots']
+        total_hits = self.totals['hits']
+        total_piercings = self.totals['piercings']
+        total_blocked = self.totals['damage_blocked']
         
         return {
             'total_battles': total_battles,
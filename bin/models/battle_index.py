@@ -0,0 +1,98 @@
+import time
+
+import numpy as np
+
+# Атрибуты боя, по которым строятся битовые индексы
+ATTRIBUTES = ('map', 'result', 'clan', 'month')
+
+# Значения атрибута result
+WIN = 'win'
+LOSS = 'loss'
+
+
+def battle_attributes(battle):
+    """Пары (атрибут, значение) боя (BattleRecord); клан соперника - каждый из сборной"""
+    yield 'map', battle.map
+    yield 'result', WIN if battle.is_win else LOSS
+    for clan in battle.opponent_clans():
+        yield 'clan', clan
+    if battle.timestamp:
+        yield 'month', time.strftime('%Y-%m', time.gmtime(battle.timestamp))
+
+
+class BattleBitmaps:
+    """
+    Битовые индексы боев: для каждого значения атрибута (карта, исход,
+    клан соперника, месяц) - целое число, в котором бит i означает,
+    что бой из столбца i матрицы имеет это значение.
+
+    Фильтры собираются из масок операциями & и |, поэтому выборка вроде
+    "победы на Прохоровке против клана X за месяц" - несколько побитовых
+    операций над целыми, без обхода списка боев
+    """
+
+    def __init__(self):
+        self.bitmaps = {attribute: {} for attribute in ATTRIBUTES}
+        self.records = []  # индекс столбца -> BattleRecord
+        self.times = []    # индекс столбца -> timestamp
+
+    def add(self, col, battle):
+        """Добавляет бой столбца col (столбцы добавляются по порядку)"""
+        if col != len(self.records):
+            raise ValueError(f"Ожидался столбец {len(self.records)}, получен {col}")
+        self.records.append(battle)
+        self.times.append(battle.timestamp)
+        bit = 1 << col
+        for attribute, value in battle_attributes(battle):
+            values = self.bitmaps[attribute]
+            values[value] = values.get(value, 0) | bit
+
+    @property
+    def all(self):
+        """Маска всех боев"""
+        return (1 << len(self.records)) - 1
+
+    def values(self, attribute):
+        """Известные значения атрибута, по алфавиту"""
+        return sorted(self.bitmaps[attribute])
+
+    def bitmap(self, attribute, value):
+        """Маска боев с данным значением атрибута (0, если таких нет)"""
+        if attribute not in self.bitmaps:
+            raise ValueError(f"Неизвестный атрибут боя: {attribute}")
+        return self.bitmaps[attribute].get(value, 0)
+
+    def any_of(self, attribute, values):
+        """Маска боев с любым из значений (OR)"""
+        mask = 0
+        for value in values:
+            mask |= self.bitmap(attribute, value)
+        return mask
+
+    def select(self, **criteria):
+        """
+        Маска по критериям: атрибуты объединяются через AND, список значений
+        одного атрибута - через OR; None - без ограничения.
+        Например: select(map='Прохоровка', result='win', clan=['4BD', 'MUCOP'])
+        """
+        mask = self.all
+        for attribute, values in criteria.items():
+            if values is None:
+                continue
+            if isinstance(values, str):
+                values = (values,)
+            mask &= self.any_of(attribute, values)
+        return mask
+
+    def columns(self, mask):
+        """Индексы столбцов маски по возрастанию"""
+        if not mask:
+            return np.zeros(0, dtype=np.intp)
+        raw = np.frombuffer(mask.to_bytes((mask.bit_length() + 7) // 8, 'little'), dtype=np.uint8)
+        return np.flatnonzero(np.unpackbits(raw, bitorder='little'))
+
+    def battles(self, mask):
+        """BattleRecord маски в порядке времени (равные по времени - в порядке добавления)"""
+        cols = self.columns(mask)
+        order = np.argsort(np.asarray(self.times, dtype=np.int64)[cols], kind='stable')
+        return [self.records[col] for col in cols[order].tolist()]
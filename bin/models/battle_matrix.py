@@ -0,0 +1,569 @@
+import copy
+
+import numpy as np
+
+from .schemas import PlayerTotals
+
+# Начальная емкость по игрокам и боям, при нехватке удваивается
+_INITIAL_PLAYERS = 64
+_INITIAL_BATTLES = 64
+# Начальная емкость разреженного хранилища (ячеек)
+_INITIAL_ENTRIES = 1024
+# Идентификатор техники в пустой ячейке
+NO_VEHICLE = -1
+
+# Режимы хранения:
+# 'auto'   - плотный, пока доля заполненных ячеек не упадет ниже SPARSE_DENSITY
+# 'dense'  - плотные массивы игрок × бой
+# 'sparse' - только заполненные ячейки, сжатые по столбцам
+STORAGE_MODES = ('auto', 'dense', 'sparse')
+# В режиме 'auto' разреженное хранение включается, когда заполнено
+# меньше этой доли ячеек, а матрица не меньше SPARSE_MIN_CELLS
+SPARSE_DENSITY = 0.2
+SPARSE_MIN_CELLS = 100_000
+
+# Накопленные итоги по игрокам, столбцы массива totals
+TOTAL_FIELDS = PlayerTotals._fields
+_BATTLES, _DAMAGE, _KILLS, _SURVIVED, _WINS = range(len(TOTAL_FIELDS))
+
+# Поля значений ячейки и их типы; won - победила ли команда игрока
+_FIELDS = (('vehicle', np.int32, NO_VEHICLE), ('damage', np.int32, 0),
+           ('health', np.int32, 0), ('kills', np.int16, 0), ('won', np.int8, 0))
+
+
+class _DenseStore:
+    """Плотные массивы (строка - игрок, столбец - бой) и маска played"""
+
+    kind = 'dense'
+
+    def __init__(self):
+        self.nnz = 0
+        for name, dtype, fill in _FIELDS:
+            setattr(self, name, np.full((_INITIAL_PLAYERS, _INITIAL_BATTLES), fill, dtype=dtype))
+        self.played = np.zeros((_INITIAL_PLAYERS, _INITIAL_BATTLES), dtype=bool)
+
+    def _ensure_capacity(self, rows, cols):
+        """Увеличивает массивы вдвое, если индексы не помещаются"""
+        cap_rows, cap_cols = self.played.shape
+        if rows <= cap_rows and cols <= cap_cols:
+            return
+        new_rows = max(cap_rows, 1)
+        while new_rows < rows:
+            new_rows *= 2
+        new_cols = max(cap_cols, 1)
+        while new_cols < cols:
+            new_cols *= 2
+
+        for name, _, fill in _FIELDS + (('played', bool, False),):
+            old = getattr(self, name)
+            new = np.full((new_rows, new_cols), fill, dtype=old.dtype)
+            new[:cap_rows, :cap_cols] = old
+            setattr(self, name, new)
+
+    def add_column(self, col, n_rows, rows, values):
+        self._ensure_capacity(n_rows, col + 1)
+        if not rows:
+            return
+        for (name, _, _), column in zip(_FIELDS, values):
+            getattr(self, name)[rows, col] = column
+        self.played[rows, col] = True
+        self.nnz += len(rows)
+
+    def cell(self, row, col):
+        if not self.played[row, col]:
+            return None
+        return tuple(int(getattr(self, name)[row, col]) for name, _, _ in _FIELDS)
+
+    def column(self, col, n_rows):
+        """Заполненные ячейки одного боя: (строки, значения)"""
+        rows = np.flatnonzero(self.played[:n_rows, col])
+        return rows, [getattr(self, name)[rows, col] for name, _, _ in _FIELDS]
+
+    def block(self, rows, cols):
+        index = np.ix_(rows, cols)
+        return (self.played[index],) + tuple(getattr(self, name)[index] for name, _, _ in _FIELDS)
+
+    def compact(self, n_rows, n_cols):
+        """Копия без запаса емкости - для сохранения"""
+        store = copy.copy(self)
+        for name in tuple(name for name, _, _ in _FIELDS) + ('played',):
+            setattr(store, name, getattr(self, name)[:max(n_rows, 1), :max(n_cols, 1)].copy())
+        return store
+
+    def entries(self, n_cols):
+        """Все заполненные ячейки по столбцам: (указатели столбцов, строки, значения)"""
+        played = self.played[:, :n_cols]
+        cols, rows = np.nonzero(played.T)
+        col_ptr = np.zeros(n_cols + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cols, minlength=n_cols), out=col_ptr[1:])
+        return col_ptr, rows, [getattr(self, name)[rows, cols] for name, _, _ in _FIELDS]
+
+    def merge_rows(self, source, target, n_rows, n_cols):
+        """
+        Переносит ячейки строки source в строку target и очищает source.
+        В боях, где у target уже есть ячейка, остается она; возвращает
+        значения отброшенных ячеек source
+        """
+        played = self.played[source, :n_cols]
+        conflict = np.flatnonzero(played & self.played[target, :n_cols])
+        moved = np.flatnonzero(played & ~self.played[target, :n_cols])
+        dropped = [getattr(self, name)[source, conflict] for name, _, _ in _FIELDS]
+        for name, _, fill in _FIELDS + (('played', bool, False),):
+            array = getattr(self, name)
+            array[target, moved] = array[source, moved]
+            array[source] = fill
+        self.nnz -= len(conflict)
+        return dropped
+
+    def move_row(self, source, target, n_cols):
+        """Переносит строку source на место пустой строки target"""
+        for name, _, fill in _FIELDS + (('played', bool, False),):
+            array = getattr(self, name)
+            array[target] = array[source]
+            array[source] = fill
+
+
+class _SparseStore:
+    """
+    Разреженное хранение: только заполненные ячейки.
+    Бои добавляются столбцами, поэтому ячейки лежат подряд по столбцам
+    (CSC): col_ptr[c]:col_ptr[c + 1] - ячейки боя c в параллельных
+    массивах row, vehicle, damage, health, kills
+    """
+
+    kind = 'sparse'
+
+    def __init__(self, col_ptr=None, rows=None, values=None):
+        self.col_ptr = [0] if col_ptr is None else col_ptr.tolist()
+        self.nnz = self.col_ptr[-1]
+        capacity = max(_INITIAL_ENTRIES, self.nnz)
+        self.row = np.zeros(capacity, dtype=np.int32)
+        for name, dtype, fill in _FIELDS:
+            setattr(self, name, np.full(capacity, fill, dtype=dtype))
+        if self.nnz:
+            self.row[:self.nnz] = rows
+            for (name, _, _), column in zip(_FIELDS, values):
+                getattr(self, name)[:self.nnz] = column
+
+    def _ensure_capacity(self, size):
+        capacity = len(self.row)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in ('row',) + tuple(name for name, _, _ in _FIELDS):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.nnz] = old[:self.nnz]
+            setattr(self, name, new)
+
+    def add_column(self, col, n_rows, rows, values):
+        start = self.nnz
+        end = start + len(rows)
+        self._ensure_capacity(end)
+        self.row[start:end] = rows
+        for (name, _, _), column in zip(_FIELDS, values):
+            getattr(self, name)[start:end] = column
+        self.nnz = end
+        self.col_ptr.append(end)
+
+    def cell(self, row, col):
+        start, end = self.col_ptr[col], self.col_ptr[col + 1]
+        hits = np.flatnonzero(self.row[start:end] == row)
+        if not len(hits):
+            return None
+        pos = start + hits[0]
+        return tuple(int(getattr(self, name)[pos]) for name, _, _ in _FIELDS)
+
+    def column(self, col, n_rows):
+        start, end = self.col_ptr[col], self.col_ptr[col + 1]
+        return self.row[start:end], [getattr(self, name)[start:end] for name, _, _ in _FIELDS]
+
+    def compact(self, n_rows, n_cols):
+        store = copy.copy(self)
+        store.col_ptr = list(self.col_ptr)
+        for name in ('row',) + tuple(name for name, _, _ in _FIELDS):
+            setattr(store, name, getattr(self, name)[:max(self.nnz, 1)].copy())
+        return store
+
+    def block(self, rows, cols):
+        """Плотный блок только для выбранных строк и столбцов (для показа)"""
+        size = max(int(self.row[:self.nnz].max(initial=-1)), int(rows.max(initial=-1))) + 1
+        position = np.full(size, -1, dtype=np.intp)
+        position[rows] = np.arange(len(rows))
+
+        played = np.zeros((len(rows), len(cols)), dtype=bool)
+        out = [np.full((len(rows), len(cols)), fill, dtype=dtype) for _, dtype, fill in _FIELDS]
+        for j, col in enumerate(cols.tolist()):
+            start, end = self.col_ptr[col], self.col_ptr[col + 1]
+            target = position[self.row[start:end]]
+            keep = target >= 0
+            target = target[keep]
+            played[target, j] = True
+            for (name, _, _), array in zip(_FIELDS, out):
+                array[target, j] = getattr(self, name)[start:end][keep]
+        return (played,) + tuple(out)
+
+    def merge_rows(self, source, target, n_rows, n_cols):
+        n = self.nnz
+        rows = self.row[:n]
+        col_ptr = np.asarray(self.col_ptr, dtype=np.int64)
+        cols = np.repeat(np.arange(len(col_ptr) - 1), np.diff(col_ptr))
+        positions = np.flatnonzero(rows == source)
+        conflict = positions[np.isin(cols[positions], cols[rows == target])]
+        dropped = [getattr(self, name)[conflict] for name, _, _ in _FIELDS]
+        rows[positions] = target
+        if len(conflict):
+            # Ячейки лежат по столбцам, поэтому удаление сдвигает указатели столбцов
+            keep = np.ones(n, dtype=bool)
+            keep[conflict] = False
+            for name in ('row',) + tuple(name for name, _, _ in _FIELDS):
+                array = getattr(self, name)
+                array[:n - len(conflict)] = array[:n][keep]
+            self.nnz = n - len(conflict)
+            self.col_ptr = (col_ptr - np.searchsorted(conflict, col_ptr)).tolist()
+        return dropped
+
+    def move_row(self, source, target, n_cols):
+        rows = self.row[:self.nnz]
+        rows[rows == source] = target
+
+
+class BattleMatrix:
+    """
+    Столбцовое хранилище матрицы игрок × бой.
+
+    Игроки (по accountDBID), бои и названия техники получают
+    целочисленные индексы, имена хранятся один раз в players,
+    а значения лежат в NumPy массивах: vehicle (id названия), damage,
+    health, kills, won и признак участия игрока в бою. Итоги по игрокам
+    (боев, урон, фраги, выживания, победы) накапливаются в totals
+    при добавлении боя, поэтому средние читаются без обхода матрицы.
+
+    Хранение плотное или разреженное (см. STORAGE_MODES); в режиме
+    'auto' матрица сама переходит на разреженное хранение, когда
+    большинство игроков есть лишь в малой части боев
+    """
+
+    def __init__(self, storage='auto'):
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"Неизвестный режим хранения: {storage}")
+        self.storage = storage
+        self.players = []        # индекс строки -> имя игрока (из самого нового боя)
+        self.name_times = []     # индекс строки -> timestamp боя, из которого взято имя
+        self.player_ids = []     # индекс строки -> accountDBID (0 - неизвестен)
+        self.player_index = {}   # accountDBID -> индекс строки
+        self.name_index = {}     # имя игрока (в т.ч. прежние) -> индекс строки
+        self.battle_ids = []     # индекс столбца -> battle_id
+        self.battle_index = {}   # battle_id -> индекс столбца
+        self.vehicle_names = []  # id техники -> короткое название
+        self.vehicle_index = {}  # короткое название -> id техники
+        # Строка - игрок, столбцы - TOTAL_FIELDS
+        self.totals = np.zeros((_INITIAL_PLAYERS, len(TOTAL_FIELDS)), dtype=np.int64)
+        # Пары (строка без accountDBID, строка игрока), которые надо слить
+        self.pending_merges = []
+
+        self.store = _SparseStore() if storage == 'sparse' else _DenseStore()
+
+    def __getstate__(self):
+        # Запас емкости массивов в снимок не пишется
+        state = self.__dict__.copy()
+        rows, cols = self.shape
+        state['store'] = self.store.compact(rows, cols)
+        state['totals'] = self.totals[:max(rows, 1)].copy()
+        return state
+
+    @property
+    def shape(self):
+        return len(self.players), len(self.battle_ids)
+
+    @property
+    def density(self):
+        """Доля заполненных ячеек"""
+        rows, cols = self.shape
+        return self.store.nnz / (rows * cols) if rows and cols else 1.0
+
+    def player_row(self, account_id, player_name, timestamp=0):
+        """
+        Индекс строки игрока, новый игрок получает следующую строку.
+        Игрок определяется по accountDBID, поэтому после смены ника
+        остается в той же строке. Показывается имя из самого нового боя
+        (timestamp - время боя, 0 - неизвестно), так что порядок
+        добавления реплеев на имя не влияет. Без accountDBID
+        (старые реплеи) игрок ищется по имени, в т.ч. прежнему; если
+        строку без accountDBID позже признает игрок с accountDBID,
+        она сливается с его строкой (см. apply_merges)
+        """
+        if not account_id:
+            row = self.name_index.get(player_name)
+            if row is None:
+                return self._new_row(0, player_name, timestamp)
+            self.rename(row, player_name, timestamp)
+            return row
+
+        row = self.player_index.get(account_id)
+        if row is None:
+            # Игрок мог уже встретиться в реплее без accountDBID
+            row = self.name_index.get(player_name)
+            if row is None or self.player_ids[row]:
+                return self._new_row(account_id, player_name, timestamp)
+            self.player_ids[row] = account_id
+            self.player_index[account_id] = row
+        self.rename(row, player_name, timestamp)
+        return row
+
+    def rename(self, row, player_name, timestamp):
+        """Имя из боя timestamp становится основным, если бой новее; прежнее остается для поиска"""
+        owner = self.name_index.get(player_name)
+        if owner is not None and owner != row and self.player_ids[row] and not self.player_ids[owner]:
+            # Строка с этим ником из реплеев без accountDBID - тот же игрок
+            self.pending_merges.append((owner, row))
+        if timestamp > self.name_times[row]:
+            self.players[row] = player_name
+            self.name_times[row] = timestamp
+            self.name_index[player_name] = row
+        else:
+            self.name_index.setdefault(player_name, row)
+
+    def _new_row(self, account_id, player_name, timestamp=0):
+        row = len(self.players)
+        self.players.append(player_name)
+        self.name_times.append(timestamp)
+        self.player_ids.append(account_id)
+        if row >= len(self.totals):
+            grown = np.zeros((len(self.totals) * 2, len(TOTAL_FIELDS)), dtype=np.int64)
+            grown[:row] = self.totals
+            self.totals = grown
+        self.name_index[player_name] = row
+        if account_id:
+            self.player_index[account_id] = row
+        return row
+
+    def vehicle_id(self, vehicle_name):
+        vid = self.vehicle_index.get(vehicle_name)
+        if vid is None:
+            vid = len(self.vehicle_names)
+            self.vehicle_index[vehicle_name] = vid
+            self.vehicle_names.append(vehicle_name)
+        return vid
+
+    def add_battle(self, battle_id, entries, timestamp=0):
+        """
+        Добавляет столбец боя.
+        entries - список (accountDBID, имя игрока, техника, урон, здоровье, фраги, победа),
+        timestamp - время боя, по нему выбирается показываемое имя игрока
+        """
+        col = len(self.battle_ids)
+        self.battle_index[battle_id] = col
+        self.battle_ids.append(battle_id)
+
+        # Одна ячейка на игрока в бою
+        cells = {self.player_row(entry[0], entry[1], timestamp): entry for entry in entries}
+        rows = list(cells)
+        entries = list(cells.values())
+        values = (
+            [self.vehicle_id(entry[2]) for entry in entries],
+            [entry[3] for entry in entries],
+            [entry[4] for entry in entries],
+            [entry[5] for entry in entries],
+            [int(bool(entry[6])) for entry in entries],
+        )
+        self.store.add_column(col, len(self.players), rows, values)
+        self.accumulate(rows, *values[1:])
+        self.apply_merges()
+        self.maybe_make_sparse()
+        return col
+
+    def accumulate(self, rows, damage, health, kills, wins):
+        """Добавляет результаты одного боя к итогам игроков (строки не повторяются)"""
+        if not rows:
+            return
+        totals = self.totals
+        totals[rows, _BATTLES] += 1
+        totals[rows, _DAMAGE] += damage
+        totals[rows, _KILLS] += kills
+        totals[rows, _SURVIVED] += np.asarray(health) > 0
+        totals[rows, _WINS] += wins
+
+    def merge_battle(self, other, battle_id):
+        """
+        Переносит бой из другой матрицы; игроки сопоставляются по accountDBID.
+        Имена в other - текущие, а не из этого боя, поэтому они не меняют
+        показываемые имена; их согласует merge_names
+        """
+        return self.add_battle(battle_id, other.battle_entries(battle_id))
+
+    def merge_names(self, other):
+        """
+        Имена игроков из другой матрицы: показывается имя из самого нового боя
+        среди обеих матриц (как при разборе всех реплеев вместе), поэтому
+        результат не зависит от того, как части группировались при объединении.
+        Прежние ники остаются для поиска по имени; строки без accountDBID
+        с ником игрока из other сливаются с его строкой, как при разборе
+        всех реплеев вместе
+        """
+        for other_row, name in enumerate(other.players):
+            account_id = other.player_ids[other_row]
+            row = self.player_index.get(account_id) if account_id else self.name_index.get(name)
+            if row is not None:
+                self.rename(row, name, other.name_times[other_row])
+        for name, other_row in other.name_index.items():
+            account_id = other.player_ids[other_row]
+            row = self.player_index.get(account_id) if account_id else None
+            if row is not None:
+                # Время 0 - имя только добавляется для поиска
+                self.rename(row, name, 0)
+        self.apply_merges()
+
+    def apply_merges(self):
+        """
+        Сливает строки из pending_merges: строка без accountDBID переходит
+        в строку игрока, на ее место встает последняя строка матрицы
+        """
+        pending, self.pending_merges = self.pending_merges, []
+        while pending:
+            source, target = pending.pop(0)
+            if source == target or self.player_ids[source]:
+                continue
+            last = len(self.players) - 1
+            self.merge_rows(source, target)
+
+            def moved(row):
+                row = target if row == source else row
+                return source if row == last else row
+
+            pending = [(moved(s), moved(t)) for s, t in pending]
+
+    def merge_rows(self, source, target):
+        """Переносит бои и прежние ники строки source в target и удаляет source"""
+        n_rows, n_cols = self.shape
+        totals = self.totals
+        # В общих боях остается ячейка target, отброшенные вычитаются из итогов
+        _, damage, health, kills, won = self.store.merge_rows(source, target, n_rows, n_cols)
+        totals[target] += totals[source]
+        totals[target] -= (len(damage), damage.sum(), kills.sum(), (health > 0).sum(), won.sum())
+        if self.name_times[source] > self.name_times[target]:
+            self.players[target] = self.players[source]
+            self.name_times[target] = self.name_times[source]
+
+        last = n_rows - 1
+        if source != last:
+            self.store.move_row(last, source, n_cols)
+            totals[source] = totals[last]
+            self.players[source] = self.players[last]
+            self.name_times[source] = self.name_times[last]
+            self.player_ids[source] = self.player_ids[last]
+            if self.player_ids[source]:
+                self.player_index[self.player_ids[source]] = source
+        totals[last] = 0
+        # Строка target сама могла быть последней и переехать на место source
+        target = source if target == last else target
+        for name, row in self.name_index.items():
+            if row == source:
+                self.name_index[name] = target
+            elif row == last:
+                self.name_index[name] = source
+        self.players.pop()
+        self.name_times.pop()
+        self.player_ids.pop()
+
+    def maybe_make_sparse(self):
+        """В режиме 'auto' переводит плотное хранение в разреженное"""
+        if self.storage != 'auto' or self.store.kind != 'dense':
+            return
+        rows, cols = self.shape
+        if rows * cols < SPARSE_MIN_CELLS or self.density >= SPARSE_DENSITY:
+            return
+        self.store = _SparseStore(*self.store.entries(cols))
+        print(f"🧮 Матрица {rows}×{cols} заполнена на {self.density:.0%}, "
+              f"переходим на разреженное хранение")
+
+    def __contains__(self, battle_id):
+        return battle_id in self.battle_index
+
+    def cell(self, player_name, battle_id):
+        """(техника, урон, здоровье, фраги) игрока в бою или None"""
+        row = self.name_index.get(player_name)
+        col = self.battle_index.get(battle_id)
+        if row is None or col is None:
+            return None
+        values = self.store.cell(row, col)
+        if values is None:
+            return None
+        return (self.vehicle_names[values[0]],) + values[1:4]
+
+    def row_sums(self, cols=None):
+        """
+        По строкам: (количество боев, суммарный урон, выживаний) - из накопленных итогов,
+        а если заданы столбцы cols - пересчитанные только по этим боям
+        """
+        totals = self.totals[:len(self.players)] if cols is None else self.subset_totals(cols)
+        return totals[:, _BATTLES], totals[:, _DAMAGE], totals[:, _SURVIVED]
+
+    def player_totals(self, player_name):
+        """PlayerTotals игрока по имени (в т.ч. прежнему) или None"""
+        row = self.name_index.get(player_name)
+        if row is None:
+            return None
+        return self.row_totals(row)
+
+    def row_totals(self, row):
+        return PlayerTotals(*self.totals[row].tolist())
+
+    def column(self, battle_id):
+        """
+        Ячейки одного боя: {строка игрока: (техника, урон, здоровье, фраги, победа)}.
+        Читается только столбец боя, без обхода матрицы
+        """
+        rows, values = self.store.column(self.battle_index[battle_id], len(self.players))
+        vehicle, damage, health, kills, won = (column.tolist() for column in values)
+        return {
+            row: (self.vehicle_names[vehicle[i]], damage[i], health[i], kills[i], bool(won[i]))
+            for i, row in enumerate(rows.tolist())
+        }
+
+    def battle_entries(self, battle_id):
+        """Ячейки боя в формате entries для add_battle"""
+        return [
+            (self.player_ids[row], self.players[row]) + cell
+            for row, cell in self.column(battle_id).items()
+        ]
+
+    def subset_totals(self, cols):
+        """
+        Итоги игроков (строки x TOTAL_FIELDS) только по выбранным боям:
+        читаются лишь их столбцы, матрица целиком не обходится
+        """
+        n_rows = len(self.players)
+        totals = np.zeros((n_rows, len(TOTAL_FIELDS)), dtype=np.int64)
+        columns = [self.store.column(col, n_rows) for col in cols]
+        if not columns:
+            return totals
+        rows = np.concatenate([rows for rows, _ in columns])
+        _, damage, health, kills, won = (np.concatenate([values[i] for _, values in columns])
+                                         for i in range(len(_FIELDS)))
+        totals[:, _BATTLES] = np.bincount(rows, minlength=n_rows)
+        totals[:, _DAMAGE] = np.bincount(rows, weights=damage, minlength=n_rows)
+        totals[:, _KILLS] = np.bincount(rows, weights=kills, minlength=n_rows)
+        totals[:, _SURVIVED] = np.bincount(rows[health > 0], minlength=n_rows)
+        totals[:, _WINS] = np.bincount(rows, weights=won, minlength=n_rows)
+        return totals
+
+    def battle_counts(self):
+        """Количество боев каждого игрока (по строкам)"""
+        return self.row_sums()[0]
+
+    def damage_totals(self):
+        """Суммарный урон каждого игрока"""
+        return self.row_sums()[1]
+
+    def survival_counts(self):
+        """Количество боев, в которых игрок выжил"""
+        return self.row_sums()[2]
+
+    def block(self, rows, cols):
+        """
+        Подматрица для таблицы: (played, vehicle, damage, health, kills, won)
+        для выбранных строк и столбцов в заданном порядке
+        """
+        return self.store.block(np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp))
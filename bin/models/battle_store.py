@@ -0,0 +1,363 @@
+import sqlite3
+from pathlib import Path
+
+from .replay_cache import default_cache_dir
+
+# Версия схемы архива; при изменении таблицы пересоздаются
+STORE_VERSION = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS battles (
+    id INTEGER PRIMARY KEY,
+    battle_key TEXT NOT NULL UNIQUE,  -- arenaUniqueID или "дата_карта"
+    timestamp INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    map TEXT NOT NULL,
+    file TEXT NOT NULL,
+    players_count INTEGER NOT NULL,
+    is_win INTEGER NOT NULL,
+    winner_team INTEGER NOT NULL,
+    player_team INTEGER,
+    clan TEXT NOT NULL,
+    clan_is_mixed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS battles_timestamp ON battles(timestamp);
+CREATE INDEX IF NOT EXISTS battles_map ON battles(map, timestamp);
+CREATE TABLE IF NOT EXISTS players (
+    id INTEGER PRIMARY KEY,
+    account_id INTEGER UNIQUE,  -- NULL в старых реплеях без accountDBID
+    name TEXT NOT NULL,         -- имя из самого нового боя
+    name_time INTEGER NOT NULL  -- timestamp боя, из которого взято имя
+);
+CREATE INDEX IF NOT EXISTS players_name ON players(name);
+-- Все ники игроков, в т.ч. прежние, - для поиска по имени (как BattleMatrix.name_index)
+CREATE TABLE IF NOT EXISTS player_names (
+    name TEXT PRIMARY KEY,
+    player_id INTEGER NOT NULL REFERENCES players(id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS player_names_player ON player_names(player_id);
+CREATE TABLE IF NOT EXISTS participants (
+    battle_id INTEGER NOT NULL REFERENCES battles(id),
+    player_id INTEGER NOT NULL REFERENCES players(id),
+    vehicle TEXT NOT NULL,
+    damage INTEGER NOT NULL,
+    health INTEGER NOT NULL,
+    kills INTEGER NOT NULL,
+    won INTEGER NOT NULL,
+    PRIMARY KEY (battle_id, player_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS participants_player ON participants(player_id, battle_id);
+CREATE INDEX IF NOT EXISTS participants_vehicle ON participants(vehicle);
+CREATE TABLE IF NOT EXISTS battle_clans (
+    battle_id INTEGER NOT NULL REFERENCES battles(id),
+    clan TEXT NOT NULL,  -- клан соперника
+    PRIMARY KEY (battle_id, clan)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS battle_clans_clan ON battle_clans(clan, battle_id);
+
+-- Участник боя вместе с боем и именем - основа выборок с фильтрами
+CREATE VIEW IF NOT EXISTS battle_participants AS
+SELECT b.id AS battle_id, b.timestamp, b.date, b.map, b.is_win, b.clan,
+       p.player_id, pl.name, p.vehicle, p.damage, p.health, p.kills, p.won
+FROM participants p
+JOIN battles b ON b.id = p.battle_id
+JOIN players pl ON pl.id = p.player_id;
+
+-- Итоги игроков по всему архиву
+CREATE VIEW IF NOT EXISTS player_totals AS
+SELECT player_id, name, COUNT(*) AS battles, SUM(damage) AS damage, SUM(kills) AS kills,
+       SUM(health > 0) AS survived, SUM(won) AS wins
+FROM battle_participants
+GROUP BY player_id;
+"""
+
+# Фильтры боев: имя -> условие на таблицу battles (псевдоним b)
+_FILTERS = {
+    'map': "b.map = ?",
+    'start': "b.timestamp >= ?",
+    'end': "b.timestamp <= ?",
+    'is_win': "b.is_win = ?",
+    'clan': "EXISTS (SELECT 1 FROM battle_clans c WHERE c.battle_id = b.id AND c.clan = ?)",
+    'player': ("EXISTS (SELECT 1 FROM participants p JOIN player_names n ON n.player_id = p.player_id "
+               "WHERE p.battle_id = b.id AND n.name = ?)"),
+    'vehicle': "EXISTS (SELECT 1 FROM participants p WHERE p.battle_id = b.id AND p.vehicle = ?)",
+}
+
+
+def default_store_path():
+    return default_cache_dir() / 'battle_archive.sqlite'
+
+
+class BattleStore:
+    """
+    Архив АБС боев в SQLite: бои, участники и кланы соперника
+    с индексами по игроку, карте, дате, клану и технике.
+
+    Анализатор добавляет в архив каждый учтенный бой, а выборки
+    (get_table_data, player_totals) строятся запросами SQL с фильтрами
+    по любым полям - в памяти только результат, а не весь архив
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else default_store_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path))
+        # Пары (игрок без accountDBID, игрок), которые надо слить
+        self.pending_merges = []
+        self.check_version()
+        self.conn.executescript(_SCHEMA)
+
+    def check_version(self):
+        """Пересоздает архив, записанный другой версией схемы"""
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row and row[0] == str(STORE_VERSION):
+            return
+        if row:
+            print("♻️ Формат архива боев изменился, архив будет собран заново")
+        for name in ('battle_participants', 'player_totals'):
+            self.conn.execute(f"DROP VIEW IF EXISTS {name}")
+        for name in ('battle_clans', 'participants', 'player_names', 'players', 'battles'):
+            self.conn.execute(f"DROP TABLE IF EXISTS {name}")
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",
+                          (str(STORE_VERSION),))
+        self.conn.commit()
+
+    def player_id(self, account_id, name, timestamp=0):
+        """
+        id игрока - по тем же правилам, что BattleMatrix.player_row:
+        по accountDBID, а без него - по имени, в т.ч. прежнему. Игрок,
+        встреченный раньше только в реплеях без accountDBID, получает
+        accountDBID, а не новую строку. Имя берется из самого нового боя
+        (timestamp - время боя)
+        """
+        if account_id:
+            row = self.conn.execute("SELECT id FROM players WHERE account_id = ?",
+                                    (account_id,)).fetchone()
+            if row is None:
+                # Игрок мог уже встретиться в реплее без accountDBID
+                row = self.conn.execute(
+                    "SELECT p.id FROM player_names n JOIN players p ON p.id = n.player_id "
+                    "WHERE n.name = ? AND p.account_id IS NULL", (name,)
+                ).fetchone()
+                if row is None:
+                    return self.new_player(account_id, name, timestamp)
+                self.conn.execute("UPDATE players SET account_id = ? WHERE id = ?", (account_id, row[0]))
+            self.rename(row[0], name, timestamp)
+            return row[0]
+
+        player_id = self.name_owner(name)
+        if player_id is None:
+            return self.new_player(None, name, timestamp)
+        self.rename(player_id, name, timestamp)
+        return player_id
+
+    def name_owner(self, name):
+        """id игрока с этим ником (текущим или прежним) или None"""
+        row = self.conn.execute("SELECT player_id FROM player_names WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def new_player(self, account_id, name, timestamp):
+        player_id = self.conn.execute("INSERT INTO players (account_id, name, name_time) VALUES (?, ?, ?)",
+                                      (account_id, name, timestamp)).lastrowid
+        self.conn.execute("INSERT OR REPLACE INTO player_names (name, player_id) VALUES (?, ?)",
+                          (name, player_id))
+        return player_id
+
+    def rename(self, player_id, name, timestamp):
+        """
+        Смена ника: имя из более нового боя становится основным, прежнее
+        остается для поиска. Игрок без accountDBID с этим ником ставится
+        в очередь на слияние (см. apply_merges)
+        """
+        owner = self.conn.execute(
+            "SELECT n.player_id, p.account_id FROM player_names n JOIN players p ON p.id = n.player_id "
+            "WHERE n.name = ?", (name,)
+        ).fetchone()
+        if owner and owner[0] != player_id and owner[1] is None:
+            row = self.conn.execute("SELECT account_id FROM players WHERE id = ?", (player_id,)).fetchone()
+            if row[0] is not None:
+                self.pending_merges.append((owner[0], player_id))
+        renamed = self.conn.execute("UPDATE players SET name = ?, name_time = ? WHERE id = ? AND name_time < ?",
+                                    (name, timestamp, player_id, timestamp)).rowcount
+        self.conn.execute(f"INSERT OR {'REPLACE' if renamed else 'IGNORE'} INTO player_names (name, player_id) "
+                          "VALUES (?, ?)", (name, player_id))
+
+    def apply_merges(self):
+        """
+        Сливает игроков из pending_merges: бои и ники игрока без accountDBID
+        переходят к игроку с accountDBID. В общих боях остается участие
+        игрока с accountDBID - как в BattleMatrix.merge_rows
+        """
+        pending, self.pending_merges = self.pending_merges, []
+        for source, target in pending:
+            row = self.conn.execute("SELECT name, name_time, account_id FROM players WHERE id = ?",
+                                    (source,)).fetchone()
+            if row is None or row[2] is not None or source == target:
+                continue
+            name, name_time, _ = row
+            self.conn.execute(
+                "DELETE FROM participants WHERE player_id = ? AND battle_id IN "
+                "(SELECT battle_id FROM participants WHERE player_id = ?)", (source, target)
+            )
+            self.conn.execute("UPDATE participants SET player_id = ? WHERE player_id = ?", (target, source))
+            self.conn.execute("UPDATE player_names SET player_id = ? WHERE player_id = ?", (target, source))
+            self.conn.execute("UPDATE players SET name = ?, name_time = ? WHERE id = ? AND name_time < ?",
+                              (name, name_time, target, name_time))
+            self.conn.execute("DELETE FROM players WHERE id = ?", (source,))
+
+    def merge_names(self, matrix):
+        """
+        Имена игроков из BattleMatrix (после merge_names): основные - если они
+        из более новых боев, прежние - для поиска. Игроки без accountDBID
+        с ником игрока сливаются с ним, как в матрице
+        """
+        for account_id, name, name_time in zip(matrix.player_ids, matrix.players, matrix.name_times):
+            player_id = self.known_player(account_id, name)
+            if player_id is not None:
+                self.rename(player_id, name, name_time)
+        for name, row in matrix.name_index.items():
+            account_id = matrix.player_ids[row]
+            player_id = self.known_player(account_id, None) if account_id else None
+            if player_id is not None:
+                # Время 0 - имя только добавляется для поиска
+                self.rename(player_id, name, 0)
+        self.apply_merges()
+
+    def known_player(self, account_id, name):
+        """id уже известного игрока по accountDBID, а без него - по нику; None, если нет"""
+        if account_id:
+            row = self.conn.execute("SELECT id FROM players WHERE account_id = ?", (account_id,)).fetchone()
+            return row[0] if row else None
+        return self.name_owner(name)
+
+    def add_battle(self, battle, entries, name_time=None):
+        """
+        Добавляет бой (BattleRecord) и его участников.
+        entries - как для BattleMatrix.add_battle:
+        (accountDBID, имя, техника, урон, здоровье, фраги, победа).
+        name_time - время, к которому относятся имена в entries
+        (по умолчанию время боя; 0 - имена не меняют уже известные).
+        Бой, который уже есть в архиве, пропускается; возвращает True, если добавлен
+        """
+        if name_time is None:
+            name_time = battle.timestamp
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO battles (battle_key, timestamp, date, map, file, players_count, "
+            "is_win, winner_team, player_team, clan, clan_is_mixed) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (str(battle.id), battle.timestamp, battle.date, battle.map, battle.file,
+             battle.players_count, int(battle.is_win), battle.winner_team, battle.player_team,
+             battle.clan, int(battle.clan_is_mixed))
+        )
+        if not cursor.rowcount:
+            return False
+        battle_id = cursor.lastrowid
+
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO participants (battle_id, player_id, vehicle, damage, health, kills, won) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(battle_id, self.player_id(account_id, name, name_time), vehicle, damage, health, kills, int(bool(won)))
+             for account_id, name, vehicle, damage, health, kills, won in entries]
+        )
+        self.apply_merges()
+        self.conn.executemany("INSERT OR IGNORE INTO battle_clans (battle_id, clan) VALUES (?, ?)",
+                              [(battle_id, clan) for clan in battle.opponent_clans()])
+        return True
+
+    def commit(self):
+        self.conn.commit()
+
+    def where(self, filters):
+        """WHERE для battles b по фильтрам из _FILTERS (условия объединяются через AND)"""
+        clauses, params = [], []
+        for name, value in filters.items():
+            if value is None:
+                continue
+            if name not in _FILTERS:
+                raise ValueError(f"Неизвестный фильтр архива: {name}")
+            clauses.append(_FILTERS[name])
+            params.append(int(value) if name == 'is_win' else value)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def battles(self, **filters):
+        """(id, дата, карта, победа, клан соперника) боев по фильтрам, по времени"""
+        where, params = self.where(filters)
+        return self.conn.execute(
+            f"SELECT b.id, b.date, b.map, b.is_win, b.clan FROM battles b{where} ORDER BY b.timestamp, b.id",
+            params
+        ).fetchall()
+
+    def player_totals(self, **filters):
+        """(имя, боев, урон, фраги, выживаний, побед) по игрокам в боях по фильтрам"""
+        where, params = self.where(filters)
+        if not where:
+            return self.conn.execute(
+                "SELECT name, battles, damage, kills, survived, wins FROM player_totals ORDER BY name"
+            ).fetchall()
+        return self.conn.execute(
+            "SELECT name, COUNT(*), SUM(damage), SUM(kills), SUM(health > 0), SUM(won) "
+            f"FROM battle_participants WHERE battle_id IN (SELECT b.id FROM battles b{where}) "
+            "GROUP BY player_id ORDER BY name",
+            params
+        ).fetchall()
+
+    def get_table_data(self, **filters):
+        """
+        Таблица по боям, подходящим под фильтры, в разреженном виде:
+        (headers, players, cells, total_battles). headers и строки players
+        ([имя, ср.урон, боев], по алфавиту) - как у BattleMatrixAnalyzer.get_table_data,
+        cells - {(индекс в players, индекс боя): ячейка} только для сыгранных боев.
+        Плотная таблица игрок × бой по архиву в памяти не строится, ее строку
+        собирает table_row. Например:
+        get_table_data(map='Прохоровка', is_win=True, clan='4BD', start=..., end=...)
+        """
+        where, params = self.where(filters)
+        battles = self.battles(**filters)
+        columns = {battle_id: index for index, (battle_id, *_) in enumerate(battles)}
+
+        headers = ['Игрок', 'Ср.урон', 'Боёв']
+        headers.extend(f"{date[:16]} {map_name}" for _, date, map_name, _, _ in battles)
+
+        rows = {}
+        players = []
+        for player_id, name, count, damage in self.conn.execute(
+            "SELECT player_id, name, COUNT(*), SUM(damage) FROM battle_participants "
+            f"WHERE battle_id IN (SELECT b.id FROM battles b{where}) "
+            "GROUP BY player_id ORDER BY name, player_id",
+            params
+        ):
+            rows[player_id] = len(players)
+            players.append([name, round(damage / count) if count else 0, count])
+
+        cells = {}
+        for player_id, battle_id, vehicle, damage, health, kills in self.conn.execute(
+            "SELECT player_id, battle_id, vehicle, damage, health, kills FROM participants "
+            f"WHERE battle_id IN (SELECT b.id FROM battles b{where})",
+            params
+        ):
+            cells[rows[player_id], columns[battle_id]] = {
+                'vehicle': vehicle, 'damage': damage, 'health': health, 'kills': kills
+            }
+
+        return headers, players, cells, len(battles)
+
+    @staticmethod
+    def table_row(players, cells, index, total_battles):
+        """Строка таблицы игрока players[index] с прочерками в несыгранных боях"""
+        return players[index] + [cells.get((index, col), '-') for col in range(total_battles)]
+
+    def maps(self):
+        """Карты боев архива, по алфавиту"""
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT map FROM battles ORDER BY map")]
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM battles").fetchone()[0]
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
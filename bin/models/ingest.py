@@ -0,0 +1,124 @@
+import os
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from .replay_reader import ReplayReader
+from .schemas import ParsedReplay
+
+# Количество рабочих процессов для разбора реплеев:
+# 0 - по числу ядер, 1 - последовательно в текущем процессе (для отладки)
+DEFAULT_WORKERS = 0
+# На маленьких наборах запуск процессов дороже самого разбора
+PARALLEL_MIN_FILES = 16
+# Сколько файлов отдавать процессу за раз
+_CHUNK_FILES = 8
+
+# Читатель рабочего процесса, создается один раз в _init_worker
+_worker_reader = None
+
+
+def resolve_workers(workers):
+    """Переводит настройку в число процессов: 0 и None - по числу ядер"""
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def parse_replay(reader, replay_path):
+    """Читает один реплей и возвращает ParsedReplay"""
+    metadata, results = reader.read(replay_path)
+    error = None
+    if not metadata or not results:
+        error = reader.last_error or 'not_found'
+    return ParsedReplay(
+        file=Path(replay_path).name,
+        metadata=metadata,
+        results=results,
+        bytes_read=reader.last_bytes_read,
+        file_size=reader.last_file_size,
+        error=error
+    )
+
+
+def _init_worker(reader_options):
+    global _worker_reader
+    _worker_reader = ReplayReader(**reader_options)
+
+
+def _parse_in_worker(replay_path):
+    return parse_replay(_worker_reader, replay_path)
+
+
+def iter_parsed_replays(file_paths, reader, workers=1, cache=None):
+    """
+    Разбирает файлы и выдает ParsedReplay в порядке file_paths.
+    Если передан cache (ReplayCache), уже известные реплеи берутся из него,
+    а разбираются только промахи; новые записи сохраняются в кэш.
+    При workers > 1 файлы читаются пулом процессов с теми же настройками,
+    что и reader; родительский процесс получает только компактные записи
+    и собирает их в исходном порядке, поэтому результат не зависит
+    от числа процессов
+    """
+    if cache is None:
+        yield from _parse_files(file_paths, reader, workers)
+        return
+
+    cached = [cache.lookup(replay_path, reader.battle_filter) for replay_path in file_paths]
+    misses = [replay_path for replay_path, (record, _) in zip(file_paths, cached) if record is None]
+    if cache.hits or cache.quarantined:
+        print(f"💾 Из кэша: {cache.hits}, в карантине: {cache.quarantined}, к разбору: {len(misses)}")
+
+    parsed = _parse_files(misses, reader, workers)
+    try:
+        for record, key in cached:
+            if record is None:
+                record = next(parsed)
+                cache.store(key, record, reader.battle_filter)
+            yield record
+    finally:
+        cache.commit()
+
+
+def replay_richness(parsed):
+    """Насколько полон реплей: больше статистики техники - лучше"""
+    return len(parsed.results.vehicles), len(parsed.metadata.vehicles)
+
+
+def dedupe_battles(records):
+    """
+    Оставляет по одному реплею на бой (arenaUniqueID).
+    Один бой, записанный несколькими сокомандниками, дает несколько файлов -
+    из них выбирается самый полный, при равенстве - первый по порядку.
+    Нечитаемые реплеи и реплеи без arenaUniqueID проходят как есть.
+    Возвращает (список записей в исходном порядке, число отброшенных копий)
+    """
+    records = list(records)
+    best = {}
+    for index, parsed in enumerate(records):
+        if parsed.error or not parsed.results.arena_unique_id:
+            continue
+        arena_id = parsed.results.arena_unique_id
+        current = best.get(arena_id)
+        if current is None or replay_richness(parsed) > replay_richness(records[current]):
+            best[arena_id] = index
+
+    kept = [
+        parsed for index, parsed in enumerate(records)
+        if parsed.error or not parsed.results.arena_unique_id
+        or best[parsed.results.arena_unique_id] == index
+    ]
+    return kept, len(records) - len(kept)
+
+
+def _parse_files(file_paths, reader, workers):
+    workers = min(resolve_workers(workers), len(file_paths))
+    if workers <= 1 or len(file_paths) < PARALLEL_MIN_FILES:
+        for replay_path in file_paths:
+            yield parse_replay(reader, replay_path)
+        return
+
+    print(f"⚙️ Разбор в {workers} процессах")
+    chunksize = max(1, min(_CHUNK_FILES, len(file_paths) // (workers * 4)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(reader.options(),)) as executor:
+        yield from executor.map(_parse_in_worker, file_paths, chunksize=chunksize)
@@ -0,0 +1,70 @@
+import json
+
+# Порядок выбора в режиме 'auto': самые быстрые из установленных
+AUTO_ORDER = ('orjson', 'msgspec', 'stdlib')
+JSON_BACKENDS = ('auto',) + AUTO_ORDER
+
+
+def _stdlib_loads():
+    """Стандартный json: сначала декодируем UTF-8 с пропуском битых байт"""
+    def loads(raw):
+        return json.loads(str(raw, 'utf-8', 'ignore'))
+    return loads
+
+
+def _orjson_loads():
+    """orjson принимает bytes и memoryview напрямую"""
+    import orjson
+    return orjson.loads
+
+
+def _msgspec_loads():
+    """msgspec принимает любой буфер; его ошибки приводим к ValueError"""
+    import msgspec
+    decode = msgspec.json.decode
+
+    def loads(raw):
+        try:
+            return decode(raw)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+    return loads
+
+
+_FACTORIES = {
+    'stdlib': _stdlib_loads,
+    'orjson': _orjson_loads,
+    'msgspec': _msgspec_loads,
+}
+
+
+def available_backends():
+    """Возвращает список установленных бэкендов"""
+    names = []
+    for name in AUTO_ORDER:
+        try:
+            _FACTORIES[name]()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_json_backend(name='auto'):
+    """
+    Возвращает (имя, loads) для выбранного бэкенда.
+    loads принимает bytes или memoryview и бросает ValueError при ошибке.
+    Если бэкенд не установлен - используется стандартный json
+    """
+    if name not in JSON_BACKENDS:
+        raise ValueError(f"Неизвестный JSON бэкенд: {name}")
+
+    candidates = AUTO_ORDER if name == 'auto' else (name,)
+    for candidate in candidates:
+        try:
+            return candidate, _FACTORIES[candidate]()
+        except ImportError:
+            continue
+
+    print(f"⚠️ JSON бэкенд {name} не установлен, используем стандартный json")
+    return 'stdlib', _FACTORIES['stdlib']()
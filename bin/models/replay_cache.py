@@ -0,0 +1,331 @@
+import os
+import sys
+import time
+import pickle
+import sqlite3
+import hashlib
+from pathlib import Path
+
+from .schemas import ParsedReplay
+from .replay_reader import TRANSIENT_FAILURES
+
+# Версия формата записей в кэше. Увеличивается при изменении ParsedReplay
+# и схем в schemas.py - старый кэш тогда очищается при открытии
+CACHE_VERSION = 7
+
+# Не попадают в карантин: временные ошибки (TRANSIENT_FAILURES -
+# файл занят клиентом, нет прав, не хватило времени), а 'filtered' - не ошибка,
+# а бой, отсеянный фильтром анализатора; такие бои запоминаются
+# отдельно для каждого фильтра (таблица filtered)
+NOT_QUARANTINED = TRANSIENT_FAILURES | {'filtered'}
+
+# Ограничения по умолчанию: записи, не использованные дольше срока,
+# удаляются, а при превышении размера - самые давно использованные
+DEFAULT_MAX_AGE_DAYS = 180
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Быстрый хэш содержимого: начало и конец файла плюс размер.
+# JSON блоки лежат в начале, конец отличает реплеи одного боя
+_HASH_CHUNK = 64 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS replays (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    record BLOB NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS replays_hash ON replays(content_hash);
+CREATE INDEX IF NOT EXISTS replays_accessed ON replays(accessed);
+CREATE TABLE IF NOT EXISTS quarantine (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    failed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS filtered (
+    path TEXT NOT NULL,
+    battle_filter TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    checked_at REAL NOT NULL,
+    PRIMARY KEY (path, battle_filter)
+) WITHOUT ROWID;
+"""
+
+
+def default_cache_dir():
+    """Папка данных пользователя для кэша"""
+    if sys.platform == "win32":
+        base = os.environ.get('LOCALAPPDATA') or Path.home() / 'AppData' / 'Local'
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'MirTankovABSReplayAnalyzer'
+
+
+def default_cache_path():
+    return default_cache_dir() / 'replay_cache.sqlite'
+
+
+def fast_content_hash(replay_path, size):
+    """blake2b от размера, первых и последних 64 КБ файла"""
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(replay_path, 'rb') as f:
+        h.update(f.read(_HASH_CHUNK))
+        if size > _HASH_CHUNK:
+            f.seek(max(_HASH_CHUNK, size - _HASH_CHUNK))
+            h.update(f.read(_HASH_CHUNK))
+    return h.hexdigest()
+
+
+class ReplayCache:
+    """
+    Постоянный кэш разобранных реплеев (ParsedReplay) в SQLite.
+
+    Реплеи после боя не меняются, поэтому запись ищется по пути,
+    а размер и mtime подтверждают, что файл тот же - на каждый файл
+    один stat и один запрос по индексу. Если файл переместили
+    или скопировали, запись находится по быстрому хэшу содержимого.
+    Кэшируются только успешно разобранные реплеи; файлы, которые
+    разобрать не удалось, попадают в карантин с причиной и отпечатком
+    и при следующих запусках пропускаются без чтения, пока файл
+    не изменится или карантин не будет снят (release_quarantine).
+    Так же без чтения пропускаются бои, уже отсеянные тем же
+    фильтром типа боя (ReplayReader.battle_filter)
+    """
+
+    def __init__(self, path=None, max_age_days=DEFAULT_MAX_AGE_DAYS, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = Path(path) if path else default_cache_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.executescript(_SCHEMA)
+        self.check_version()
+
+        # Статистика последнего анализа
+        self.hits = 0
+        self.misses = 0
+        self.quarantined = 0
+        self._touched = []
+
+    def check_version(self):
+        """Очищает кэш, записанный другой версией формата"""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row and row[0] == str(CACHE_VERSION):
+            return
+        if row:
+            print("♻️ Формат кэша реплеев изменился, кэш очищен")
+        self.conn.execute("DELETE FROM replays")
+        # Новая версия разбора может справиться с прежде нечитаемыми файлами
+        self.conn.execute("DELETE FROM quarantine")
+        self.conn.execute("DELETE FROM filtered")
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",
+                          (str(CACHE_VERSION),))
+        self.conn.commit()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.quarantined = 0
+
+    def lookup(self, replay_path, battle_filter=None):
+        """
+        Возвращает (ParsedReplay или None, ключ файла).
+        Ключ нужен для store() после разбора промаха.
+        battle_filter - фильтр читателя: бой, который он уже отсеял,
+        возвращается как ParsedReplay с ошибкой 'filtered'
+        """
+        path = str(Path(replay_path).resolve())
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.misses += 1
+            return None, None
+
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, content_hash, record FROM replays WHERE path = ?", (path,)
+        ).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            record = self.unpack(row[3])
+            if record is not None:
+                self.hits += 1
+                self._touched.append(path)
+                return record, None
+
+        if battle_filter:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns FROM filtered WHERE path = ? AND battle_filter = ?",
+                (path, battle_filter)
+            ).fetchone()
+            if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+                self.hits += 1
+                return ParsedReplay(
+                    file=Path(path).name, metadata=None, results=None, bytes_read=0,
+                    file_size=st.st_size, error='filtered', from_cache=True
+                ), None
+
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, reason FROM quarantine WHERE path = ?", (path,)
+        ).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            self.quarantined += 1
+            return ParsedReplay(
+                file=Path(path).name, metadata=None, results=None, bytes_read=0,
+                file_size=st.st_size, error=row[2], from_cache=True
+            ), None
+
+        # Путь новый или файл изменился - ищем то же содержимое под другим путем
+        try:
+            content_hash = fast_content_hash(path, st.st_size)
+        except OSError:
+            self.misses += 1
+            return None, None
+        key = (path, st.st_size, st.st_mtime_ns, content_hash)
+
+        row = self.conn.execute(
+            "SELECT record FROM replays WHERE content_hash = ? AND size = ? LIMIT 1",
+            (content_hash, st.st_size)
+        ).fetchone()
+        record = self.unpack(row[0]) if row else None
+        if record is None:
+            self.misses += 1
+            return None, key
+
+        self.hits += 1
+        record = record._replace(file=Path(path).name)
+        self.put(key, record)
+        return record, None
+
+    def unpack(self, blob):
+        try:
+            return pickle.loads(blob)
+        except Exception:
+            return None
+
+    def put(self, key, record):
+        path, size, mtime_ns, content_hash = key
+        self.conn.execute(
+            "INSERT OR REPLACE INTO replays (path, size, mtime_ns, content_hash, record, accessed) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (path, size, mtime_ns, content_hash,
+             pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL), time.time())
+        )
+
+    def store(self, key, record, battle_filter=None):
+        """
+        Сохраняет разобранный реплей, нечитаемый - отправляет в карантин,
+        а отсеянный фильтром battle_filter - запоминает для этого фильтра
+        """
+        if key is None:
+            return
+        if record.error == 'filtered':
+            if battle_filter:
+                path, size, mtime_ns, _ = key
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO filtered (path, battle_filter, size, mtime_ns, checked_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (path, battle_filter, size, mtime_ns, time.time())
+                )
+            return
+        if record.error:
+            if record.error not in NOT_QUARANTINED:
+                self.quarantine(key, record.error)
+            return
+        self.put(key, record._replace(bytes_read=0, from_cache=True))
+
+    def quarantine(self, key, reason):
+        path, size, mtime_ns, content_hash = key
+        self.conn.execute(
+            "INSERT OR REPLACE INTO quarantine (path, size, mtime_ns, content_hash, reason, failed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (path, size, mtime_ns, content_hash, reason, time.time())
+        )
+
+    def quarantined_files(self):
+        """Список (путь, причина, время ошибки) файлов в карантине"""
+        return self.conn.execute(
+            "SELECT path, reason, failed_at FROM quarantine ORDER BY failed_at DESC, path"
+        ).fetchall()
+
+    def release_quarantine(self, paths=None):
+        """Снимает карантин со всех или указанных файлов - они будут разобраны заново"""
+        if paths is None:
+            released = self.conn.execute("DELETE FROM quarantine").rowcount
+        else:
+            released = self.conn.executemany(
+                "DELETE FROM quarantine WHERE path = ?",
+                ((str(Path(p).resolve()),) for p in paths)
+            ).rowcount
+        self.conn.commit()
+        print(f"🔄 Снят карантин с файлов: {released}")
+        return released
+
+    def commit(self):
+        """Записывает накопленные изменения и время использования попаданий"""
+        if self._touched:
+            now = time.time()
+            self.conn.executemany("UPDATE replays SET accessed = ? WHERE path = ?",
+                                  ((now, path) for path in self._touched))
+            self._touched = []
+        self.conn.commit()
+
+    def evict(self):
+        """Удаляет устаревшие записи и ужимает кэш до max_bytes"""
+        removed = 0
+        if self.max_age_days:
+            cutoff = time.time() - self.max_age_days * 86400
+            removed += self.conn.execute("DELETE FROM replays WHERE accessed < ?", (cutoff,)).rowcount
+            removed += self.conn.execute("DELETE FROM filtered WHERE checked_at < ?", (cutoff,)).rowcount
+            # Старый карантин снимается - файл будет разобран заново
+            removed += self.conn.execute("DELETE FROM quarantine WHERE failed_at < ?", (cutoff,)).rowcount
+
+        if self.max_bytes:
+            total = self.size_bytes()
+            if total > self.max_bytes:
+                # Самые давно использованные записи уходят первыми
+                rows = self.conn.execute(
+                    "SELECT path, length(record) FROM replays ORDER BY accessed"
+                ).fetchall()
+                excess = total - self.max_bytes
+                doomed = []
+                for path, length in rows:
+                    if excess <= 0:
+                        break
+                    doomed.append((path,))
+                    excess -= length
+                self.conn.executemany("DELETE FROM replays WHERE path = ?", doomed)
+                removed += len(doomed)
+
+        self.conn.commit()
+        if removed:
+            print(f"🧹 Из кэша реплеев удалено устаревших записей: {removed}")
+        return removed
+
+    def size_bytes(self):
+        return self.conn.execute("SELECT COALESCE(SUM(length(record)), 0) FROM replays").fetchone()[0]
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM replays").fetchone()[0]
+
+    def clear(self):
+        """Полностью очищает кэш и карантин (перестроение при следующем анализе)"""
+        self.conn.execute("DELETE FROM replays")
+        self.conn.execute("DELETE FROM quarantine")
+        self.conn.execute("DELETE FROM filtered")
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+        print("🗑️ Кэш реплеев очищен")
+
+    def close(self):
+        self.commit()
+        self.conn.close()
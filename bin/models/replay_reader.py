@@ -0,0 +1,592 @@
+import os
+import json
+import mmap
+import time
+import struct
+
+from .json_backends import get_json_backend
+from .schemas import ReplayMetadata, BattleResults
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для стратегии 'numpy'
+    np = None
+
+# Сигнатура контейнера .mtreplay (первые 4 байта файла, little-endian)
+REPLAY_MAGIC = 0x11343212
+# Больше блоков в заголовке не бывает - иначе это не реплей
+MAX_BLOCKS = 16
+
+_HEADER = struct.Struct('<II')     # magic, количество JSON блоков
+_BLOCK_SIZE = struct.Struct('<I')  # длина очередного JSON блока
+
+# Режимы чтения:
+# 'prefix' - только заголовок и JSON блоки
+# 'mmap'   - отображение файла в память, блоки декодируются без копирования
+# 'full'   - весь файл целиком (старое поведение)
+READ_MODES = ('prefix', 'mmap', 'full')
+
+# Стратегии резервного поиска JSON блоков:
+# 'linear' - find + raw_decode (по умолчанию)
+# 'numpy'  - векторизованный поиск границ, при неудаче - 'linear'
+SCAN_STRATEGIES = ('linear', 'numpy')
+
+# Бюджет резервного поиска JSON в файлах с нераспознанным заголовком
+DEFAULT_SCAN_BYTES = 16 * 1024 * 1024
+DEFAULT_SCAN_SECONDS = 5.0
+# Неудачная попытка короче этого порога не позволяет перепрыгнуть байты
+_SHORT_ATTEMPT = 64
+# Начальное окно разбора кандидата, при нехватке удваивается
+_FIRST_WINDOW = 256
+# Начальное окно векторизованного поиска
+_FIRST_NUMPY_WINDOW = 1024 * 1024
+
+# Фильтры типа боя, которые проверяются по блоку metadata
+# до чтения и декодирования блока results:
+# None  - без фильтра
+# 'abs' - пропускать случайные бои 15×15
+BATTLE_FILTERS = (None, 'abs')
+# Столько участников бывает только в случайном бою (15 на 15)
+RANDOM_BATTLE_PLAYERS = 30
+
+# Причины, по которым не удалось извлечь данные из реплея
+FAILURE_REASONS = {
+    'read_error': 'ошибка чтения файла',
+    'not_found': 'JSON блоки не найдены',
+    'budget_exceeded': 'превышен лимит разбора',
+    'time_exceeded': 'превышено время разбора',
+}
+
+# Временные неудачи: файл занят клиентом игры, нет прав, машина
+# была загружена и не уложилась в max_scan_seconds и т.п. -
+# при следующем анализе или добавлении такой файл разбирается снова
+TRANSIENT_FAILURES = {'read_error', 'time_exceeded'}
+
+_decoder = json.JSONDecoder()
+
+
+def parse_block_spans(data):
+    """
+    Разбирает заголовок контейнера реплея:
+    magic (4 байта) | количество блоков (4 байта) | [длина (4 байта) + JSON] * N
+
+    Возвращает список (начало, конец) для каждого JSON блока
+    или None, если файл не похож на известный формат
+    """
+    if len(data) < _HEADER.size:
+        return None
+
+    magic, blocks_count = _HEADER.unpack_from(data, 0)
+    if magic != REPLAY_MAGIC or not 0 < blocks_count <= MAX_BLOCKS:
+        return None
+
+    spans = []
+    pos = _HEADER.size
+    for _ in range(blocks_count):
+        if pos + _BLOCK_SIZE.size > len(data):
+            return None
+        (block_size,) = _BLOCK_SIZE.unpack_from(data, pos)
+        pos += _BLOCK_SIZE.size
+
+        end = pos + block_size
+        # Блок должен целиком помещаться в файл и начинаться с JSON
+        if block_size == 0 or end > len(data) or data[pos] not in b'{[':
+            return None
+
+        spans.append((pos, end))
+        pos = end
+
+    return spans
+
+
+def read_header(f):
+    """
+    Читает заголовок контейнера из начала файла.
+    Возвращает (количество блоков, прочитано байт);
+    количество равно None, если заголовок не распознан
+    """
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None, len(header)
+
+    magic, blocks_count = _HEADER.unpack(header)
+    if magic != REPLAY_MAGIC or not 0 < blocks_count <= MAX_BLOCKS:
+        return None, len(header)
+    return blocks_count, len(header)
+
+
+def read_block(f, remaining):
+    """
+    Читает очередной JSON блок с его длиной.
+    remaining - сколько байт осталось в файле.
+    Возвращает (блок или None, прочитано байт)
+    """
+    raw_size = f.read(_BLOCK_SIZE.size)
+    if len(raw_size) < _BLOCK_SIZE.size:
+        return None, len(raw_size)
+    (block_size,) = _BLOCK_SIZE.unpack(raw_size)
+
+    # Длину проверяем до чтения, чтобы мусор не заставил читать весь файл
+    if block_size == 0 or _BLOCK_SIZE.size + block_size > remaining:
+        return None, len(raw_size)
+
+    block = f.read(block_size)
+    bytes_read = len(raw_size) + len(block)
+    if len(block) < block_size or block[:1] not in (b'{', b'['):
+        return None, bytes_read
+    return block, bytes_read
+
+
+def read_header_blocks(f, file_size):
+    """
+    Читает из открытого файла только заголовок и JSON блоки,
+    не трогая поток пакетов за ними.
+
+    Возвращает (список блоков, прочитано байт).
+    Список равен None, если заголовок не распознан
+    """
+    blocks_count, bytes_read = read_header(f)
+    if blocks_count is None:
+        return None, bytes_read
+
+    blocks = []
+    for _ in range(blocks_count):
+        block, block_bytes = read_block(f, file_size - bytes_read)
+        bytes_read += block_bytes
+        if block is None:
+            return None, bytes_read
+        blocks.append(block)
+
+    return blocks, bytes_read
+
+
+def battle_filter_rejects(battle_filter, metadata):
+    """Проверяет сырой блок metadata фильтром типа боя"""
+    if battle_filter == 'abs':
+        vehicles = metadata.get('vehicles')
+        if not isinstance(vehicles, dict):
+            return False
+        # Как в ReplayMetadata.from_json: учитываются только записи-словари
+        return sum(isinstance(v, dict) for v in vehicles.values()) == RANDOM_BATTLE_PLAYERS
+    return False
+
+
+def classify_block(block, metadata=None, results=None):
+    """
+    Определяет, что содержится в JSON блоке.
+    Блок результатов обычно является списком, где первый элемент -
+    словарь с 'vehicles', 'personal' и 'common'
+    """
+    candidates = block if isinstance(block, list) else [block]
+    for j in candidates:
+        if not isinstance(j, dict):
+            continue
+        if 'clientVersionFromXml' in j:
+            metadata = j
+        if 'vehicles' in j and 'personal' in j and 'common' in j:
+            results = j
+    return metadata, results
+
+
+def _decode_at(text, pos):
+    """
+    Разбирает JSON значение, начинающееся с pos, в окне, растущем вдвое.
+    Ошибка разбора в stdlib считает номер строки от начала документа,
+    поэтому целый файл передавать нельзя - это дало бы квадратичное время.
+
+    Возвращает (объект, конец) или (None, позиция ошибки)
+    """
+    window = _FIRST_WINDOW
+    while True:
+        chunk = text[pos:pos + window]
+        try:
+            block, end = _decoder.raw_decode(chunk)
+            return block, pos + end
+        except ValueError as e:
+            # Ошибка у края окна может означать, что значение просто не поместилось
+            cut_off = e.pos >= len(chunk) - 6 or e.msg.startswith('Unterminated string')
+            if not cut_off or pos + window >= len(text):
+                return None, pos + e.pos
+            window *= 2
+
+
+def locate_json_blocks(data, max_bytes=DEFAULT_SCAN_BYTES, max_seconds=DEFAULT_SCAN_SECONDS):
+    """
+    Резервный поиск JSON блоков для файлов с нераспознанным заголовком.
+
+    Кандидаты ищутся через find('{') и разбираются raw_decode в окне
+    (см. _decode_at), так что стоимость попытки зависит только от её длины.
+    После неудачной попытки поиск продолжается с места ошибки:
+    всё до него уже было разобрано как часть одного значения,
+    поэтому каждый байт разбирается не более одного раза (линейное время).
+    Короткие неудачные попытки продолжаются со следующего байта,
+    чтобы случайный '{' перед настоящим блоком не "съел" его начало.
+
+    Просматривается не больше max_bytes байт и не дольше max_seconds.
+
+    Возвращает (metadata, results, причина ошибки или None)
+    """
+    limit = min(len(data), max_bytes)
+    deadline = time.monotonic() + max_seconds
+    metadata = None
+    results = None
+
+    with memoryview(data) as view:
+        # latin-1 сохраняет соответствие символ = байт, позиции совпадают с файлом
+        text = str(view[:limit], 'latin-1')
+
+    pos = text.find('{')
+    while pos != -1 and not (metadata and results):
+        if time.monotonic() > deadline:
+            return metadata, results, 'time_exceeded'
+
+        try:
+            block, end = _decode_at(text, pos)
+        except RecursionError:
+            # Слишком глубокая вложенность - это не блок реплея.
+            # Все '{' до первой '}' вложены друг в друга, пропускаем их разом
+            close = text.find('}', pos)
+            pos = text.find('{', close) if close != -1 else -1
+            continue
+
+        if block is None:
+            resume = pos + 1 if end - pos <= _SHORT_ATTEMPT else end
+            pos = text.find('{', resume)
+            continue
+
+        # Ключи ASCII, поэтому блок можно опознать до перекодирования
+        if any(classify_block(block)):
+            block = json.loads(str(data[pos:end], 'utf-8', 'ignore'))
+            metadata, results = classify_block(block, metadata, results)
+        pos = text.find('{', end)
+
+    if metadata and results:
+        return metadata, results, None
+    if limit < len(data):
+        return metadata, results, 'budget_exceeded'
+    return metadata, results, 'not_found'
+
+
+def find_object_spans_numpy(data, max_bytes=DEFAULT_SCAN_BYTES):
+    """
+    Векторизованный поиск границ JSON объектов верхнего уровня.
+
+    За один проход numpy по байтам файла:
+    - находит кавычки и отбрасывает экранированные (нечётное число '\\' перед ними);
+    - по чётности числа кавычек отбрасывает скобки внутри строк;
+    - cumsum по +1/-1 для '{' и '}' даёт глубину вложенности;
+    - объект верхнего уровня - '{' на текущем минимуме глубины
+      и первая '}', которая возвращает глубину к этому минимуму.
+
+    Отсчёт начинается с первого '{"', чтобы мусор заголовка не сбил
+    чётность кавычек. Возвращает список (начало, конец) по возрастанию
+    """
+    limit = min(len(data), max_bytes)
+    start = data.find(b'{"', 0, limit)
+    if start == -1:
+        return []
+
+    with memoryview(data) as view:
+        arr = np.frombuffer(view[start:limit], dtype=np.uint8)
+
+        quotes = np.flatnonzero(arr == ord('"'))
+        # Кавычка после '\\' может быть экранирована - такие проверяем по одной
+        maybe_escaped = quotes[(quotes > 0) & (arr[quotes - 1] == ord('\\'))]
+        escaped = []
+        for q in maybe_escaped.tolist():
+            run = 0
+            while q - run - 1 >= 0 and arr[q - run - 1] == ord('\\'):
+                run += 1
+            if run % 2:
+                escaped.append(q)
+        if escaped:
+            quotes = np.setdiff1d(quotes, np.array(escaped, dtype=quotes.dtype), assume_unique=True)
+
+        braces = np.flatnonzero((arr == ord('{')) | (arr == ord('}')))
+        # Скобка внутри строки, если перед ней нечётное число кавычек
+        braces = braces[(np.searchsorted(quotes, braces) & 1) == 0]
+        delta = np.where(arr[braces] == ord('{'), 1, -1)
+        del arr
+
+    if not len(braces):
+        return []
+
+    depth_after = np.cumsum(delta)
+    depth_before = depth_after - delta
+    floor = np.minimum.accumulate(depth_before)
+
+    open_pos = braces[(delta == 1) & (depth_before == floor)]
+    close_pos = braces[(delta == -1) & (depth_after == floor)]
+
+    # Каждому открытию на минимуме соответствует ближайшее следующее закрытие
+    idx = np.searchsorted(close_pos, open_pos)
+    paired = idx < len(close_pos)
+    return [(start + int(s), start + int(e) + 1)
+            for s, e in zip(open_pos[paired], close_pos[idx[paired]])]
+
+
+def locate_json_blocks_numpy(data, max_bytes=DEFAULT_SCAN_BYTES, max_seconds=DEFAULT_SCAN_SECONDS):
+    """
+    Резервный поиск JSON блоков по границам из find_object_spans_numpy.
+    Просматриваемое окно удваивается, пока блоки не найдены, поэтому
+    для блоков в начале файла не приходится обрабатывать весь файл.
+    Если блоки не найдены (например, мусор между блоками сбил чётность
+    кавычек) - используется линейный поиск.
+
+    Возвращает (metadata, results, причина ошибки или None)
+    """
+    limit = min(len(data), max_bytes)
+    deadline = time.monotonic() + max_seconds
+    metadata = None
+    results = None
+    window = _FIRST_NUMPY_WINDOW
+    decoded_until = 0
+
+    while not (metadata and results) and time.monotonic() <= deadline:
+        window = min(window, limit)
+        for start, end in find_object_spans_numpy(data, window):
+            if start < decoded_until:
+                continue
+            decoded_until = end
+            try:
+                block = json.loads(str(data[start:end], 'utf-8', 'ignore'))
+            except (ValueError, RecursionError):
+                continue
+            metadata, results = classify_block(block, metadata, results)
+            if metadata and results:
+                return metadata, results, None
+        if window >= limit:
+            break
+        window *= 2
+
+    remaining = max(0.0, deadline - time.monotonic())
+    return locate_json_blocks(data, max_bytes, remaining)
+
+
+class ReplayReader:
+    """
+    Извлекает metadata и results из .mtreplay файлов.
+    Сначала читает блоки по заголовку контейнера (O(количество блоков)),
+    если заголовок не распознан - ищет JSON линейным сканером
+    с ограничением по объёму и времени.
+
+    В режиме 'prefix' с диска читаются только заголовок и JSON блоки,
+    поток пакетов (основная часть файла) не загружается.
+    В режиме 'mmap' файл отображается в память, а JSON декодируется
+    прямо из memoryview без промежуточных копий.
+
+    scan_strategy выбирает резервный поиск: 'linear' или 'numpy'.
+    read() возвращает типизированные записи ReplayMetadata и BattleResults
+    только с нужными анализаторам полями, остальное (personal, экономика,
+    достижения) сразу отбрасывается. Сырые блоки доступны через read_raw().
+    json_backend выбирает декодер JSON блоков (см. json_backends).
+    battle_filter (см. BATTLE_FILTERS) отсеивает ненужные бои по блоку
+    metadata - блок results таких реплеев не читается и не декодируется,
+    а last_error становится 'filtered'
+    """
+
+    def __init__(self, read_mode='prefix', max_scan_bytes=DEFAULT_SCAN_BYTES,
+                 max_scan_seconds=DEFAULT_SCAN_SECONDS, scan_strategy='linear',
+                 json_backend='auto', battle_filter=None):
+        if read_mode not in READ_MODES:
+            raise ValueError(f"Неизвестный режим чтения: {read_mode}")
+        if scan_strategy not in SCAN_STRATEGIES:
+            raise ValueError(f"Неизвестная стратегия поиска: {scan_strategy}")
+        if battle_filter not in BATTLE_FILTERS:
+            raise ValueError(f"Неизвестный фильтр боев: {battle_filter}")
+        if scan_strategy == 'numpy' and np is None:
+            print("⚠️ numpy не установлен, используем линейный поиск JSON блоков")
+            scan_strategy = 'linear'
+        self.read_mode = read_mode
+        self.scan_strategy = scan_strategy
+        self.json_backend, self.loads = get_json_backend(json_backend)
+        self.max_scan_bytes = max_scan_bytes
+        self.max_scan_seconds = max_scan_seconds
+        self.battle_filter = battle_filter
+
+        # Статистика последнего прочитанного файла
+        self.last_bytes_read = 0
+        self.last_file_size = 0
+        self.last_error = None  # Ключ из FAILURE_REASONS
+        self.last_header_ok = False
+
+    def options(self):
+        """Параметры, по которым можно создать такой же читатель (например, в рабочем процессе)"""
+        return {
+            'read_mode': self.read_mode,
+            'max_scan_bytes': self.max_scan_bytes,
+            'max_scan_seconds': self.max_scan_seconds,
+            'scan_strategy': self.scan_strategy,
+            'json_backend': self.json_backend,
+            'battle_filter': self.battle_filter,
+        }
+
+    def __getstate__(self):
+        # Функция loads JSON бэкенда не сериализуется - сохраняются параметры
+        return self.options()
+
+    def __setstate__(self, options):
+        self.__init__(**options)
+
+    def read(self, replay_path):
+        """
+        Возвращает (ReplayMetadata, BattleResults) или (None, None).
+        Причина неудачи - в last_error
+        """
+        metadata, results = self.read_raw(replay_path)
+        if not metadata or not results:
+            return None, None
+        return ReplayMetadata.from_json(metadata), BattleResults.from_json(results)
+
+    def read_raw(self, replay_path):
+        """Возвращает полные metadata и results без проекции"""
+        self.last_bytes_read = 0
+        self.last_file_size = 0
+        self.last_error = None
+
+        try:
+            with open(replay_path, 'rb') as f:
+                self.last_file_size = os.fstat(f.fileno()).st_size
+
+                # Пустой файл отобразить в память нельзя
+                if self.read_mode == 'mmap' and self.last_file_size > 0:
+                    return self.read_mapped(f)
+
+                if self.read_mode == 'prefix':
+                    metadata, results = self.decode_blocks(self.iter_prefix_blocks(f))
+                    if (metadata and results) or self.last_error:
+                        return metadata, results
+                    if self.last_header_ok:
+                        # Формат распознан, но результатов нет (например, игрок вышел из боя) -
+                        # сканировать файл бесполезно
+                        self.last_error = 'not_found'
+                        return None, None
+                    # Заголовок не распознан - дочитываем только то, что готовы просканировать
+                    f.seek(0)
+                    data = f.read(self.max_scan_bytes)
+                else:
+                    data = f.read()
+                self.last_bytes_read += len(data)
+        except Exception as e:
+            print(f"  ❌ Ошибка чтения файла: {e}")
+            self.last_error = 'read_error'
+            return None, None
+
+        if self.read_mode != 'prefix':
+            spans = parse_block_spans(data)
+            if spans is not None:
+                metadata, results = self.decode_blocks(data[start:end] for start, end in spans)
+                if (metadata and results) or self.last_error:
+                    return metadata, results
+                self.last_error = 'not_found'
+                return None, None
+
+        return self.scan(data, self.last_file_size)
+
+    def iter_prefix_blocks(self, f):
+        """
+        Лениво читает JSON блоки по заголовку, учитывая прочитанные байты.
+        Блок results не читается, если decode_blocks остановился на metadata.
+        last_header_ok становится True, когда заголовок и все блоки прочитаны
+        """
+        self.last_header_ok = False
+        blocks_count, bytes_read = read_header(f)
+        self.last_bytes_read += bytes_read
+        for _ in range(blocks_count or 0):
+            block, bytes_read = read_block(f, self.last_file_size - self.last_bytes_read)
+            self.last_bytes_read += bytes_read
+            if block is None:
+                return
+            yield block
+        self.last_header_ok = blocks_count is not None
+
+    def read_mapped(self, f):
+        """
+        Отображает файл в память и декодирует JSON блоки на месте.
+        Отображение закрывается сразу, поэтому память не копится
+        при обработке тысяч файлов
+        """
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            spans = parse_block_spans(mm)
+            if spans is not None:
+                # Реально затронуты только страницы заголовка и JSON блоков
+                self.last_bytes_read = spans[-1][1]
+                with memoryview(mm) as view:
+                    metadata, results = self.decode_blocks(view[start:end] for start, end in spans)
+                if (metadata and results) or self.last_error:
+                    return metadata, results
+                # Формат распознан - резервный поиск не найдет больше, чем разбор заголовка
+                self.last_error = 'not_found'
+                return None, None
+
+            self.last_bytes_read = min(len(mm), self.max_scan_bytes)
+            return self.scan(mm, len(mm))
+
+    def scan(self, data, file_size):
+        """Резервный поиск JSON блоков с учётом бюджета"""
+        locate = locate_json_blocks_numpy if self.scan_strategy == 'numpy' else locate_json_blocks
+        metadata, results, error = locate(data, self.max_scan_bytes, self.max_scan_seconds)
+
+        if error:
+            # Файл мог быть прочитан не полностью - лимит превышен, а не "не найдено"
+            if error == 'not_found' and len(data) < file_size:
+                error = 'budget_exceeded'
+            self.last_error = error
+            return None, None
+        return metadata, results
+
+    def decode_blocks(self, blocks):
+        """
+        Декодирует JSON блоки и определяет metadata и results.
+        Блок может быть bytes или memoryview - все бэкенды
+        декодируют буфер без промежуточной копии.
+        blocks может быть ленивым: если metadata отсеяна фильтром,
+        следующие блоки не запрашиваются
+        """
+        metadata = None
+        results = None
+
+        for raw in blocks:
+            try:
+                block = self.decode_block(raw)
+            except (ValueError, RecursionError):
+                continue
+            had_metadata = metadata is not None
+            metadata, results = classify_block(block, metadata, results)
+            if (not had_metadata and metadata is not None and results is None
+                    and battle_filter_rejects(self.battle_filter, metadata)):
+                self.last_error = 'filtered'
+                return None, None
+            if metadata and results:
+                break
+
+        return metadata, results
+
+    def decode_block(self, raw):
+        """
+        Декодирует один JSON блок выбранным бэкендом.
+        Быстрые бэкенды строгие к UTF-8 - при ошибке повторяем через stdlib
+        """
+        if self.json_backend != 'stdlib':
+            try:
+                return self.loads(raw)
+            except ValueError:
+                pass
+        return self.decode_block_stdlib(str(raw, 'utf-8', 'ignore'))
+
+    def decode_block_stdlib(self, text):
+        """
+        Декодирует JSON блок стандартным json.
+        Блок результатов - список [результаты, техника, фраги];
+        нужен только первый элемент, остальные не декодируются
+        """
+        if text[:1] == '[':
+            first = text.find('{')
+            if first != -1:
+                try:
+                    head, _ = _decoder.raw_decode(text, first)
+                except ValueError:
+                    head = None
+                if isinstance(head, dict) and classify_block(head)[1] is not None:
+                    return head
+        return json.loads(text)
@@ -0,0 +1,223 @@
+import sys
+import calendar
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional, Union
+
+
+def _int(value):
+    """Счётчики в реплеях иногда бывают null или строкой - приводим к int"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _str(value, default):
+    return value if isinstance(value, str) else default
+
+
+# Формат dateTime в metadata: "DD.MM.YYYY HH:MM:SS"
+BATTLE_TIME_FORMAT = '%d.%m.%Y %H:%M:%S'
+
+
+def parse_battle_time(date_time):
+    """
+    Переводит dateTime реплея в секунды (время клиента без часового пояса).
+    Нераспознанная дата дает 0 - такие бои идут первыми
+    """
+    try:
+        return calendar.timegm(datetime.strptime(date_time, BATTLE_TIME_FORMAT).timetuple())
+    except (TypeError, ValueError):
+        return 0
+
+
+class VehicleInfo(NamedTuple):
+    """Участник боя из блока metadata"""
+    name: str
+    vehicle_type: str
+    team: int
+    clan_abbrev: str
+
+    @classmethod
+    def from_json(cls, v):
+        # Ники и техника повторяются в тысячах реплеев - храним по одной копии
+        return cls(
+            name=sys.intern(_str(v.get('name'), 'Unknown')),
+            vehicle_type=sys.intern(_str(v.get('vehicleType'), 'Unknown')),
+            team=_int(v.get('team', 0)),
+            clan_abbrev=_str(v.get('clanAbbrev'), '').strip()
+        )
+
+
+class VehicleStats(NamedTuple):
+    """Итоговая статистика техники из блока results"""
+    damage: int = 0
+    health: int = 0
+    kills: int = 0
+    spotted: int = 0
+    shots: int = 0
+    hits: int = 0
+    piercings: int = 0
+    xp: int = 0
+    damage_blocked: int = 0
+    damage_received: int = 0
+    account_id: int = 0  # accountDBID - постоянный, в отличие от ника
+
+    @classmethod
+    def from_json(cls, stats):
+        return cls(
+            damage=_int(stats.get('damageDealt', 0)),
+            health=_int(stats.get('health', 0)),
+            kills=_int(stats.get('kills', 0)),
+            spotted=_int(stats.get('spotted', 0)),
+            shots=_int(stats.get('shots', 0)),
+            hits=_int(stats.get('directHits', 0)),
+            piercings=_int(stats.get('piercings', 0)),
+            xp=_int(stats.get('xp', 0)),
+            damage_blocked=_int(stats.get('damageBlockedByArmor', 0)),
+            damage_received=_int(stats.get('damageReceived', 0)),
+            account_id=_int(stats.get('accountDBID', 0))
+        )
+
+
+# Статистика игрока, которого нет в results
+EMPTY_STATS = VehicleStats()
+
+
+class ReplayMetadata(NamedTuple):
+    """Блок metadata: кто, где и когда играл"""
+    player_name: str
+    map_name: str
+    date_time: str
+    timestamp: int  # date_time в секундах, разбирается один раз при чтении
+    vehicles: Dict[str, VehicleInfo]
+
+    @classmethod
+    def from_json(cls, metadata):
+        """Проверяет и переводит сырой блок metadata в типизированную запись"""
+        vehicles = metadata.get('vehicles')
+        date_time = _str(metadata.get('dateTime'), 'Неизвестно')
+        return cls(
+            player_name=_str(metadata.get('playerName'), ''),
+            map_name=_str(metadata.get('mapDisplayName'), 'Неизвестно'),
+            date_time=date_time,
+            timestamp=parse_battle_time(date_time),
+            vehicles={
+                vid: VehicleInfo.from_json(v)
+                for vid, v in (vehicles.items() if isinstance(vehicles, dict) else ())
+                if isinstance(v, dict)
+            }
+        )
+
+    def find_player(self, player_name):
+        """Возвращает VehicleInfo игрока по имени или None"""
+        for v in self.vehicles.values():
+            if v.name == player_name:
+                return v
+        return None
+
+
+class BattleResults(NamedTuple):
+    """Блок results: исход боя и статистика техники"""
+    arena_unique_id: int  # Один и тот же у всех реплеев одного боя, 0 - неизвестен
+    winner_team: int
+    vehicles: Dict[str, VehicleStats]
+
+    @classmethod
+    def from_json(cls, results):
+        """Проверяет и переводит сырой блок results в типизированную запись"""
+        common = results.get('common')
+        vehicles = results.get('vehicles')
+        stats = {}
+        for vid, entries in (vehicles.items() if isinstance(vehicles, dict) else ()):
+            # vid -> [статистика]; в обычных боях одна запись на технику
+            if isinstance(entries, list) and entries and isinstance(entries[0], dict):
+                stats[vid] = VehicleStats.from_json(entries[0])
+
+        return cls(
+            arena_unique_id=_int(results.get('arenaUniqueID', 0)),
+            winner_team=_int(common.get('winnerTeam', 0)) if isinstance(common, dict) else 0,
+            vehicles=stats
+        )
+
+    def stats_for(self, vid):
+        """Статистика техники или нули, если её нет в результатах"""
+        return self.vehicles.get(vid, EMPTY_STATS)
+
+
+class ParsedReplay(NamedTuple):
+    """Результат разбора одного файла - компактная запись для передачи между процессами"""
+    file: str
+    metadata: Optional[ReplayMetadata]
+    results: Optional[BattleResults]
+    bytes_read: int
+    file_size: int
+    error: Optional[str]  # Ключ из FAILURE_REASONS или None
+    from_cache: bool = False  # Запись взята из ReplayCache, файл не читался
+
+
+# Значения клана соперника, когда кланов нет (см. ClanExtractor)
+NO_CLAN = ('', '?', 'Без клана')
+
+
+class BattleRecord(NamedTuple):
+    """Бой в анализаторе. Поля после file заполняет только АБС анализатор"""
+    id: Union[int, str]   # arenaUniqueID или "дата_карта"
+    date: str
+    timestamp: int        # date в секундах, по нему бои упорядочены
+    map: str
+    file: str
+    players_count: int = 0
+    is_win: bool = False
+    winner_team: int = 0
+    player_team: Optional[int] = None
+    clan: str = ''              # Клан(ы) соперника, как в ClanExtractor
+    clan_is_mixed: bool = False  # Сборная соперника из нескольких кланов
+
+    def opponent_clans(self):
+        """Кланы соперника списком (сборная - несколько)"""
+        if self.clan in NO_CLAN:
+            return []
+        return self.clan.split('/')
+
+
+class PlayerTotals(NamedTuple):
+    """Накопленные итоги игрока по всем учтенным боям"""
+    battles: int = 0
+    damage: int = 0
+    kills: int = 0
+    survived: int = 0
+    wins: int = 0
+
+    @property
+    def avg_damage(self):
+        return round(self.damage / self.battles) if self.battles else 0
+
+    @property
+    def survival_rate(self):
+        """Процент боев, в которых игрок выжил"""
+        return self.survived / self.battles * 100 if self.battles else 0
+
+    @property
+    def win_rate(self):
+        return self.wins / self.battles * 100 if self.battles else 0
+
+
+class RandomBattleStats(NamedTuple):
+    """Статистика владельца реплея в одном случайном бою"""
+    battle_id: Union[int, str]
+    date: str
+    timestamp: int
+    map: str
+    vehicle: str
+    damage: int
+    kills: int
+    spotted: int
+    shots: int
+    hits: int
+    piercings: int
+    xp: int
+    damage_blocked: int
+    damage_received: int
+    health: int
+    accuracy: float
@@ -0,0 +1,102 @@
+import time
+import pickle
+import struct
+from pathlib import Path
+
+from .replay_cache import default_cache_dir
+
+# Версия формата снимка. Увеличивается при изменении анализаторов,
+# BattleMatrix и схем в schemas.py - старые снимки тогда не открываются
+SNAPSHOT_VERSION = 5
+
+_MAGIC = b'MTABSSNP'
+# Заголовок: сигнатура, версия, количество внешних буферов
+_HEADER = struct.Struct('<8sII')
+_LENGTH = struct.Struct('<Q')
+
+
+def default_session_path():
+    """Файл последней сессии рядом с кэшем реплеев"""
+    return default_cache_dir() / 'last_session.snapshot'
+
+
+def save_snapshot(path, state):
+    """
+    Сохраняет состояние (анализаторы и все, что с ними связано) в двоичный файл.
+    pickle протокола 5 выносит массивы NumPy во внешние буферы - они пишутся
+    в файл как есть, без копирования в поток pickle.
+    Запись идет во временный файл, поэтому прерванное сохранение
+    не портит предыдущий снимок
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    buffers = []
+    payload = pickle.dumps(state, protocol=5, buffer_callback=buffers.append)
+
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, SNAPSHOT_VERSION, len(buffers)))
+        f.write(_LENGTH.pack(len(payload)))
+        f.write(payload)
+        for buffer in buffers:
+            raw = buffer.raw()
+            f.write(_LENGTH.pack(raw.nbytes))
+            f.write(raw)
+    tmp_path.replace(path)
+    print(f"💾 Сессия сохранена: {path} ({path.stat().st_size / 1024:.0f} КБ, "
+          f"{time.perf_counter() - started:.2f} с)")
+
+
+def load_snapshot(path):
+    """
+    Загружает состояние, сохраненное save_snapshot.
+    Файл читается целиком в изменяемый буфер, массивы NumPy ссылаются
+    на него без копирования. Возвращает None, если файла нет, он поврежден
+    или записан другой версией формата
+    """
+    path = Path(path)
+    started = time.perf_counter()
+    try:
+        with open(path, 'rb') as f:
+            data = bytearray(path.stat().st_size)
+            f.readinto(data)
+    except OSError as e:
+        print(f"⚠️ Не удалось прочитать сессию {path}: {e}")
+        return None
+
+    view = memoryview(data)
+    if len(data) < _HEADER.size + _LENGTH.size:
+        print(f"⚠️ Файл сессии поврежден: {path}")
+        return None
+    magic, version, n_buffers = _HEADER.unpack_from(view)
+    if magic != _MAGIC:
+        print(f"⚠️ Файл не является сохраненной сессией: {path}")
+        return None
+    if version != SNAPSHOT_VERSION:
+        print(f"♻️ Сессия сохранена другой версией программы, открыть нельзя: {path}")
+        return None
+
+    try:
+        offset = _HEADER.size
+        payload, offset = _read_chunk(view, offset)
+        buffers = []
+        for _ in range(n_buffers):
+            buffer, offset = _read_chunk(view, offset)
+            buffers.append(buffer)
+        state = pickle.loads(payload, buffers=buffers)
+    except Exception as e:
+        print(f"⚠️ Файл сессии поврежден: {path} ({e})")
+        return None
+
+    print(f"📂 Сессия загружена: {path} ({time.perf_counter() - started:.2f} с)")
+    return state
+
+
+def _read_chunk(view, offset):
+    """Блок [длина + байты] из файла снимка"""
+    (length,) = _LENGTH.unpack_from(view, offset)
+    offset += _LENGTH.size
+    if offset + length > len(view):
+        raise ValueError("файл обрезан")
+    return view[offset:offset + length], offset + length
@@ -14,24 +14,17 @@ if not metadata or not results:
     print("❌ Не удалось извлечь данные")
 else:
     # Получаем vehicles из metadata
-    vehicles_meta = metadata.get('vehicles', {})
-    
-    # Получаем статистику из results
-    vehicles_stats = results.get('vehicles', {})
+    vehicles_meta = metadata.vehicles
     
     print("\n📊 Реальное состояние игроков (по health):")
     print("-" * 60)
     
     for vid, v in vehicles_meta.items():
-        if not isinstance(v, dict):
-            continue
-        
-        player_name = v.get('name', 'Unknown')
-        team = v.get('team', '?')
+        player_name = v.name
+        team = v.team
         
         # Получаем здоровье из results
-        stats = vehicles_stats.get(vid, [{}])[0]
-        health = stats.get('health', 0)
+        health = results.stats_for(vid).health
         
         # Определяем статус по здоровью
         status = "💀 ПОГИБ" if health <= 0 else f"✅ ВЫЖИЛ ({health} HP)"
@@ -46,12 +39,8 @@ else:
     alive = 0
     
     for vid, v in vehicles_meta.items():
-        if not isinstance(v, dict):
-            continue
-        
         total += 1
-        stats = vehicles_stats.get(vid, [{}])[0]
-        health = stats.get('health', 0)
+        health = results.stats_for(vid).health
         
         if health <= 0:
             dead += 1
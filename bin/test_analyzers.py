@@ -0,0 +1,332 @@
+"""
+Проверки анализаторов на небольшом синтетическом наборе реплеев.
+
+Каждый путь обработки (плотное и разреженное хранение, добавление
+реплеев, объединение состояний, архив SQLite, битовые индексы, снимок
+сессии) должен давать ту же таблицу, что и обычный process_files.
+
+Запуск из папки bin: python -m pytest -q test_analyzers.py
+"""
+import json
+import random
+import struct
+import time
+from pathlib import Path
+
+import pytest
+
+from models import battle_matrix
+from models.analyzer import BattleMatrixAnalyzer
+from models.battle_store import BattleStore
+from models.snapshot import load_snapshot, save_snapshot
+from models.replay_reader import REPLAY_MAGIC
+
+MAPS = ('Прохоровка', 'Химмельсдорф', 'Рудники')
+TANKS = ('ussr:R45_IS-7', 'china:Ch22_113', 'france:F108_Panhard_EBR_105', 'germany:G89_Leopard1')
+
+# Игрок, сменивший ник на RENAME_DAY день
+RENAMED = 1003
+RENAME_DAY = 60
+# Бои с номером меньше этого записаны старым клиентом - без accountDBID
+NAME_ONLY_BATTLES = 10
+ABS_BATTLES = 48
+
+
+def player_name(account_id, day):
+    if account_id == RENAMED:
+        return 'Старый' if day < RENAME_DAY else 'Новый'
+    return f'Игрок{account_id - 1000:02d}'
+
+
+def write_replay(path, players, day, map_name, arena_id, winner, owner=0, with_accounts=True, seed=0):
+    """
+    Пишет .mtreplay: заголовок, блок metadata, блок results и немного потока пакетов.
+    players - список (accountDBID, клан), первая половина - команда 1
+    """
+    rnd = random.Random(seed)
+    vehicles = {}
+    stats = {}
+    half = len(players) // 2
+    for i, (account_id, clan) in enumerate(players):
+        vid = str(100 + i)
+        vehicles[vid] = {
+            'name': player_name(account_id, day),
+            'vehicleType': rnd.choice(TANKS),
+            'team': 1 if i < half else 2,
+            'clanAbbrev': clan,
+        }
+        entry = {
+            'damageDealt': rnd.randint(0, 4000),
+            'health': rnd.choice([0, 0, 350, 1200]),
+            'kills': rnd.randint(0, 3),
+            'shots': rnd.randint(1, 15),
+            'directHits': rnd.randint(0, 10),
+        }
+        if with_accounts:
+            entry['accountDBID'] = account_id
+        stats[vid] = [entry]
+
+    month, day_of_month = divmod(day, 28)
+    metadata = {
+        'clientVersionFromXml': '1.30.0',
+        'playerName': player_name(players[owner][0], day),
+        'mapDisplayName': map_name,
+        'dateTime': f'{day_of_month + 1:02d}.{month + 1:02d}.2026 '
+                    f'{rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d}',
+        'vehicles': vehicles,
+    }
+    results = {
+        'arenaUniqueID': arena_id,
+        'personal': {},
+        'common': {'winnerTeam': winner},
+        'vehicles': stats,
+    }
+    blocks = [json.dumps(metadata, ensure_ascii=False).encode(), json.dumps([results, {}, {}]).encode()]
+    data = struct.pack('<II', REPLAY_MAGIC, len(blocks))
+    for block in blocks:
+        data += struct.pack('<I', len(block)) + block
+    path.write_bytes(data + bytes(rnd.getrandbits(8) for _ in range(512)))
+
+
+@pytest.fixture(scope='module')
+def replay_files(tmp_path_factory):
+    """
+    Набор реплеев: АБС бои за несколько месяцев, часть - без accountDBID,
+    игрок со сменой ника, копии боя из реплеев сокомандников,
+    случайные бои 15×15 и нечитаемый файл. Имена файлов не совпадают
+    с порядком боев по времени
+    """
+    root = tmp_path_factory.mktemp('replays')
+    rnd = random.Random(7)
+    clans = {1000 + i: 'ALPHA' if i < 10 else rnd.choice(['4BD', 'MUCOP', 'RED', '']) for i in range(30)}
+    paths = []
+    for n in range(ABS_BATTLES):
+        day = n * 2
+        team = [1000 + i for i in rnd.sample(range(10), 7)]
+        if n % 3 == 0 and RENAMED not in team:
+            team[0] = RENAMED
+        enemies = [1000 + i for i in rnd.sample(range(10, 30), 7)]
+        players = [(account_id, clans[account_id]) for account_id in team + enemies]
+        map_name, winner = rnd.choice(MAPS), rnd.choice([1, 2])
+        with_accounts = n >= NAME_ONLY_BATTLES
+        path = root / f'{rnd.randrange(10 ** 6):06d}_{n}.mtreplay'
+        write_replay(path, players, day, map_name, 10 ** 15 + n, winner, with_accounts=with_accounts, seed=n)
+        paths.append(path)
+        if n % 10 == 5:
+            copy_path = root / f'{rnd.randrange(10 ** 6):06d}_{n}_copy.mtreplay'
+            write_replay(copy_path, players, day, map_name, 10 ** 15 + n, winner, owner=1,
+                         with_accounts=with_accounts, seed=n)
+            paths.append(copy_path)
+
+    for n in range(3):
+        path = root / f'random_{n}.mtreplay'
+        write_replay(path, [(1000 + i, '') for i in range(30)], n, MAPS[1], 2 * 10 ** 15 + n, 1, seed=100 + n)
+        paths.append(path)
+
+    broken = root / 'broken.mtreplay'
+    broken.write_bytes(b'not a replay' * 100)
+    paths.append(broken)
+    return sorted(str(path) for path in paths)
+
+
+def analyze(file_paths, **options):
+    analyzer = BattleMatrixAnalyzer(**options)
+    analyzer.process_files(file_paths)
+    return analyzer
+
+
+@pytest.fixture(scope='module')
+def reference(replay_files):
+    """Эталон - обычный process_files по всем файлам"""
+    return analyze(replay_files)
+
+
+def test_reference_corpus(reference):
+    assert len(reference.battles) == ABS_BATTLES
+    assert reference.skipped_battles == 3
+    assert reference.duplicate_battles == 5
+    assert len(reference.failed_files) == 1
+
+
+@pytest.mark.parametrize('storage', ['dense', 'sparse'])
+def test_storage_modes_match(replay_files, reference, storage):
+    analyzer = analyze(replay_files, storage=storage)
+    assert analyzer.matrix.store.kind == storage
+    assert analyzer.get_table_data() == reference.get_table_data()
+    assert analyzer.get_survival_stats() == reference.get_survival_stats()
+
+    subset = reference.battles[5:30:3]
+    assert analyzer.get_table_data(subset) == reference.get_table_data(subset)
+
+
+def test_auto_storage_switches_to_sparse(replay_files, reference, monkeypatch):
+    # Переход на разреженное хранение посреди разбора
+    monkeypatch.setattr(battle_matrix, 'SPARSE_MIN_CELLS', 0)
+    monkeypatch.setattr(battle_matrix, 'SPARSE_DENSITY', 0.5)
+    analyzer = analyze(replay_files)
+    assert analyzer.matrix.store.kind == 'sparse'
+    assert analyzer.get_table_data() == reference.get_table_data()
+
+
+def test_renamed_player_keeps_one_row_with_newest_name(reference):
+    row = reference.get_player_row('Новый')
+    assert row is not None
+    assert reference.get_player_row('Старый') == row
+    assert 'Старый' not in reference.players
+    assert reference.get_player_totals('Старый') == reference.get_player_totals('Новый')
+
+
+def test_name_only_players_are_adopted(reference):
+    # Игроки из реплеев без accountDBID не дублируются строками
+    assert len(reference.players) == 30
+    assert all(reference.matrix.player_ids)
+
+
+def test_newest_name_does_not_depend_on_order(replay_files, reference):
+    by_time = sorted(reference.battles, key=lambda battle: battle.timestamp)
+    newer = {battle.file for battle in by_time[len(by_time) // 2:]}
+    newer_files = [path for path in replay_files if Path(path).name in newer]
+    analyzer = analyze(newer_files)
+    analyzer.add_files(replay_files)
+    assert sorted(analyzer.players) == sorted(reference.players)
+    assert analyzer.get_table_data() == reference.get_table_data()
+
+
+def split_by_day(replay_files):
+    """
+    Файлы по времени боя: старые реплеи без accountDBID, бои со старым ником
+    переименованного игрока и бои с новым ником (к ним - остальные файлы)
+    """
+    early, mid, late = [], [], []
+    for path in replay_files:
+        parts = Path(path).stem.split('_')
+        n = int(parts[1]) if parts[0].isdigit() else ABS_BATTLES
+        if n < NAME_ONLY_BATTLES:
+            early.append(path)
+        elif n * 2 < RENAME_DAY:
+            mid.append(path)
+        else:
+            late.append(path)
+    return early, mid, late
+
+
+def assert_same_table(analyzer, reference):
+    assert sorted(analyzer.players) == sorted(reference.players)
+    assert analyzer.get_table_data() == reference.get_table_data()
+    assert analyzer.get_survival_stats() == reference.get_survival_stats()
+
+
+@pytest.mark.parametrize('storage', ['dense', 'sparse'])
+def test_merge_is_associative(replay_files, reference, storage):
+    # Строка 'Старый' без accountDBID и строка 'Новый' связываются только боями из mid
+    early, mid, late = split_by_day(replay_files)
+    groups = (early, late, mid)
+    left = analyze(groups[0], storage=storage).merge(analyze(groups[1], storage=storage))
+    left.merge(analyze(groups[2], storage=storage))
+    right = analyze(groups[1], storage=storage).merge(analyze(groups[2], storage=storage))
+    right = analyze(groups[0], storage=storage).merge(right)
+    single = analyze(early + late + mid, storage=storage)
+    for analyzer in (left, right, single):
+        assert_same_table(analyzer, reference)
+        assert len(analyzer.battles) == ABS_BATTLES
+        assert analyzer.duplicate_battles == reference.duplicate_battles
+    assert right.get_player_row('Старый') == right.get_player_row('Новый')
+
+
+def test_merge_with_interleaved_parts(replay_files, reference):
+    parts = [replay_files[i::3] for i in range(3)]
+    merged = analyze(parts[2]).merge(analyze(parts[0])).merge(analyze(parts[1]))
+    assert_same_table(merged, reference)
+
+
+def test_add_files_order(replay_files, reference):
+    early, mid, late = split_by_day(replay_files)
+    analyzer = analyze(late)
+    analyzer.add_files(early)
+    analyzer.add_files(mid)
+    assert_same_table(analyzer, reference)
+    assert all(analyzer.matrix.player_ids)
+
+
+def store_table(store, **filters):
+    """Таблица архива в плотном виде, как у BattleMatrixAnalyzer.get_table_data"""
+    headers, players, cells, total_battles = store.get_table_data(**filters)
+    data = [store.table_row(players, cells, i, total_battles) for i in range(len(players))]
+    return headers, data, total_battles
+
+
+def test_store_matches_analyzer(replay_files, reference, tmp_path):
+    # Старые реплеи без accountDBID и смена ника разбираются не по порядку времени
+    early, mid, late = split_by_day(replay_files)
+    store = BattleStore(tmp_path / 'archive.sqlite')
+    analyzer = analyze(late, store=store)
+    analyzer.add_files(early)
+    analyzer.add_files(mid)
+    assert store.count() == ABS_BATTLES
+    assert store_table(store) == reference.get_table_data()
+
+    map_name = reference.battles[0].map
+    battles = reference.select_battles(map=map_name)
+    assert store_table(store, map=map_name) == reference.get_table_data(battles)
+
+    # Игрок находится и по прежнему нику
+    assert store.battles(player='Старый') == store.battles(player='Новый')
+    totals = {name: (battles, damage) for name, battles, damage, *_ in store.player_totals()}
+    assert totals['Новый'] == tuple(reference.get_player_totals('Новый'))[:2]
+    store.close()
+
+
+def test_store_after_merge(replay_files, reference, tmp_path):
+    early, mid, late = split_by_day(replay_files)
+    store = BattleStore(tmp_path / 'archive.sqlite')
+    analyzer = analyze(early, store=store).merge(analyze(late)).merge(analyze(mid))
+    assert_same_table(analyzer, reference)
+    assert store_table(store) == reference.get_table_data()
+    store.close()
+
+
+def scan_battles(battles, map=None, result=None, clan=None, month=None):
+    """Фильтр перебором списка боев - эталон для битовых индексов"""
+    selected = []
+    for battle in battles:
+        if map is not None and battle.map != map:
+            continue
+        if result is not None and ('win' if battle.is_win else 'loss') != result:
+            continue
+        if clan is not None and not set(clan) & set(battle.opponent_clans()):
+            continue
+        if month is not None and time.strftime('%Y-%m', time.gmtime(battle.timestamp)) != month:
+            continue
+        selected.append(battle)
+    return selected
+
+
+@pytest.mark.parametrize('criteria', [
+    {'map': MAPS[0]},
+    {'result': 'win'},
+    {'clan': ['RED']},
+    {'month': '2026-02'},
+    {'map': MAPS[1], 'result': 'loss', 'clan': ['RED']},
+    {'map': MAPS[2], 'month': '2026-03', 'result': 'win'},
+    {'clan': ['НЕТ ТАКОГО']},
+])
+def test_bitmap_select_matches_scan(reference, criteria):
+    selected = reference.select_battles(**criteria)
+    assert [battle.id for battle in selected] == [battle.id for battle in scan_battles(reference.battles, **criteria)]
+    assert reference.get_table_data(selected) == reference.get_table_data(scan_battles(reference.battles, **criteria))
+
+
+@pytest.mark.parametrize('storage', ['dense', 'sparse'])
+def test_snapshot_round_trip(replay_files, reference, tmp_path, storage):
+    early, mid, late = split_by_day(replay_files)
+    analyzer = analyze(early + late, storage=storage)
+    save_snapshot(tmp_path / 'session.snapshot', {'abs': analyzer})
+    restored = load_snapshot(tmp_path / 'session.snapshot')['abs']
+    assert restored.get_table_data() == analyzer.get_table_data()
+    assert restored.select_battles(map=MAPS[1]) == analyzer.select_battles(map=MAPS[1])
+
+    # После загрузки добавляются только новые файлы, строки 'Старый' и 'Новый' сливаются
+    assert len(restored.add_files(replay_files)) == len(reference.battles) - len(analyzer.battles)
+    assert_same_table(restored, reference)
+    assert restored.duplicate_battles == reference.duplicate_battles
+    assert restored.select_battles(result='win', clan=['4BD']) == reference.select_battles(result='win', clan=['4BD'])
@@ -1,13 +1,77 @@
-from wotreplay import ReplayData
 from collections import Counter
 import os
 
 class ClanExtractor:
     """
-    Отдельный класс для извлечения информации о клане соперника
-    Использует wotreplay и не влияет на основной анализатор
+    Отдельный класс для извлечения информации о клане соперника.
+    Основной путь - from_metadata() по уже разобранному блоку metadata
+    (используется анализатором, повторного чтения файла нет).
+    extract_opponent_clan_info() читает реплей заново через wotreplay
     """
     
+    @staticmethod
+    def empty_result():
+        """Результат по умолчанию, когда кланы определить не удалось"""
+        return {
+            'clan_string': 'Без клана',
+            'clans_list': [],
+            'is_mixed': False,
+            'clan_stats': {},
+            'success': False
+        }
+    
+    @staticmethod
+    def summarize(players, owner_name, owner_team):
+        """
+        Собирает информацию о кланах противников
+        
+        Args:
+            players: итерируемое из (имя, команда, клан)
+            owner_name: имя владельца реплея
+            owner_team: команда владельца
+        """
+        result = ClanExtractor.empty_result()
+        
+        # Собираем кланы противников
+        clan_counter = Counter()
+        
+        for player_name, team, clan in players:
+            # Пропускаем владельца
+            if player_name == owner_name:
+                continue
+            
+            if team != owner_team and clan:  # Это противник с кланом
+                clan_counter[clan] += 1
+        
+        # Формируем результат
+        clans_list = sorted(clan_counter.keys())
+        result['clans_list'] = clans_list
+        result['clan_stats'] = dict(clan_counter)
+        result['is_mixed'] = len(clans_list) > 1
+        result['success'] = True
+        
+        if not clans_list:
+            result['clan_string'] = 'Без клана'
+        elif len(clans_list) == 1:
+            result['clan_string'] = clans_list[0]
+        else:
+            result['clan_string'] = '/'.join(clans_list)
+        
+        return result
+    
+    @staticmethod
+    def from_metadata(metadata):
+        """
+        Информация о клане соперника из ReplayMetadata.
+        Возвращает словарь того же формата, что extract_opponent_clan_info
+        """
+        owner = metadata.find_player(metadata.player_name)
+        if owner is None:
+            return ClanExtractor.empty_result()
+        
+        players = ((v.name, v.team, v.clan_abbrev) for v in metadata.vehicles.values())
+        return ClanExtractor.summarize(players, owner.name, owner.team)
+    
     @staticmethod
     def extract_opponent_clan_info(replay_path):
         """
@@ -25,15 +89,9 @@ class ClanExtractor:
                 'success': True/False
             }
         """
-        result = {
-            'clan_string': 'Без клана',
-            'clans_list': [],
-            'is_mixed': False,
-            'clan_stats': {},
-            'success': False
-        }
-        
         try:
+            from wotreplay import ReplayData
+            
             # Загружаем реплей через wotreplay
             replay = ReplayData(file_path=str(replay_path))
             
@@ -58,42 +116,18 @@ class ClanExtractor:
                     break
             
             if owner_team is None:
-                return result
-            
-            # Собираем кланы противников
-            clan_counter = Counter()
-            
-            for player_id, player_info in players_data.items():
-                player_name = player_info.get('name', '')
-                team = player_info.get('team')
-                clan = player_info.get('clanAbbrev', '').strip()
-                
-                # Пропускаем владельца
-                if player_name == owner_name:
-                    continue
-                
-                if team != owner_team and clan:  # Это противник с кланом
-                    clan_counter[clan] += 1
-            
-            # Формируем результат
-            clans_list = sorted(clan_counter.keys())
-            result['clans_list'] = clans_list
-            result['clan_stats'] = dict(clan_counter)
-            result['is_mixed'] = len(clans_list) > 1
-            result['success'] = True
+                return ClanExtractor.empty_result()
             
-            if not clans_list:
-                result['clan_string'] = 'Без клана'
-            elif len(clans_list) == 1:
-                result['clan_string'] = clans_list[0]
-            else:
-                result['clan_string'] = '/'.join(clans_list)
+            players = (
+                (player_info.get('name', ''), player_info.get('team'),
+                 player_info.get('clanAbbrev', '').strip())
+                for player_info in players_data.values()
+            )
+            return ClanExtractor.summarize(players, owner_name, owner_team)
                 
         except Exception as e:
             print(f"⚠️ Ошибка при извлечении клана: {e}")
-            result['success'] = False
-        
-        return result
+            return ClanExtractor.empty_result()
     
     @staticmethod
     def extract_clan_string(replay_path):